@@ -0,0 +1,165 @@
+"""In-process index of active rentals, kept write-through by database.py."""
+import bisect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Порядки списка аренд: "new" — новые сверху (id DESC), "due" — раньше истекающие сверху
+SORT_KEYS: Dict[str, Callable[[Dict[str, Any]], Tuple[int, ...]]] = {
+    "new": lambda r: (-int(r["id"]),),
+    "due": lambda r: (int(r["expires_at"]), int(r["id"])),
+}
+
+
+class ActiveRentalIndex:
+    """Active rentals keyed by rental id and by user_id.
+
+    Loaded once from SQLite at startup; every write in database.py that changes
+    an active rental updates the index right after its transaction commits, so
+    read-heavy screens never touch the database. Rows handed out are copies.
+    For each user and each order in SORT_KEYS a sorted list of (key, id) is
+    kept up to date with bisect, so a page is a bisect plus a slice.
+    """
+
+    def __init__(self) -> None:
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_user: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        # user_id -> порядок -> отсортированные (ключ, id)
+        self._sorted: Dict[int, Dict[str, List[Tuple[Tuple[int, ...], int]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self._by_id.clear()
+        self._by_user.clear()
+        self._sorted.clear()
+        for row in rows:
+            if int(row.get("active", 0)) != 1:
+                continue
+            row = dict(row)
+            self._by_id[int(row["id"])] = row
+            self._by_user.setdefault(int(row["user_id"]), {})[int(row["id"])] = row
+        # Списки порядков строим разом, а не вставками по одной
+        for user_id, user_rows in self._by_user.items():
+            self._sorted[user_id] = {
+                sort: sorted((key(row), rental_id) for rental_id, row in user_rows.items())
+                for sort, key in SORT_KEYS.items()
+            }
+
+    def put(self, row: Dict[str, Any]) -> None:
+        """Insert or replace a rental; inactive rows are removed instead."""
+        rental_id = int(row["id"])
+        if int(row.get("active", 0)) != 1:
+            self.remove(rental_id)
+            return
+        if rental_id in self._by_id:
+            self.remove(rental_id)
+        row = dict(row)
+        user_id = int(row["user_id"])
+        self._by_id[rental_id] = row
+        self._by_user.setdefault(user_id, {})[rental_id] = row
+        orders = self._sorted.setdefault(user_id, {sort: [] for sort in SORT_KEYS})
+        for sort, key in SORT_KEYS.items():
+            bisect.insort(orders[sort], (key(row), rental_id))
+
+    def remove(self, rental_id: int) -> None:
+        row = self._by_id.pop(int(rental_id), None)
+        if row is None:
+            return
+        user_id = int(row["user_id"])
+        user_rows = self._by_user.get(user_id)
+        if user_rows is not None:
+            user_rows.pop(int(rental_id), None)
+            if not user_rows:
+                del self._by_user[user_id]
+        orders = self._sorted.get(user_id)
+        if orders is not None:
+            for sort, key in SORT_KEYS.items():
+                keys = orders[sort]
+                pos = bisect.bisect_left(keys, (key(row), int(rental_id)))
+                if pos < len(keys) and keys[pos][1] == int(rental_id):
+                    del keys[pos]
+            if not user_rows:
+                del self._sorted[user_id]
+
+    def get(self, rental_id: int) -> Optional[Dict[str, Any]]:
+        row = self._by_id.get(int(rental_id))
+        return dict(row) if row is not None else None
+
+    def rows(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Active rentals ordered by id DESC, like the original SQL query."""
+        if user_id is None:
+            return [dict(self._by_id[k]) for k in sorted(self._by_id, reverse=True)]
+        source = self._by_user.get(int(user_id), {})
+        return [dict(source[k]) for _, k in self._sorted.get(int(user_id), {}).get("new", [])]
+
+    def page(
+        self,
+        user_id: int,
+        sort: str = "new",
+        cursor_id: Optional[int] = None,
+        direction: str = "next",
+        limit: int = 10,
+    ) -> Tuple[List[Dict[str, Any]], bool, bool]:
+        """One page of a user's rentals: (rows, has_prev, has_next).
+
+        Keyset pagination: the cursor is the id of an edge rental of the current
+        page, ``direction`` is "next" (after it), "prev" (before it) or "at"
+        (a page starting with it). The order is kept sorted by put/remove, so
+        a page costs a bisect and a slice; just its rows are copied. If the
+        cursor rental is gone, "new" still knows its place (the key is the
+        id), "due" starts from the first page.
+        """
+        source = self._by_user.get(int(user_id), {})
+        key = SORT_KEYS[sort]
+        keys = self._sorted.get(int(user_id), {}).get(sort, [])
+        start = 0
+        if cursor_id is not None:
+            cursor_row = source.get(int(cursor_id))
+            if cursor_row is not None:
+                pos = bisect.bisect_left(keys, (key(cursor_row), int(cursor_id)))
+            elif sort == "new":
+                pos = bisect.bisect_left(keys, ((-int(cursor_id),), int(cursor_id)))
+            else:
+                pos = None
+            if pos is not None:
+                if direction == "next":
+                    start = pos + 1 if cursor_row is not None else pos
+                elif direction == "prev":
+                    start = max(0, pos - limit)
+                else:
+                    start = pos
+        if start >= len(keys):
+            # Курсор был в самом конце (хвост закрыли) — показываем последнюю страницу
+            start = max(0, len(keys) - limit)
+        rows = [dict(source[rental_id]) for _, rental_id in keys[start:start + limit]]
+        return rows, start > 0, start + limit < len(keys)
+
+    def by_user(self) -> Dict[int, List[Dict[str, Any]]]:
+        """All active rentals grouped by user_id (users ascending, rentals id DESC)."""
+        return {
+            user_id: [dict(rows[k]) for k in sorted(rows, reverse=True)]
+            for user_id, rows in sorted(self._by_user.items())
+        }
+
+    def diff(self, db_rows: Iterable[Dict[str, Any]]) -> List[str]:
+        """Describe every mismatch between the index and rows read from SQLite."""
+        problems: List[str] = []
+        expected = {int(r["id"]): dict(r) for r in db_rows}
+        for rental_id in sorted(expected.keys() - self._by_id.keys()):
+            problems.append(f"rental {rental_id}: missing from index")
+        for rental_id in sorted(self._by_id.keys() - expected.keys()):
+            problems.append(f"rental {rental_id}: in index but not active in database")
+        for rental_id in sorted(expected.keys() & self._by_id.keys()):
+            if expected[rental_id] != self._by_id[rental_id]:
+                problems.append(f"rental {rental_id}: index {self._by_id[rental_id]!r} != database {expected[rental_id]!r}")
+        for user_id, user_rows in self._by_user.items():
+            for rental_id, row in user_rows.items():
+                if self._by_id.get(rental_id) is not row:
+                    problems.append(f"rental {rental_id}: stale entry under user {user_id}")
+        for user_id in sorted(self._by_user.keys() | self._sorted.keys()):
+            user_rows = self._by_user.get(user_id, {})
+            for sort, key in SORT_KEYS.items():
+                expected_keys = sorted((key(row), rental_id) for rental_id, row in user_rows.items())
+                if self._sorted.get(user_id, {}).get(sort) != expected_keys:
+                    problems.append(f"user {user_id}: {sort!r} order out of sync")
+        return problems
@@ -2,6 +2,7 @@
 from aiogram import Dispatcher
 
 from handlers import register_fsm_handlers, register_command_handlers, register_callback_handlers
+from update_gate import install_update_gate
 
 
 def register_handlers(dp: Dispatcher, scheduler) -> None:
@@ -19,4 +20,9 @@ def register_handlers(dp: Dispatcher, scheduler) -> None:
     register_callback_handlers(router)
     
     # Включаем роутер в диспетчер
-    dp.include_router(router)
\ No newline at end of file
+    dp.include_router(router)
+    # Планировщик доступен хэндлерам как аргумент `scheduler`
+    dp["scheduler"] = scheduler
+
+    # Апдейты разных чатов обрабатываются параллельно, одного чата — по очереди
+    install_update_gate(dp)
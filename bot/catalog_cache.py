@@ -0,0 +1,81 @@
+"""In-process cache of the tools catalog with exact and normalized name lookup."""
+from typing import Any, Dict, Iterable, List, Optional
+
+from catalog_search import CatalogSearchIndex
+
+
+def normalize_tool_name(name: str) -> str:
+    """Case-, whitespace- and ё-insensitive key: "  Перфоратор  BOSCH " -> "перфоратор bosch"."""
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+
+class CatalogCache:
+    """Tools keyed by id, exact name and normalized name.
+
+    Loaded once at startup; database.py updates single rows after each write
+    and reloads it wholesale after a CSV import. Rows handed out are copies.
+    """
+
+    def __init__(self) -> None:
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_name: Dict[str, int] = {}
+        # Несколько позиций могут совпасть после нормализации — храним все id
+        self._by_norm: Dict[str, Dict[int, None]] = {}
+        self._search = CatalogSearchIndex()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self._by_id.clear()
+        self._by_name.clear()
+        self._by_norm.clear()
+        for row in rows:
+            self._put(row)
+        self._search.load((tool_id, row["name"]) for tool_id, row in self._by_id.items())
+
+    def put(self, row: Dict[str, Any]) -> None:
+        self._put(row)
+        self._search.add(int(row["id"]), row["name"])
+
+    def _put(self, row: Dict[str, Any]) -> None:
+        tool_id = int(row["id"])
+        self.remove(tool_id)
+        row = dict(row)
+        self._by_id[tool_id] = row
+        self._by_name[row["name"]] = tool_id
+        self._by_norm.setdefault(normalize_tool_name(row["name"]), {})[tool_id] = None
+
+    def remove(self, tool_id: int) -> None:
+        row = self._by_id.pop(int(tool_id), None)
+        if row is None:
+            return
+        self._search.remove(int(tool_id))
+        if self._by_name.get(row["name"]) == int(tool_id):
+            del self._by_name[row["name"]]
+        key = normalize_tool_name(row["name"])
+        ids = self._by_norm.get(key)
+        if ids is not None:
+            ids.pop(int(tool_id), None)
+            if not ids:
+                del self._by_norm[key]
+
+    def get(self, tool_id: int) -> Optional[Dict[str, Any]]:
+        row = self._by_id.get(int(tool_id))
+        return dict(row) if row is not None else None
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        tool_id = self._by_name.get(name)
+        return self.get(tool_id) if tool_id is not None else None
+
+    def find(self, name: str) -> Optional[Dict[str, Any]]:
+        """Exact match first, then normalized; ties go to the oldest tool."""
+        row = self.get_by_name(name)
+        if row is not None:
+            return row
+        ids = self._by_norm.get(normalize_tool_name(name))
+        return self.get(min(ids)) if ids else None
+
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Ranked fuzzy/prefix candidates for ``query`` (see catalog_search.py)."""
+        return [self.get(tool_id) for tool_id, _ in self._search.search(query, limit=limit)]
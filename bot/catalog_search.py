@@ -0,0 +1,238 @@
+"""Fuzzy/prefix search over tool names.
+
+Two levels: query words are matched against the vocabulary of distinct words
+in the catalog with a trigram index (vocabulary is far smaller than the
+catalog), and each vocabulary word keeps a bitmap of the tools containing it.
+Candidates are then produced by AND-ing bitmaps, best word combination first,
+so a lookup never walks the whole catalog. Bits are dense slots, not tool ids:
+ids only grow (AUTOINCREMENT), slots of removed tools are reused, so bitmaps
+stay as long as the catalog.
+"""
+import bisect
+import heapq
+import math
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Кириллицу приводим к латинице, чтобы «перфоратор бош» находил «Перфоратор Bosch»
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+_EMPTY: FrozenSet[str] = frozenset()
+
+WORD_MIN_SIMILARITY = 0.3
+MAX_QUERY_WORDS = 6
+MAX_VARIANTS_PER_WORD = 8
+MAX_COMBINATIONS = 256
+
+
+def search_key(text: str) -> List[str]:
+    """Lowercased, transliterated, de-duplicated words with punctuation stripped."""
+    text = text.casefold().translate(_TRANSLIT_TABLE)
+    cleaned = "".join(ch if ch.isalnum() else " " for ch in text)
+    return list(dict.fromkeys(cleaned.split()))
+
+
+def trigrams(word: str) -> Set[str]:
+    # Как в pg_trgm: слово дополняется двумя пробелами слева и одним справа,
+    # поэтому первые буквы слова дают «префиксные» триграммы
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _iter_bits(bitmap: int) -> Iterator[int]:
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+class CatalogSearchIndex:
+    """Ranked fuzzy/prefix lookup of item ids by name."""
+
+    def __init__(self) -> None:
+        self._item_words: Dict[int, List[str]] = {}
+        self._slots: Dict[int, int] = {}  # id позиции -> номер бита
+        self._ids: List[Optional[int]] = []  # номер бита -> id позиции (None — свободен)
+        self._free: List[int] = []  # свободные биты, куча: занимаем младшие первыми
+        self._word_items: Dict[str, int] = {}  # слово -> битовая карта позиций
+        self._gram_words: Dict[str, Set[str]] = {}  # триграмма -> слова словаря
+        self._vocab: List[str] = []  # отсортированный словарь для поиска по префиксу
+        self._all = 0
+
+    def __len__(self) -> int:
+        return len(self._item_words)
+
+    def clear(self) -> None:
+        self._item_words.clear()
+        self._slots.clear()
+        self._ids.clear()
+        self._free.clear()
+        self._word_items.clear()
+        self._gram_words.clear()
+        self._vocab.clear()
+        self._all = 0
+
+    def load(self, items: Iterable[Tuple[int, str]]) -> None:
+        """Bulk build; much cheaper than calling add() per item."""
+        self.clear()
+        word_slots: Dict[str, List[int]] = {}
+        # Биты по возрастанию id: при равном сходстве порядок выдачи — по id
+        for item_id, text in sorted(items):
+            if item_id in self._slots:
+                continue
+            slot = self._slots[item_id] = len(self._ids)
+            self._ids.append(item_id)
+            words = search_key(text)
+            self._item_words[item_id] = words
+            for word in words:
+                word_slots.setdefault(word, []).append(slot)
+        if not self._ids:
+            return
+        size = len(self._ids) // 8 + 1
+        for word, slots in word_slots.items():
+            self._word_items[word] = self._bitmap(slots, size)
+            self._index_word(word)
+        self._vocab = sorted(word_slots)
+        self._all = self._bitmap(range(len(self._ids)), size)
+
+    @staticmethod
+    def _bitmap(slots: Iterable[int], size: int) -> int:
+        buf = bytearray(size)
+        for slot in slots:
+            buf[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(buf, "little")
+
+    def _index_word(self, word: str) -> None:
+        for gram in trigrams(word):
+            self._gram_words.setdefault(gram, set()).add(word)
+
+    def add(self, item_id: int, text: str) -> None:
+        self.remove(item_id)
+        if self._free:
+            slot = heapq.heappop(self._free)
+            self._ids[slot] = item_id
+        else:
+            slot = len(self._ids)
+            self._ids.append(item_id)
+        self._slots[item_id] = slot
+        bit = 1 << slot
+        words = search_key(text)
+        self._item_words[item_id] = words
+        for word in words:
+            if word not in self._word_items:
+                self._word_items[word] = 0
+                self._index_word(word)
+                bisect.insort(self._vocab, word)
+            self._word_items[word] |= bit
+        self._all |= bit
+
+    def remove(self, item_id: int) -> None:
+        words = self._item_words.pop(item_id, None)
+        if words is None:
+            return
+        slot = self._slots.pop(item_id)
+        self._ids[slot] = None
+        heapq.heappush(self._free, slot)
+        mask = ~(1 << slot)
+        self._all &= mask
+        for word in words:
+            bitmap = self._word_items[word] & mask
+            if bitmap:
+                self._word_items[word] = bitmap
+                continue
+            del self._word_items[word]
+            del self._vocab[bisect.bisect_left(self._vocab, word)]
+            for gram in trigrams(word):
+                vocab = self._gram_words.get(gram)
+                if vocab is not None:
+                    vocab.discard(word)
+                    if not vocab:
+                        del self._gram_words[gram]
+
+    def _prefix_words(self, query_word: str) -> List[str]:
+        start = bisect.bisect_left(self._vocab, query_word)
+        words: List[str] = []
+        for word in self._vocab[start:start + MAX_VARIANTS_PER_WORD]:
+            if not word.startswith(query_word):
+                break
+            words.append(word)
+        return words
+
+    def _match_word(self, query_word: str) -> List[Tuple[float, str]]:
+        """Vocabulary words similar to ``query_word``: 1.0 for a prefix match, else trigram Jaccard."""
+        prefixed = self._prefix_words(query_word)
+        matches: List[Tuple[float, str]] = [(1.0, word) for word in prefixed]
+        # Числа (артикулы, размеры) сравниваем только по префиксу: «похожие» числа бессмысленны
+        if not query_word.isdigit() and len(matches) < MAX_VARIANTS_PER_WORD:
+            query_grams = trigrams(query_word)
+            # Для порога сходства нужно не меньше ceil(min * |q|) общих триграмм;
+            # по принципу Дирихле такое слово есть хотя бы в одном из
+            # (|q| - need + 1) самых редких списков
+            need = math.ceil(WORD_MIN_SIMILARITY * len(query_grams))
+            postings = sorted((self._gram_words.get(g, _EMPTY) for g in query_grams), key=len)
+            fuzzy: List[Tuple[float, str]] = []
+            for word in set().union(*postings[:len(query_grams) - need + 1]).difference(prefixed):
+                word_grams = trigrams(word)
+                common = len(query_grams & word_grams)
+                score = common / (len(query_grams) + len(word_grams) - common)
+                if score >= WORD_MIN_SIMILARITY:
+                    fuzzy.append((score, word))
+            fuzzy.sort(key=lambda m: (-m[0], m[1]))
+            matches.extend(fuzzy[:MAX_VARIANTS_PER_WORD - len(matches)])
+        return matches
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.4) -> List[Tuple[int, float]]:
+        """Return up to ``limit`` (id, score) pairs, best first.
+
+        Score is the mean over query words of the best similarity to any word
+        of the name, so an item missing one of the words can still rank.
+        """
+        words = search_key(query)[:MAX_QUERY_WORDS]
+        if not words or not self._all:
+            return []
+        # Для каждого слова запроса: варианты (сходство, битовая карта) по убыванию,
+        # последним — «слово не найдено» со всеми позициями
+        options: List[List[Tuple[float, int]]] = []
+        for word in words:
+            variants = [(score, self._word_items[w]) for score, w in self._match_word(word)]
+            variants.append((0.0, self._all))
+            options.append(variants)
+
+        def total(combo: Tuple[int, ...]) -> float:
+            return sum(options[i][j][0] for i, j in enumerate(combo)) / len(words)
+
+        # Перебор комбинаций вариантов в порядке убывания суммарного сходства
+        start = (0,) * len(words)
+        heap = [(-total(start), start)]
+        visited = {start}
+        result: List[Tuple[int, float]] = []
+        seen = 0
+        popped = 0
+        while heap and len(result) < limit and popped < MAX_COMBINATIONS:
+            neg_score, combo = heapq.heappop(heap)
+            popped += 1
+            score = -neg_score
+            if score < min_score:
+                break
+            bitmap = self._all & ~seen
+            for i, j in enumerate(combo):
+                bitmap &= options[i][j][1]
+                if not bitmap:
+                    break
+            seen |= bitmap
+            for slot in _iter_bits(bitmap):
+                result.append((self._ids[slot], score))
+                if len(result) >= limit:
+                    break
+            for i in range(len(combo)):
+                if combo[i] + 1 < len(options[i]):
+                    nxt = combo[:i] + (combo[i] + 1,) + combo[i + 1:]
+                    if nxt not in visited:
+                        visited.add(nxt)
+                        heapq.heappush(heap, (-total(nxt), nxt))
+        return result
@@ -1,202 +1,631 @@
 import asyncio
+import json
 import logging
 import os
 import sqlite3
-from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from active_index import SORT_KEYS, ActiveRentalIndex
+from catalog_cache import CatalogCache
+from db_pool import ConnectionPool
+from report_schedule import DEFAULT_REPORT_MINUTE, ReportSchedule
 
 # DB path inside container volume
 DB_DIR = Path("/app/data")
 DB_PATH = DB_DIR / "rentals.db"
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Отчёты пользователей с одинаковым временем размазываются по этому окну
+REPORT_WINDOW_MINUTES = int(os.getenv("REPORT_WINDOW_MINUTES", "60"))
+# Кэшируемые таблицы и их ключ в change_log
+_CACHED_TABLES = {"rentals": "id", "tools": "id", "report_prefs": "user_id"}
+# Больше изменений за раз — дешевле перечитать кэши целиком
+SYNC_MAX_CHANGES = 5000
+CHANGE_LOG_KEEP_SEC = 24 * 3600
+# Срок аренды по умолчанию (создание, продление)
+RENTAL_DURATION_SEC = 24 * 3600
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+_pool: Optional[ConnectionPool] = None
+_active = ActiveRentalIndex()
+_catalog = CatalogCache()
+_reports = ReportSchedule(REPORT_WINDOW_MINUTES * 60)
+# data_version на момент последней загрузки кэшей (см. sync_external_changes)
+_data_version: Optional[int] = None
+# Последняя применённая запись change_log
+_change_seq = 0
+_external_change_listeners: List[Callable[[], None]] = []
+
 
 def _dict_factory(cursor: sqlite3.Cursor, row: Tuple[Any, ...]) -> Dict[str, Any]:
     return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
 
-async def init_db() -> None:
-    DB_DIR.mkdir(parents=True, exist_ok=True)
-    loop = asyncio.get_running_loop()
+def _get_pool() -> ConnectionPool:
+    # Пул открывает только init_db: после close_db (выключение, reset_database)
+    # запоздавший вызов не должен тихо открыть файл заново
+    if _pool is None or not _pool.is_open:
+        raise RuntimeError("Database is closed; call init_db() first")
+    return _pool
+
+
+def _open_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None or _pool.path != DB_PATH:
+        _pool = ConnectionPool(DB_PATH, readers=DB_READERS, row_factory=_dict_factory)
+    if not _pool.is_open:
+        DB_DIR.mkdir(parents=True, exist_ok=True)
+        _pool.open()
+    return _pool
+
 
-    def _init() -> None:
-        conn = sqlite3.connect(DB_PATH)
+async def _read(fn: Callable[[sqlite3.Connection], T]) -> T:
+    return await _get_pool().read(fn)
+
+
+async def _write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    return await _get_pool().write(fn)
+
+
+async def init_db() -> None:
+    def _init(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rentals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tool_name TEXT NOT NULL,
+                rent_price INTEGER NOT NULL,
+                start_time INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                active INTEGER NOT NULL DEFAULT 1,
+                deposit INTEGER DEFAULT 0,
+                payment_method TEXT DEFAULT 'cash',
+                delivery_type TEXT DEFAULT 'pickup',
+                address TEXT DEFAULT '',
+                expires_at INTEGER,
+                notified_expires_at INTEGER
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_rentals_active ON rentals(active);
+            """
+        )
+        # Миграция: добавляем новые поля если их нет
         try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN deposit INTEGER DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN payment_method TEXT DEFAULT 'cash'")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN delivery_type TEXT DEFAULT 'pickup'")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN address TEXT DEFAULT ''")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        # Срок окончания хранится явно: его ведут create/renew/reset, по нему
+        # работают планировщик и /due. notified_expires_at — срок, о котором уже уведомили
+        try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN expires_at INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        try:
+            conn.execute("ALTER TABLE rentals ADD COLUMN notified_expires_at INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        # Идемпотентно: дозаполняет строки без срока, если прошлый запуск прервался
+        conn.execute(
+            "UPDATE rentals SET expires_at = start_time + ? WHERE expires_at IS NULL", (RENTAL_DURATION_SEC,)
+        )
+        _migrate_expirations_table(conn)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rentals_expires_at ON rentals(expires_at) WHERE active = 1"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rentals_user_expires_at ON rentals(user_id, expires_at) WHERE active = 1"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tools (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                price INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS revenues (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                rental_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                UNIQUE(date, rental_id)
+            );
+            """
+        )
+        # Дневная сводка выручки по пользователям, ведётся add_revenue в той же транзакции
+        has_rollup = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'revenue_daily'"
+        ).fetchone()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS revenue_daily (
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                amount INTEGER NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, date)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_revenue_daily_date ON revenue_daily(date)")
+        if not has_rollup:
+            _backfill_revenue_daily(conn)
+        # Неотправленные сообщения, ждущие повторной попытки; next_attempt_at IS NULL — попытки исчерпаны
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                reply_markup TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                rental_ids TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at INTEGER,
+                last_error TEXT,
+                created_at INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox(next_attempt_at) WHERE next_attempt_at IS NOT NULL"
+        )
+        # Время ежедневного отчёта (минута суток, локальное время); строка есть у каждого пользователя с арендами
+        has_report_prefs = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'report_prefs'"
+        ).fetchone()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS report_prefs (
+                user_id INTEGER PRIMARY KEY,
+                report_minute INTEGER NOT NULL
+            );
+            """
+        )
+        if not has_report_prefs:
             conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS rentals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tool_name TEXT NOT NULL,
-                    rent_price INTEGER NOT NULL,
-                    start_time INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    active INTEGER NOT NULL DEFAULT 1,
-                    deposit INTEGER DEFAULT 0,
-                    payment_method TEXT DEFAULT 'cash',
-                    delivery_type TEXT DEFAULT 'pickup',
-                    address TEXT DEFAULT ''
-                );
-                """
-            )
-            conn.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_rentals_active ON rentals(active);
-                """
-            )
-            # Миграция: добавляем новые поля если их нет
-            try:
-                conn.execute("ALTER TABLE rentals ADD COLUMN deposit INTEGER DEFAULT 0")
-            except sqlite3.OperationalError:
-                pass  # Колонка уже существует
-            try:
-                conn.execute("ALTER TABLE rentals ADD COLUMN payment_method TEXT DEFAULT 'cash'")
-            except sqlite3.OperationalError:
-                pass  # Колонка уже существует
-            try:
-                conn.execute("ALTER TABLE rentals ADD COLUMN delivery_type TEXT DEFAULT 'pickup'")
-            except sqlite3.OperationalError:
-                pass  # Колонка уже существует
-            try:
-                conn.execute("ALTER TABLE rentals ADD COLUMN address TEXT DEFAULT ''")
-            except sqlite3.OperationalError:
-                pass  # Колонка уже существует
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS tools (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    price INTEGER NOT NULL
-                );
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS revenues (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
-                    rental_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    created_at INTEGER NOT NULL,
-                    UNIQUE(date, rental_id)
-                );
-                """
+                "INSERT OR IGNORE INTO report_prefs(user_id, report_minute) SELECT DISTINCT user_id, ? FROM rentals",
+                (DEFAULT_REPORT_MINUTE,),
             )
-            conn.commit()
-        finally:
-            conn.close()
+        # Аренда лидерства: задачи планировщика выполняет только одна реплика
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leader_lease (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+        # Небольшое состояние планировщика, которое должно пережить перезапуск
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        # Состояния FSM (незавершённые диалоги), пишет fsm_storage.SQLiteStorage
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated_at ON fsm_state(updated_at)")
+        # Журнал изменений кэшируемых таблиц: по нему реплики подтягивают чужие записи
+        # точечно (см. sync_external_changes). Ведут его триггеры, так что ни одна
+        # запись не пройдёт мимо. AUTOINCREMENT — номера идут подряд и не переиспользуются
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tbl TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_at ON change_log(at)")
+        for table, key in _CACHED_TABLES.items():
+            for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                conn.execute(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_log AFTER {event} ON {table}
+                    BEGIN INSERT INTO change_log(tbl, row_id) VALUES ('{table}', {ref}.{key}); END
+                    """
+                )
 
-    await loop.run_in_executor(None, _init)
+    await asyncio.get_running_loop().run_in_executor(None, _open_pool)
+    await _write(_init)
     logger.info("Database initialized at %s", DB_PATH)
+    await _load_caches()
 
 
-@asynccontextmanager
-async def _connect() -> Any:
-    loop = asyncio.get_running_loop()
-    def _open():
-        c = sqlite3.connect(DB_PATH, check_same_thread=False)
-        c.row_factory = _dict_factory
-        return c
-    conn = await loop.run_in_executor(None, _open)
+async def _load_caches() -> None:
+    global _data_version, _change_seq
+    _data_version = await _get_pool().data_version()
+
+    def _snapshot(conn: sqlite3.Connection) -> Tuple[int, List[Dict[str, Any]], List[Dict[str, Any]], List[Tuple[int, int]]]:
+        return _last_change_seq(conn), _select_active_rentals(conn), _select_tools(conn), _select_report_prefs(conn)
+
+    # Снимок берём на соединении писателя (см. sync_external_changes): курсор и
+    # данные согласованы, а локальная запись не может оказаться старше снимка
+    _change_seq, active, tools, prefs = await _write(_snapshot)
+    _active.load(active)
+    _catalog.load(tools)
+    _reports.load(prefs)
+    logger.info("Caches loaded: %s active rentals, %s tools, %s report users", len(_active), len(_catalog), len(_reports))
+
+
+def _last_change_seq(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return int(row["seq"]) if row else 0
+
+
+def _read_changes(conn: sqlite3.Connection, since: int) -> Tuple[int, Optional[Dict[str, Dict[int, Any]]]]:
+    """Current rows of everything changed after ``since``: (last seq, {table: {key: row or None}}).
+
+    None instead of the rows means "reload everything": too many changes, or
+    part of the journal was pruned or the database recreated.
+    """
+    last = _last_change_seq(conn)
+    if last < since or last - since > SYNC_MAX_CHANGES:
+        return last, None
+    changes = conn.execute(
+        "SELECT tbl, row_id FROM change_log WHERE seq > ? AND seq <= ?", (since, last)
+    ).fetchall()
+    if len(changes) != last - since:
+        return last, None
+    keys: Dict[str, Dict[int, None]] = {table: {} for table in _CACHED_TABLES}
+    for change in changes:
+        keys[change["tbl"]][int(change["row_id"])] = None
+    result: Dict[str, Dict[int, Any]] = {}
+    for table, key in _CACHED_TABLES.items():
+        found = {}
+        if keys[table]:
+            cur = conn.execute(
+                f"SELECT * FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(keys[table])),),
+            )
+            found = {int(row[key]): row for row in cur.fetchall()}
+        result[table] = {k: found.get(k) for k in keys[table]}
+    return last, result
+
+
+async def sync_external_changes() -> bool:
+    """Apply writes made by another process (replica) to the in-memory caches.
+
+    Only rows listed in change_log after our cursor are re-read and patched
+    into the caches; a full reload happens only if the journal cannot cover
+    the gap (see _read_changes). Caches of every replica therefore lag other
+    replicas' writes by at most the interval between calls: the leader
+    heartbeat, LEADER_LEASE_SEC / 3 (10 s by default). Returns True if
+    anything changed. With a single bot process this is one cheap PRAGMA.
+    """
+    global _data_version, _change_seq
+    version = await _get_pool().data_version()
+    if version == _data_version:
+        return False
+    # Строки читаем на соединении писателя, а не читателя: снимок читателя мог
+    # быть взят до локальной записи, которая уже обновила кэш, и put() откатил
+    # бы её. Писатель один, поэтому снимок не старше ни одной записи, чей
+    # результат уже в кэше, а более поздние записи применятся после нас.
+    last, changes = await _write(lambda conn: _read_changes(conn, _change_seq))
+    if changes is None:
+        logger.info("Database changed by another process, reloading caches")
+        await _load_caches()
+    else:
+        _data_version = version
+        for rental_id, row in changes["rentals"].items():
+            if row is None:
+                _active.remove(rental_id)
+            else:
+                _active.put(row)
+        for tool_id, row in changes["tools"].items():
+            if row is None:
+                _catalog.remove(tool_id)
+            else:
+                _catalog.put(row)
+        for user_id, row in changes["report_prefs"].items():
+            if row is None:
+                _reports.remove(user_id)
+            else:
+                _reports.set(user_id, int(row["report_minute"]))
+        _change_seq = max(_change_seq, last)
+        logger.debug("Applied %s changes from another process", sum(len(c) for c in changes.values()))
+    for listener in _external_change_listeners:
+        listener()
+    return True
+
+
+async def prune_change_log(keep_sec: int = CHANGE_LOG_KEEP_SEC) -> int:
+    """Delete journal entries older than ``keep_sec``; a replica behind them reloads in full."""
+    import time
+    cutoff = int(time.time()) - keep_sec
+
+    def _exec(conn: sqlite3.Connection) -> int:
+        return conn.execute("DELETE FROM change_log WHERE at < ?", (cutoff,)).rowcount
+
+    return await _write(_exec)
+
+
+def on_external_change(listener: Callable[[], None]) -> None:
+    """Call ``listener`` whenever sync_external_changes() finds writes from another process."""
+    _external_change_listeners.append(listener)
+
+
+async def ping_db() -> bool:
+    """Cheap liveness check for health endpoints."""
     try:
-        yield conn
-    finally:
-        await loop.run_in_executor(None, conn.close)
+        return await _read(lambda conn: conn.execute("SELECT 1 AS ok").fetchone()["ok"] == 1)
+    except Exception:
+        logger.exception("Database ping failed")
+        return False
+
+
+def _select_active_rentals(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    return list(conn.execute("SELECT * FROM rentals WHERE active = 1 ORDER BY id DESC").fetchall())
+
+
+def _select_tools(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    return list(conn.execute("SELECT * FROM tools").fetchall())
+
+
+def _select_report_prefs(conn: sqlite3.Connection) -> List[Tuple[int, int]]:
+    return [(r["user_id"], r["report_minute"]) for r in conn.execute("SELECT * FROM report_prefs").fetchall()]
+
+
+async def _query_active_rentals() -> List[Dict[str, Any]]:
+    return await _read(_select_active_rentals)
+
+
+async def load_active_index() -> None:
+    """(Re)load the in-memory index of active rentals from SQLite."""
+    _active.load(await _query_active_rentals())
+    logger.info("Active rental index loaded: %s rentals", len(_active))
+
+
+async def load_report_schedule() -> None:
+    """(Re)load per-user report slots from SQLite."""
+    _reports.load(await _read(_select_report_prefs))
+    logger.info("Report schedule loaded: %s users, %s min window", len(_reports), REPORT_WINDOW_MINUTES)
+
+
+async def verify_active_index() -> List[str]:
+    """Diff the in-memory index against SQLite; an empty list means coherent."""
+    return _active.diff(await _query_active_rentals())
+
+
+def _migrate_expirations_table(conn: sqlite3.Connection) -> None:
+    """Carry over notification state from the old expirations table and drop it.
+
+    That table held one row per rental whose expiration notice was still
+    pending; a rental without a row had already been notified.
+    """
+    has_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'expirations'"
+    ).fetchone()
+    if not has_table:
+        return
+    conn.execute(
+        """
+        UPDATE rentals SET notified_expires_at = expires_at
+        WHERE active = 1 AND id NOT IN (SELECT rental_id FROM expirations)
+        """
+    )
+    conn.execute("DROP TABLE expirations")
+
+
+def _backfill_revenue_daily(conn: sqlite3.Connection) -> None:
+    """Rebuild revenue_daily from revenues (one-off migration for existing databases)."""
+    conn.execute("DELETE FROM revenue_daily")
+    cur = conn.execute(
+        """
+        INSERT INTO revenue_daily(user_id, date, amount, count)
+        SELECT t.user_id, r.date, SUM(r.amount), COUNT(*)
+        FROM revenues r
+        JOIN rentals t ON t.id = r.rental_id
+        GROUP BY t.user_id, r.date
+        """
+    )
+    logger.info("revenue_daily backfilled: %s rows", cur.rowcount)
+
+
+def _insert_revenue(conn: sqlite3.Connection, date: str, rental_id: int, amount: int,
+                    created_at: int, user_id: Optional[int] = None) -> None:
+    """Record revenue once per (date, rental) and bump the revenue_daily rollup."""
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO revenues(date, rental_id, amount, created_at) VALUES (?, ?, ?, ?)",
+        (date, rental_id, amount, created_at),
+    )
+    if cur.rowcount != 1:
+        return  # Уже начислено за эту дату
+    if user_id is None:
+        row = conn.execute("SELECT user_id FROM rentals WHERE id = ?", (rental_id,)).fetchone()
+        if row is None:
+            return
+        user_id = int(row["user_id"])
+    conn.execute(
+        """
+        INSERT INTO revenue_daily(user_id, date, amount, count) VALUES (?, ?, ?, 1)
+        ON CONFLICT(user_id, date) DO UPDATE SET amount = amount + excluded.amount, count = count + 1
+        """,
+        (user_id, date, amount),
+    )
+
+
+async def close_db() -> None:
+    """Close pooled connections; called once on bot shutdown."""
+    if _pool is None or not _pool.is_open:
+        return
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _pool.close)
 
 
 async def add_rental(tool_name: str, rent_price: int, user_id: int, deposit: int = 0, 
                     payment_method: str = 'cash', delivery_type: str = 'pickup', address: str = '') -> int:
+    row = await create_rental(tool_name, rent_price, user_id, deposit, payment_method, delivery_type, address)
+    return int(row["id"])
+
+
+async def create_rental(tool_name: str, rent_price: int, user_id: int, deposit: int = 0,
+                        payment_method: str = 'cash', delivery_type: str = 'pickup', address: str = '',
+                        charge_date: Optional[str] = None,
+                        duration_sec: int = RENTAL_DURATION_SEC) -> Dict[str, Any]:
+    """Insert a rental and, if ``charge_date`` is given, its revenue in one transaction.
+
+    The rental expires ``duration_sec`` after now. Returns the full inserted row.
+    """
     import time
     start_ts = int(time.time())
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> int:
-            cur = conn.execute(
-                "INSERT INTO rentals(tool_name, rent_price, start_time, user_id, active, deposit, payment_method, delivery_type, address) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)",
-                (tool_name, rent_price, start_ts, user_id, deposit, payment_method, delivery_type, address),
+
+    def _exec(conn: sqlite3.Connection) -> Dict[str, Any]:
+        row = conn.execute(
+            "INSERT INTO rentals(tool_name, rent_price, start_time, expires_at, user_id, active, deposit, payment_method, delivery_type, address) VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?) RETURNING *",
+            (tool_name, rent_price, start_ts, start_ts + duration_sec, user_id, deposit, payment_method, delivery_type, address),
+        ).fetchone()
+        if charge_date is not None:
+            _insert_revenue(conn, charge_date, int(row["id"]), rent_price, start_ts, user_id=user_id)
+        if user_id not in _reports:
+            conn.execute(
+                "INSERT OR IGNORE INTO report_prefs(user_id, report_minute) VALUES (?, ?)",
+                (user_id, DEFAULT_REPORT_MINUTE),
             )
-            conn.commit()
-            return int(cur.lastrowid)
+        return row
 
-        rental_id = await loop.run_in_executor(None, _exec)
-        logger.info("Rental added: id=%s, tool=%s, price=%s, user=%s, deposit=%s, payment=%s, delivery=%s", 
-                   rental_id, tool_name, rent_price, user_id, deposit, payment_method, delivery_type)
-        return rental_id
+    row = await _write(_exec)
+    _active.put(row)
+    if user_id not in _reports:
+        _reports.set(user_id, DEFAULT_REPORT_MINUTE)
+    logger.info("Rental added: id=%s, tool=%s, price=%s, user=%s, deposit=%s, payment=%s, delivery=%s", 
+               row["id"], tool_name, rent_price, user_id, deposit, payment_method, delivery_type)
+    return row
 
 
 async def get_active_rentals(user_id: Optional[int] = None) -> List[Dict[str, Any]]:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> List[Dict[str, Any]]:
-            if user_id is None:
-                cur = conn.execute("SELECT * FROM rentals WHERE active = 1 ORDER BY id DESC")
-            else:
-                cur = conn.execute(
-                    "SELECT * FROM rentals WHERE active = 1 AND user_id = ? ORDER BY id DESC",
-                    (user_id,),
-                )
-            return list(cur.fetchall())
+    # Отдаём из индекса в памяти (см. active_index.py), SQLite не трогаем
+    return _active.rows(user_id)
+
+
+RENTALS_PAGE_SIZE = 10
+
 
-        rows = await loop.run_in_executor(None, _query)
-        return rows
+@dataclass
+class RentalsPage:
+    items: List[Dict[str, Any]]
+    has_prev: bool
+    has_next: bool
+    sort: str
+
+
+async def active_rentals_page(user_id: int, sort: str = "new", cursor_id: Optional[int] = None,
+                              direction: str = "next", limit: int = RENTALS_PAGE_SIZE) -> RentalsPage:
+    """One page of the user's active rentals, see ActiveRentalIndex.page.
+
+    ``sort`` is "new" (newest first) or "due" (expiring first); unknown values
+    fall back to "new".
+    """
+    if sort not in SORT_KEYS:
+        sort = "new"
+    items, has_prev, has_next = _active.page(user_id, sort, cursor_id, direction, limit)
+    return RentalsPage(items=items, has_prev=has_prev, has_next=has_next, sort=sort)
+
+
+async def active_rentals_by_user() -> Dict[int, List[Dict[str, Any]]]:
+    """Active rentals grouped per user in one pass over the in-memory index."""
+    return _active.by_user()
 
 
 async def close_rental(rental_id: int) -> None:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute("UPDATE rentals SET active = 0 WHERE id = ?", (rental_id,))
-            conn.commit()
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE rentals SET active = 0 WHERE id = ?", (rental_id,))
 
-        await loop.run_in_executor(None, _exec)
-        logger.info("Rental closed: id=%s", rental_id)
+    await _write(_exec)
+    _active.remove(rental_id)
+    logger.info("Rental closed: id=%s", rental_id)
 
 
 async def renew_rental(rental_id: int) -> None:
-    """Extend rental by +24h from the later of (now, current expiry).
+    """Extend rental by +24h from the later of (now, current expiry)."""
+    await renew_and_charge_rental(rental_id)
 
-    We store start_time as (expiry - 24h). On renewal we compute:
-      old_expiry = start_time + 24h
-      new_expiry = max(now, old_expiry) + 24h
-      new_start_time = new_expiry - 24h
-    """
-    import time
-    loop = asyncio.get_running_loop()
 
-    async with _connect() as conn:
-        def _exec() -> None:
-            cur = conn.execute("SELECT start_time FROM rentals WHERE id = ?", (rental_id,))
-            row = cur.fetchone()
-            if not row:
-                return
-            start_time = int(row["start_time"])  # type: ignore[index]
-            day = 24 * 3600
-            now_sec = int(time.time())
-            old_expiry = start_time + day
-            base = now_sec if now_sec > old_expiry else old_expiry
-            new_expiry = base + day
-            new_start = new_expiry - day
-            conn.execute(
-                "UPDATE rentals SET start_time = ?, active = 1 WHERE id = ?",
-                (new_start, rental_id),
-            )
-            conn.commit()
+async def renew_and_charge_rental(rental_id: int, charge_date: Optional[str] = None,
+                                  duration_sec: int = RENTAL_DURATION_SEC) -> Optional[Dict[str, Any]]:
+    """Extend rental by ``duration_sec`` and optionally book its price as revenue, atomically.
+
+    The new period starts at the later of (now, current expiry):
+      start_time = max(now, expires_at)
+      expires_at = max(now, expires_at) + duration_sec
 
-        await loop.run_in_executor(None, _exec)
-        logger.info("Rental renewed (+24h from existing): id=%s", rental_id)
+    If ``charge_date`` is given, rent_price is recorded as revenue for that date
+    in the same transaction. Returns the updated row, or None if the rental
+    does not exist.
+    """
+    import time
+    now_sec = int(time.time())
+
+    def _exec(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            """
+            UPDATE rentals SET start_time = MAX(?, expires_at), expires_at = MAX(?, expires_at) + ?, active = 1
+            WHERE id = ? RETURNING *
+            """,
+            (now_sec, now_sec, duration_sec, rental_id),
+        ).fetchone()
+        if row and charge_date is not None:
+            _insert_revenue(conn, charge_date, rental_id, int(row["rent_price"]), now_sec, user_id=int(row["user_id"]))
+        return row
+
+    row = await _write(_exec)
+    if row:
+        _active.put(row)
+        logger.info("Rental renewed (+%ss from existing): id=%s, charged=%s", duration_sec, rental_id, charge_date is not None)
+    return row
 
 
 async def get_rental_by_id(rental_id: int) -> Optional[Dict[str, Any]]:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> Optional[Dict[str, Any]]:
-            cur = conn.execute("SELECT * FROM rentals WHERE id = ?", (rental_id,))
-            row = cur.fetchone()
-            return row
+    row = _active.get(rental_id)
+    if row is not None:
+        return row
+
+    def _query(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        cur = conn.execute("SELECT * FROM rentals WHERE id = ?", (rental_id,))
+        row = cur.fetchone()
+        return row
 
-        return await loop.run_in_executor(None, _query)
+    return await _read(_query)
 
 
 async def all_active_for_reschedule() -> List[Dict[str, Any]]:
@@ -206,106 +635,236 @@ async def all_active_for_reschedule() -> List[Dict[str, Any]]:
 
 async def add_revenue(date: str, rental_id: int, amount: int) -> None:
     ts = int(datetime.utcnow().timestamp())
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute(
-                "INSERT OR IGNORE INTO revenues(date, rental_id, amount, created_at) VALUES (?, ?, ?, ?)",
-                (date, rental_id, amount, ts),
-            )
-            conn.commit()
 
-        await loop.run_in_executor(None, _exec)
+    def _exec(conn: sqlite3.Connection) -> None:
+        _insert_revenue(conn, date, rental_id, amount, ts)
+
+    await _write(_exec)
 
 
 async def sum_revenue_by_date(date: str) -> int:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> int:
-            cur = conn.execute("SELECT COALESCE(SUM(amount), 0) as s FROM revenues WHERE date = ?", (date,))
-            row = cur.fetchone()
-            return int(row["s"]) if row and row["s"] is not None else 0
+    def _query(conn: sqlite3.Connection) -> int:
+        cur = conn.execute("SELECT COALESCE(SUM(amount), 0) as s FROM revenue_daily WHERE date = ?", (date,))
+        row = cur.fetchone()
+        return int(row["s"]) if row and row["s"] is not None else 0
 
-        return await loop.run_in_executor(None, _query)
+    return await _read(_query)
 
 # --- Catalog (tools) ---
 
+async def load_catalog_cache() -> None:
+    """(Re)load the in-memory catalog cache from SQLite."""
+    _catalog.load(await _read(_select_tools))
+    logger.info("Catalog cache loaded: %s tools", len(_catalog))
+
+
 async def upsert_tool(name: str, price: int) -> None:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute(
-                "INSERT INTO tools(name, price) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET price=excluded.price",
-                (name, price),
-            )
-            conn.commit()
+    def _exec(conn: sqlite3.Connection) -> Dict[str, Any]:
+        return conn.execute(
+            "INSERT INTO tools(name, price) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET price=excluded.price RETURNING *",
+            (name, price),
+        ).fetchone()
 
-        await loop.run_in_executor(None, _exec)
+    _catalog.put(await _write(_exec))
 
 
 async def get_tool_by_name(name: str) -> Optional[Dict[str, Any]]:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> Optional[Dict[str, Any]]:
-            cur = conn.execute("SELECT * FROM tools WHERE name = ?", (name,))
-            return cur.fetchone()
+    return _catalog.get_by_name(name)
+
+
+async def find_tool_by_name(name: str) -> Optional[Dict[str, Any]]:
+    """Exact name match, falling back to a case/whitespace-insensitive one."""
+    return _catalog.find(name)
 
-        return await loop.run_in_executor(None, _query)
+
+async def search_tools(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """Fuzzy/prefix catalog search, best candidates first."""
+    return _catalog.search(query, limit=limit)
 
 
 async def list_tools(limit: int = 50) -> List[Dict[str, Any]]:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> List[Dict[str, Any]]:
-            cur = conn.execute("SELECT * FROM tools ORDER BY name ASC LIMIT ?", (limit,))
-            return list(cur.fetchall())
+    def _query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute("SELECT * FROM tools ORDER BY name ASC LIMIT ?", (limit,))
+        return list(cur.fetchall())
+
+    return await _read(_query)
+
+
+TOOLS_PAGE_SIZE = 20
+
+
+@dataclass
+class ToolsPage:
+    items: List[Dict[str, Any]]
+    has_prev: bool
+    has_next: bool
 
-        return await loop.run_in_executor(None, _query)
 
+async def list_tools_page(after_id: Optional[int] = None, before_id: Optional[int] = None,
+                          limit: int = TOOLS_PAGE_SIZE) -> ToolsPage:
+    """One catalog page ordered by (name, id), using keyset pagination.
 
-async def import_catalog_from_csv(csv_path: str) -> int:
+    The cursor is a tool id (it fits into callback_data, a name may not); its
+    (name, id) key is resolved inside the query, so only the page itself is
+    read via the UNIQUE(name) index. A cursor whose tool has been deleted
+    falls back to the first page.
+    """
+    def _query(conn: sqlite3.Connection) -> ToolsPage:
+        if before_id is not None:
+            rows = conn.execute(
+                """
+                SELECT * FROM tools
+                WHERE (name, id) < (SELECT name, id FROM tools WHERE id = ?)
+                ORDER BY name DESC, id DESC LIMIT ?
+                """,
+                (before_id, limit + 1),
+            ).fetchall()
+            if rows:
+                has_prev = len(rows) > limit
+                return ToolsPage(items=list(reversed(rows[:limit])), has_prev=has_prev, has_next=True)
+        elif after_id is not None:
+            rows = conn.execute(
+                """
+                SELECT * FROM tools
+                WHERE (name, id) > (SELECT name, id FROM tools WHERE id = ?)
+                ORDER BY name ASC, id ASC LIMIT ?
+                """,
+                (after_id, limit + 1),
+            ).fetchall()
+            if rows:
+                return ToolsPage(items=list(rows[:limit]), has_prev=True, has_next=len(rows) > limit)
+        rows = conn.execute("SELECT * FROM tools ORDER BY name ASC, id ASC LIMIT ?", (limit + 1,)).fetchall()
+        return ToolsPage(items=list(rows[:limit]), has_prev=False, has_next=len(rows) > limit)
+
+    return await _read(_query)
+
+
+IMPORT_CHUNK_SIZE = 1000
+
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def accepted(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+
+def _iter_catalog_csv(f: Any, result: ImportResult) -> Iterator[Tuple[str, int]]:
     import csv
-    loop = asyncio.get_running_loop()
+    header_checked = False
+    for line_no, row in enumerate(csv.reader(f), start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        name = str(row[0]).strip()
+        try:
+            price = int(str(row[1]).strip()) if len(row) >= 2 else 0
+        except ValueError:
+            price = None
+        first_row, header_checked = not header_checked, True
+        if price is None and first_row:
+            continue  # Строка заголовка «Название,Цена»
+        if not name or price is None or price <= 0:
+            result.rejected += 1
+            if result.rejected <= 10:
+                logger.warning("Catalog CSV row %s rejected: %r", line_no, row)
+            continue
+        yield name, price
+
+
+async def import_catalog_from_csv(csv_path: str) -> ImportResult:
+    """Bulk upsert of a catalog CSV in a single transaction.
+
+    Rows are streamed into a temp staging table in chunks via executemany, then
+    merged into ``tools`` with set-based statements. Duplicate names within the
+    file keep the last price, as before.
+    """
+    import time
+    started = time.monotonic()
+    result = ImportResult()
+
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS catalog_import (seq INTEGER PRIMARY KEY, name TEXT NOT NULL, price INTEGER NOT NULL)"
+        )
+        conn.execute("DELETE FROM catalog_import")
+        try:
+            with open(csv_path, newline='', encoding='utf-8') as f:
+                rows = _iter_catalog_csv(f, result)
+                while True:
+                    chunk = list(islice(rows, IMPORT_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    conn.executemany("INSERT INTO catalog_import(name, price) VALUES (?, ?)", chunk)
+            # Последнее вхождение имени в файле побеждает
+            conn.execute(
+                "DELETE FROM catalog_import WHERE seq NOT IN (SELECT MAX(seq) FROM catalog_import GROUP BY name)"
+            )
+            row = conn.execute(
+                """
+                SELECT
+                    COALESCE(SUM(t.id IS NULL), 0) AS inserted,
+                    COALESCE(SUM(t.id IS NOT NULL AND t.price != i.price), 0) AS updated,
+                    COALESCE(SUM(t.id IS NOT NULL AND t.price = i.price), 0) AS unchanged
+                FROM catalog_import i
+                LEFT JOIN tools t ON t.name = i.name
+                """
+            ).fetchone()
+            result.inserted, result.updated, result.unchanged = int(row["inserted"]), int(row["updated"]), int(row["unchanged"])
+            conn.execute(
+                """
+                INSERT INTO tools(name, price)
+                SELECT name, price FROM catalog_import WHERE true
+                ON CONFLICT(name) DO UPDATE SET price = excluded.price WHERE tools.price != excluded.price
+                """
+            )
+        finally:
+            conn.execute("DELETE FROM catalog_import")
 
-    def _read_rows() -> List[tuple[str, int]]:
-        rows: List[tuple[str, int]] = []
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if not row or len(row) < 2:
-                    continue
-                name = str(row[0]).strip()
-                try:
-                    price = int(str(row[1]).strip())
-                except ValueError:
-                    continue
-                if name and price > 0:
-                    rows.append((name, price))
-        return rows
-
-    rows = await loop.run_in_executor(None, _read_rows)
-    count = 0
-    for name, price in rows:
-        await upsert_tool(name, price)
-        count += 1
-    logger.info("Catalog imported: %s items from %s", count, csv_path)
-    return count
+    await _write(_exec)
+    if result.inserted or result.updated:
+        await load_catalog_cache()
+    result.elapsed = time.monotonic() - started
+    logger.info(
+        "Catalog imported from %s: inserted=%s updated=%s unchanged=%s rejected=%s in %.2fs",
+        csv_path, result.inserted, result.updated, result.unchanged, result.rejected, result.elapsed,
+    )
+    return result
 
 
 async def reset_database() -> None:
-    """Remove SQLite file and recreate schema."""
+    """Remove SQLite file and recreate schema.
+
+    While the file is being replaced every other database call raises
+    (the pool stays closed until init_db reopens it).
+    """
     loop = asyncio.get_running_loop()
+    # Пул держит файл открытым — закрываем его перед удалением
+    await close_db()
+
     def _remove_db() -> None:
         try:
-            if DB_PATH.exists():
-                DB_PATH.unlink()
+            for path in (DB_PATH, Path(f"{DB_PATH}-wal"), Path(f"{DB_PATH}-shm")):
+                if path.exists():
+                    path.unlink()
         except Exception as e:
             # If file is locked or cannot be removed, fallback to wiping tables
             conn = sqlite3.connect(DB_PATH, check_same_thread=False)
             try:
                 conn.execute("DELETE FROM rentals;")
                 conn.execute("DELETE FROM revenues;")
+                conn.execute("DELETE FROM revenue_daily;")
+                conn.execute("DELETE FROM outbox;")
+                conn.execute("DELETE FROM report_prefs;")
+                conn.execute("DELETE FROM scheduler_state;")
+                conn.execute("DELETE FROM fsm_state;")
                 conn.execute("DELETE FROM tools;")
+                conn.execute("DELETE FROM change_log;")
                 conn.commit()
             finally:
                 conn.close()
@@ -316,75 +875,371 @@ async def reset_database() -> None:
 
 
 async def get_tool_by_id(tool_id: int) -> Optional[Dict[str, Any]]:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> Optional[Dict[str, Any]]:
-            cur = conn.execute("SELECT * FROM tools WHERE id = ?", (tool_id,))
-            return cur.fetchone()
-
-        return await loop.run_in_executor(None, _query)
+    return _catalog.get(tool_id)
 
 
 async def update_tool_name(tool_id: int, new_name: str) -> None:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute("UPDATE tools SET name = ? WHERE id = ?", (new_name, tool_id))
-            conn.commit()
+    def _exec(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        return conn.execute("UPDATE tools SET name = ? WHERE id = ? RETURNING *", (new_name, tool_id)).fetchone()
 
-        await loop.run_in_executor(None, _exec)
+    row = await _write(_exec)
+    if row:
+        _catalog.put(row)
 
 
 async def update_tool_price(tool_id: int, new_price: int) -> None:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute("UPDATE tools SET price = ? WHERE id = ?", (new_price, tool_id))
-            conn.commit()
+    def _exec(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        return conn.execute("UPDATE tools SET price = ? WHERE id = ? RETURNING *", (new_price, tool_id)).fetchone()
 
-        await loop.run_in_executor(None, _exec)
+    row = await _write(_exec)
+    if row:
+        _catalog.put(row)
 
 
 async def delete_tool(tool_id: int) -> None:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute("DELETE FROM tools WHERE id = ?", (tool_id,))
-            conn.commit()
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM tools WHERE id = ?", (tool_id,))
 
-        await loop.run_in_executor(None, _exec)
+    await _write(_exec)
+    _catalog.remove(tool_id)
 
 
 async def reset_rental_start_now(rental_id: int) -> None:
-    """Force start_time to now (useful to sync timer to 24:00)."""
+    """Restart the rental period from now (useful to sync timer to 24:00)."""
     import time
     new_start = int(time.time())
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _exec() -> None:
-            conn.execute("UPDATE rentals SET start_time = ?, active = 1 WHERE id = ?", (new_start, rental_id))
-            conn.commit()
 
-        await loop.run_in_executor(None, _exec)
-        logger.info("Rental start_time reset to now: id=%s", rental_id)
+    def _exec(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        return conn.execute(
+            "UPDATE rentals SET start_time = ?, expires_at = ?, active = 1 WHERE id = ? RETURNING *",
+            (new_start, new_start + RENTAL_DURATION_SEC, rental_id),
+        ).fetchone()
+
+    row = await _write(_exec)
+    if row:
+        _active.put(row)
+    logger.info("Rental start_time reset to now: id=%s", rental_id)
 
 
 async def sum_revenue_by_date_for_user(date: str, user_id: int) -> int:
-    loop = asyncio.get_running_loop()
-    async with _connect() as conn:
-        def _query() -> int:
+    def _query(conn: sqlite3.Connection) -> int:
+        # Точечное чтение по первичному ключу сводки revenue_daily
+        cur = conn.execute(
+            "SELECT amount FROM revenue_daily WHERE user_id = ? AND date = ?",
+            (user_id, date),
+        )
+        row = cur.fetchone()
+        return int(row["amount"]) if row and row["amount"] is not None else 0
+
+    return await _read(_query)
+
+
+async def revenue_by_user_for_date(date: str, user_ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+    """Revenue per user for one date in a single query; all users unless ``user_ids`` is given."""
+    def _query(conn: sqlite3.Connection) -> Dict[int, int]:
+        if user_ids is None:
+            cur = conn.execute("SELECT user_id, amount FROM revenue_daily WHERE date = ?", (date,))
+        else:
+            # Точечные чтения по первичному ключу (user_id, date)
             cur = conn.execute(
+                "SELECT user_id, amount FROM revenue_daily WHERE date = ? AND user_id IN (SELECT value FROM json_each(?))",
+                (date, json.dumps([int(u) for u in user_ids])),
+            )
+        return {int(r["user_id"]): int(r["amount"]) for r in cur.fetchall()}
+
+    return await _read(_query)
+
+
+async def revenue_by_period_for_user(user_id: int, date_from: str, date_to: str,
+                                     by_month: bool = False) -> List[Dict[str, Any]]:
+    """Revenue per day (or per month) in [date_from, date_to] with one grouped query.
+
+    Reads a contiguous range of the revenue_daily primary key, so the cost
+    depends on the length of the period, not on the size of history.
+    """
+    period = "substr(date, 1, 7)" if by_month else "date"
+
+    def _query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute(
+            f"""
+            SELECT {period} AS period, SUM(amount) AS amount, SUM(count) AS count
+            FROM revenue_daily
+            WHERE user_id = ? AND date BETWEEN ? AND ?
+            GROUP BY period
+            ORDER BY period
+            """,
+            (user_id, date_from, date_to),
+        )
+        return list(cur.fetchall())
+
+    return await _read(_query)
+
+
+# --- Expiration deadlines (rentals.expires_at) ---
+
+# Истечение ждёт уведомления, пока о текущем сроке ещё не сообщали
+_PENDING_EXPIRATION = "active = 1 AND notified_expires_at IS NOT expires_at"
+
+
+async def expirations_due_before(ts: int) -> List[Dict[str, Any]]:
+    """Active rentals whose deadline is not later than ``ts`` and not yet notified, soonest first."""
+    # Без статистики планировщик выбирает idx_rentals_active и читает все активные аренды
+    def _query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute(
+            f"""
+            SELECT id, user_id, tool_name, expires_at FROM rentals INDEXED BY idx_rentals_expires_at
+            WHERE expires_at <= ? AND {_PENDING_EXPIRATION}
+            ORDER BY expires_at
+            """,
+            (ts,),
+        )
+        return list(cur.fetchall())
+
+    return await _read(_query)
+
+
+async def expirations_for(rental_ids: Iterable[int]) -> Dict[int, int]:
+    """Pending deadlines of the given rentals; the database is authoritative across replicas."""
+    ids = json.dumps([int(i) for i in rental_ids])
+
+    def _query(conn: sqlite3.Connection) -> Dict[int, int]:
+        cur = conn.execute(
+            f"SELECT id, expires_at FROM rentals WHERE id IN (SELECT value FROM json_each(?)) AND {_PENDING_EXPIRATION}",
+            (ids,),
+        )
+        return {int(r["id"]): int(r["expires_at"]) for r in cur.fetchall()}
+
+    return await _read(_query)
+
+
+async def mark_expirations_notified(rental_ids: Iterable[int], due_before: int) -> None:
+    """Record that the current deadlines (not later than ``due_before``) of these rentals were notified.
+
+    A rental renewed in the meantime has a later deadline and stays pending.
+    """
+    ids = json.dumps([int(i) for i in rental_ids])
+
+    def _exec(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute(
+            """
+            UPDATE rentals SET notified_expires_at = expires_at
+            WHERE id IN (SELECT value FROM json_each(?)) AND expires_at <= ?
+            RETURNING *
+            """,
+            (ids, due_before),
+        )
+        return list(cur.fetchall())
+
+    if ids != "[]":
+        for row in await _write(_exec):
+            _active.put(row)
+
+
+async def count_expirations() -> int:
+    def _query(conn: sqlite3.Connection) -> int:
+        return int(conn.execute(f"SELECT COUNT(*) AS c FROM rentals WHERE {_PENDING_EXPIRATION}").fetchone()["c"])
+
+    return await _read(_query)
+
+
+async def rentals_due_before(user_id: int, ts: int) -> List[Dict[str, Any]]:
+    """Active rentals of ``user_id`` expiring not later than ``ts`` (overdue included), soonest first."""
+    def _query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute(
+            "SELECT * FROM rentals WHERE user_id = ? AND active = 1 AND expires_at <= ? ORDER BY expires_at, id",
+            (user_id, ts),
+        )
+        return list(cur.fetchall())
+
+    return await _read(_query)
+
+
+# --- Outbox of failed deliveries ---
+
+async def add_outbox_message(
+    chat_id: int,
+    text: str,
+    next_attempt_at: int,
+    reply_markup: Optional[str] = None,
+    priority: int = 0,
+    rental_ids: Optional[str] = None,
+    last_error: Optional[str] = None,
+) -> int:
+    """Persist a message whose delivery failed; ``reply_markup`` is the markup as JSON."""
+    import time
+
+    def _exec(conn: sqlite3.Connection) -> int:
+        cur = conn.execute(
+            """
+            INSERT INTO outbox(chat_id, text, reply_markup, priority, rental_ids, attempts, next_attempt_at, last_error, created_at)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+            """,
+            (chat_id, text, reply_markup, priority, rental_ids, next_attempt_at, last_error, int(time.time())),
+        )
+        return int(cur.lastrowid)
+
+    return await _write(_exec)
+
+
+async def outbox_due(ts: int, limit: int = 50) -> List[Dict[str, Any]]:
+    def _query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        cur = conn.execute(
+            """
+            SELECT * FROM outbox
+            WHERE next_attempt_at IS NOT NULL AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+            """,
+            (ts, limit),
+        )
+        return list(cur.fetchall())
+
+    return await _read(_query)
+
+
+async def finish_outbox_attempts(delivered: Iterable[int], failed: Iterable[Tuple[int, Optional[int], str]]) -> None:
+    """Record one retry round: drop ``delivered`` ids; for ``failed`` (id, next_attempt_at, error) bump attempts."""
+    delivered = [(int(i),) for i in delivered]
+    failed = [(next_at, error, int(i)) for i, next_at, error in failed]
+
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.executemany("DELETE FROM outbox WHERE id = ?", delivered)
+        conn.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            failed,
+        )
+
+    if delivered or failed:
+        await _write(_exec)
+
+
+async def count_outbox() -> Dict[str, int]:
+    def _query(conn: sqlite3.Connection) -> Dict[str, int]:
+        row = conn.execute(
+            "SELECT COUNT(next_attempt_at) AS pending, COUNT(*) - COUNT(next_attempt_at) AS dead FROM outbox"
+        ).fetchone()
+        return {"pending": int(row["pending"]), "dead": int(row["dead"])}
+
+    return await _read(_query)
+
+
+# --- Daily report schedule ---
+
+async def get_report_minute(user_id: int) -> int:
+    minute = _reports.minute(user_id)
+    return DEFAULT_REPORT_MINUTE if minute is None else minute
+
+
+async def set_report_minute(user_id: int, minute: int) -> int:
+    """Store the preferred report time (minute of the local day); returns the user's actual slot."""
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            INSERT INTO report_prefs(user_id, report_minute) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET report_minute = excluded.report_minute
+            """,
+            (user_id, minute),
+        )
+
+    await _write(_exec)
+    _reports.set(user_id, minute)
+    return _reports.slot(user_id)
+
+
+async def report_users_due(start: int, end: int) -> List[int]:
+    """Users whose report slot (second of the local day) falls in ``[start, end)``."""
+    return _reports.due(start, end)
+
+
+async def get_scheduler_state(key: str) -> Optional[str]:
+    def _query(conn: sqlite3.Connection) -> Optional[str]:
+        row = conn.execute("SELECT value FROM scheduler_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    return await _read(_query)
+
+
+async def set_scheduler_state(key: str, value: str) -> None:
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT INTO scheduler_state(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    await _write(_exec)
+
+
+# --- Leader lease (several bot replicas on one database) ---
+
+async def acquire_leader_lease(name: str, holder: str, ttl: float) -> bool:
+    """Take or renew the lease ``name`` for ``ttl`` seconds; True if ``holder`` owns it now."""
+    import time
+
+    def _exec(conn: sqlite3.Connection) -> bool:
+        now = time.time()
+        conn.execute(
+            """
+            INSERT INTO leader_lease(name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leader_lease.holder = excluded.holder OR leader_lease.expires_at < ?
+            """,
+            (name, holder, now + ttl, now),
+        )
+        row = conn.execute("SELECT holder FROM leader_lease WHERE name = ?", (name,)).fetchone()
+        return row is not None and row["holder"] == holder
+
+    return await _write(_exec)
+
+
+async def release_leader_lease(name: str, holder: str) -> None:
+    def _exec(conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM leader_lease WHERE name = ? AND holder = ?", (name, holder))
+
+    await _write(_exec)
+
+
+# --- FSM storage ---
+
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str, int]]:
+    """(state, data JSON, updated_at) for ``key``, or None."""
+    def _query(conn: sqlite3.Connection) -> Optional[Tuple[Optional[str], str, int]]:
+        row = conn.execute("SELECT state, data, updated_at FROM fsm_state WHERE key = ?", (key,)).fetchone()
+        return (row["state"], row["data"], row["updated_at"]) if row else None
+
+    return await _read(_query)
+
+
+async def save_fsm_records(rows: Iterable[Tuple[str, Optional[str], str, int]]) -> None:
+    """Write a batch of (key, state, data JSON, updated_at) in one transaction.
+
+    A record without state and with empty data is deleted instead of stored.
+    """
+    upserts = []
+    deletes = []
+    for key, state, data, updated_at in rows:
+        if state is None and data == "{}":
+            deletes.append((key,))
+        else:
+            upserts.append((key, state, data, updated_at))
+
+    def _exec(conn: sqlite3.Connection) -> None:
+        if upserts:
+            conn.executemany(
                 """
-                SELECT COALESCE(SUM(r.amount), 0) as s
-                FROM revenues r
-                JOIN rentals t ON t.id = r.rental_id
-                WHERE r.date = ? AND t.user_id = ?
+                INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
                 """,
-                (date, user_id),
+                upserts,
             )
-            row = cur.fetchone()
-            return int(row["s"]) if row and row["s"] is not None else 0
+        if deletes:
+            conn.executemany("DELETE FROM fsm_state WHERE key = ?", deletes)
+
+    await _write(_exec)
 
-        return await loop.run_in_executor(None, _query)
 
+async def delete_stale_fsm_records(updated_before: int) -> int:
+    def _exec(conn: sqlite3.Connection) -> int:
+        return conn.execute("DELETE FROM fsm_state WHERE updated_at < ?", (updated_before,)).rowcount
 
+    return await _write(_exec)
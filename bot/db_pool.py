@@ -0,0 +1,142 @@
+"""Long-lived SQLite connections: one writer thread and a small pool of readers."""
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Применяются к каждому соединению; journal_mode=WAL хранится в самом файле БД
+# и выставляется один раз соединением писателя.
+PRAGMAS = (
+    ("busy_timeout", 5000),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -16000),  # ~16 МБ страничного кэша на соединение
+    ("mmap_size", 128 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+
+
+class ConnectionPool:
+    """Keeps SQLite connections open for the lifetime of the bot.
+
+    All writes go through a single dedicated thread, so they are serialized
+    without waiting on SQLite locks; each write callable runs inside its own
+    ``BEGIN IMMEDIATE ... COMMIT`` transaction. Reads run on a small thread
+    pool, each thread holding its own connection; in WAL mode they never block
+    the writer.
+    """
+
+    def __init__(self, path: Path, readers: int = 4, row_factory: Optional[Callable[..., Any]] = None) -> None:
+        self.path = path
+        self.readers = readers
+        self.row_factory = row_factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._reader: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    def open(self) -> None:
+        if self._writer is not None:
+            return
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._reader = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+        # Соединение писателя создаём сразу: оно переводит файл в WAL до первых чтений
+        self._writer.submit(self._writer_connection).result()
+        logger.info("SQLite pool opened: %s (1 writer, %s readers)", self.path, self.readers)
+
+    def close(self) -> None:
+        if self._writer is None:
+            return
+        writer, reader = self._writer, self._reader
+        self._writer = self._reader = None
+        try:
+            writer.submit(lambda: self._connection().execute("PRAGMA optimize")).result()
+        except Exception:
+            logger.exception("PRAGMA optimize failed")
+        writer.shutdown(wait=True)
+        if reader is not None:
+            reader.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                logger.exception("Failed to close SQLite connection")
+        self._local = threading.local()
+        logger.info("SQLite pool closed: %s", self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакциями управляем сами (см. _run_write)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            for name, value in PRAGMAS:
+                conn.execute(f"PRAGMA {name}={value}")
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _run_write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _run_read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        return fn(self._connection())
+
+    async def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run ``fn(conn)`` in one transaction on the writer thread."""
+        if self._writer is None:
+            raise RuntimeError("Connection pool is not open")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, fn)
+
+    async def data_version(self) -> int:
+        """``PRAGMA data_version`` of the writer connection.
+
+        All writes of this process go through that connection, so the value
+        changes only when another process has committed to the database.
+        """
+        if self._writer is None:
+            raise RuntimeError("Connection pool is not open")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._read_data_version)
+
+    def _read_data_version(self) -> int:
+        # Без row_factory: результат — обычный кортеж при любой фабрике строк
+        cur = self._connection().cursor()
+        cur.row_factory = None
+        return int(cur.execute("PRAGMA data_version").fetchone()[0])
+
+    async def read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run ``fn(conn)`` on one of the reader threads."""
+        if self._reader is None:
+            raise RuntimeError("Connection pool is not open")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, self._run_read, fn)
@@ -0,0 +1,146 @@
+"""Expiry engine: a min-heap of deadlines driven by a single asyncio timer."""
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ExpireCallback = Callable[[int, Any], Awaitable[None]]
+
+
+class ExpiryEngine:
+    """Fires ``callback(key, payload)`` when a key's wall-clock deadline passes.
+
+    Only the nearest deadline has an armed timer, so memory and scheduling cost
+    stay flat however many rentals are active. Rescheduling pushes a new heap
+    entry and cancelling just forgets the key (O(log n) / O(1)); superseded
+    heap entries are skipped lazily and compacted when they pile up.
+    """
+
+    def __init__(self, callback: ExpireCallback, max_sleep: float = 3600.0) -> None:
+        self._callback = callback
+        # Спим не дольше max_sleep: так таймер переживает скачки системных часов
+        self._max_sleep = max_sleep
+        self._heap: List[Tuple[float, int, int]] = []  # (deadline, seq, key)
+        self._entries: Dict[int, Tuple[float, int, Any]] = {}  # key -> (deadline, seq, payload)
+        self._seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._armed_for: Optional[float] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
+
+    def deadline(self, key: int) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def next_deadline(self) -> Optional[float]:
+        self._drop_stale_head()
+        return self._heap[0][0] if self._heap else None
+
+    def due_before(self, ts: float) -> List[Tuple[int, Any]]:
+        """(key, payload) of live entries with deadline <= ``ts``, without removing them.
+
+        Walks only the part of the heap above ``ts`` (children are never
+        earlier than their parent), so the cost is proportional to the result.
+        """
+        found: List[Tuple[int, Any]] = []
+        stack = [0] if self._heap else []
+        while stack:
+            i = stack.pop()
+            item = self._heap[i]
+            if item[0] > ts:
+                continue
+            if self._is_live(item):
+                found.append((item[2], self._entries[item[2]][2]))
+            stack.extend(c for c in (2 * i + 1, 2 * i + 2) if c < len(self._heap))
+        return found
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._arm()
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = None
+        self._armed_for = None
+        self._loop = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    def clear(self) -> None:
+        """Forget every pending key (the timer stays armed but finds nothing due)."""
+        self._entries.clear()
+        self._heap.clear()
+
+    def schedule(self, key: int, deadline: float, payload: Any = None) -> None:
+        """Add or move ``key`` to ``deadline`` (POSIX seconds)."""
+        self._seq += 1
+        self._entries[key] = (deadline, self._seq, payload)
+        heapq.heappush(self._heap, (deadline, self._seq, key))
+        self._maybe_compact()
+        if self._armed_for is None or deadline < self._armed_for:
+            self._arm()
+
+    def cancel(self, key: int) -> bool:
+        if self._entries.pop(key, None) is None:
+            return False
+        self._maybe_compact()
+        return True
+
+    def _is_live(self, item: Tuple[float, int, int]) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is not None and entry[1] == item[1]
+
+    def _drop_stale_head(self) -> None:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _maybe_compact(self) -> None:
+        # Ленивое удаление копит устаревшие записи; перестраиваем кучу, когда их больше половины
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [item for item in self._heap if self._is_live(item)]
+            heapq.heapify(self._heap)
+
+    def _arm(self) -> None:
+        if self._loop is None:
+            return
+        self._drop_stale_head()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._heap:
+            self._armed_for = None
+            return
+        deadline = self._heap[0][0]
+        delay = min(max(0.0, deadline - time.time()), self._max_sleep)
+        self._handle = self._loop.call_later(delay, self._on_timer)
+        self._armed_for = deadline
+
+    def _on_timer(self) -> None:
+        self._handle = None
+        self._armed_for = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if not self._is_live(item):
+                continue
+            _, _, payload = self._entries.pop(item[2])
+            task = asyncio.ensure_future(self._run(item[2], payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm()
+
+    async def _run(self, key: int, payload: Any) -> None:
+        try:
+            await self._callback(key, payload)
+        except Exception:
+            logger.exception("Expiry callback failed for key=%s", key)
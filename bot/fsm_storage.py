@@ -0,0 +1,188 @@
+"""aiogram FSM storage persisted in SQLite, with an in-memory LRU cache."""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database import delete_stale_fsm_records, get_fsm_record, on_external_change, save_fsm_records
+
+logger = logging.getLogger(__name__)
+
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_TTL_SEC = int(float(os.getenv("FSM_TTL_HOURS", "24")) * 3600)
+FSM_FLUSH_SEC = 0.2
+FSM_FLUSH_BATCH = 500
+FSM_SWEEP_SEC = 600
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: int = 0
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    """Drop-in replacement for MemoryStorage that survives restarts.
+
+    Reads are served from an LRU cache of ``cache_size`` keys (users without
+    a state are cached too, which is most of them). Writes update the cache
+    right away and reach SQLite in batches: the background flusher waits
+    ``flush_interval`` after the first change and writes everything changed
+    meanwhile in one transaction. Changed keys are never evicted before they
+    are written. ``close()`` (called by the dispatcher on shutdown) flushes
+    the rest.
+
+    A session untouched for ``ttl`` seconds reads as empty and is deleted by
+    a periodic sweep.
+
+    The cache is only coherent within one process. Another replica's writes
+    reach SQLite up to ``flush_interval`` late, and the cache is dropped only
+    once sync_external_changes() notices them (every leader heartbeat), so
+    several replicas taking updates must route each chat to the same replica.
+    Otherwise a dialog step may see the state from before the previous step.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = FSM_CACHE_SIZE,
+        ttl: int = FSM_TTL_SEC,
+        flush_interval: float = FSM_FLUSH_SEC,
+    ) -> None:
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.hits = 0
+        self.misses = 0
+        on_external_change(self.invalidate)
+
+    async def _get(self, key: StorageKey) -> _Record:
+        k = _key(key)
+        record = self._cache.get(k)
+        if record is None:
+            record = self._dirty.get(k)
+        if record is None:
+            self.misses += 1
+            row = await get_fsm_record(k)
+            # Пока ждали БД, запись могла появиться — она свежее прочитанной
+            record = self._cache.get(k) or self._dirty.get(k)
+            if record is None:
+                record = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record()
+        else:
+            self.hits += 1
+        if record.updated_at and record.updated_at < time.time() - self.ttl:
+            # Сессия протухла: читается как пустая, строку удалит sweep
+            record = _Record()
+        self._cache[k] = record
+        self._cache.move_to_end(k)
+        self._evict()
+        return record
+
+    def _evict(self) -> None:
+        while len(self._cache) > self.cache_size:
+            # Незаписанные изменения остаются в _dirty, их можно выкинуть из кэша
+            self._cache.popitem(last=False)
+
+    def _changed(self, key: StorageKey, record: _Record) -> None:
+        record.updated_at = int(time.time())
+        self._dirty[_key(key)] = record
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="fsm-storage-flush")
+        self._wakeup.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        record.data = data.copy()
+        self._changed(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get(key)).data.copy()
+
+    def invalidate(self) -> None:
+        """Drop cached records that have no pending writes."""
+        self._cache = OrderedDict((k, r) for k, r in self._cache.items() if k in self._dirty)
+
+    async def _run(self) -> None:
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FSM_SWEEP_SEC)
+            except asyncio.TimeoutError:
+                pass
+            if self._closing:
+                return
+            self._wakeup.clear()
+            if self._dirty:
+                # Копим изменения, пока не наберётся пачка или не пройдёт интервал
+                if len(self._dirty) < FSM_FLUSH_BATCH:
+                    await asyncio.sleep(self.flush_interval)
+                if not await self.flush():
+                    # БД недоступна — попробуем снова через интервал
+                    await asyncio.sleep(self.flush_interval)
+                    self._wakeup.set()
+            if time.monotonic() - last_sweep >= FSM_SWEEP_SEC:
+                last_sweep = time.monotonic()
+                await self._sweep()
+
+    async def flush(self) -> bool:
+        """Write all pending changes now; False if the write failed (they stay pending)."""
+        if not self._dirty:
+            return True
+        batch, self._dirty = self._dirty, {}
+        rows = [(k, r.state, json.dumps(r.data, ensure_ascii=False), r.updated_at) for k, r in batch.items()]
+        try:
+            await save_fsm_records(rows)
+        except BaseException as e:
+            for k, record in batch.items():
+                # Более новые изменения, сделанные во время записи, не затираем
+                self._dirty.setdefault(k, record)
+            if not isinstance(e, Exception):
+                raise  # отмена: пачка остаётся в очереди
+            logger.exception("Failed to write %s FSM records", len(rows))
+            return False
+        return True
+
+    async def _sweep(self) -> None:
+        cutoff = int(time.time()) - self.ttl
+        for k in [k for k, r in self._cache.items() if r.updated_at and r.updated_at < cutoff and k not in self._dirty]:
+            del self._cache[k]
+        try:
+            removed = await delete_stale_fsm_records(cutoff)
+        except Exception:
+            logger.exception("Failed to delete stale FSM records")
+            return
+        if removed:
+            logger.info("Deleted %s FSM sessions idle for more than %ss", removed, self.ttl)
+
+    async def close(self) -> None:
+        # Не cancel(): wait_for может проглотить отмену, если событие уже выставлено
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
@@ -3,8 +3,10 @@ from .admin import is_admin, check_admin_access, check_admin_callback
 from .keyboards import (
     build_main_menu, build_rentals_list_kb, build_rental_menu_kb,
     build_tools_list_kb, build_tool_menu_kb, build_expiration_keyboard,
-    build_back_menu_kb, build_reset_confirm_kb
+    build_back_menu_kb, build_reset_confirm_kb, build_tool_suggestions_kb,
+    build_expiration_digest_kb
 )
+from .cards import render_rental_card
 from .fsm import RentalStates, EditToolStates, ReportStates, register_fsm_handlers
 from .commands import register_command_handlers
 from .callbacks import register_callback_handlers
@@ -13,7 +15,8 @@ __all__ = [
     'is_admin', 'check_admin_access', 'check_admin_callback',
     'build_main_menu', 'build_rentals_list_kb', 'build_rental_menu_kb',
     'build_tools_list_kb', 'build_tool_menu_kb', 'build_expiration_keyboard',
-    'build_back_menu_kb', 'build_reset_confirm_kb',
+    'build_back_menu_kb', 'build_reset_confirm_kb', 'build_tool_suggestions_kb',
+    'build_expiration_digest_kb', 'render_rental_card',
     'RentalStates', 'EditToolStates', 'ReportStates',
     'register_fsm_handlers', 'register_command_handlers', 'register_callback_handlers'
 ]
@@ -2,19 +2,20 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramBadRequest
 
 from database import (
-    get_active_rentals, renew_rental, close_rental, get_rental_by_id, 
+    active_rentals_page, renew_and_charge_rental, close_rental, get_rental_by_id, 
     add_revenue, get_tool_by_id, update_tool_name, update_tool_price, 
-    delete_tool, reset_database
+    delete_tool, reset_database, list_tools_page
 )
-from utils import format_remaining_time, format_local_end_time_hhmm, moscow_today_str
+from utils import format_local_end_time_hhmm, moscow_today_str
+from message_edits import edit_message
 from .admin import check_admin_callback
 from .keyboards import (
-    build_main_menu, build_rentals_list_kb, build_rental_menu_kb,
+    build_main_menu, build_rentals_list_kb,
     build_tools_list_kb, build_tool_menu_kb, build_back_menu_kb
 )
+from .cards import render_rental_card
 from .fsm import EditToolStates
 
 
@@ -30,19 +31,27 @@ def register_callback_handlers(router: Router) -> None:
         await callback.message.answer("Главное меню", reply_markup=build_main_menu())
         await callback.answer()
 
-    @router.callback_query(F.data == "rentals_refresh")
+    @router.callback_query(F.data.startswith("rentals_refresh"))
     async def cb_rentals_refresh(callback: CallbackQuery) -> None:
         if not check_admin_callback(callback):
             return
         
-        rows = await get_active_rentals(user_id=callback.from_user.id)
-        if not rows:
-            await callback.message.edit_text("✅ Все инструменты возвращены. Активных аренд нет.", reply_markup=None)
+        # rentals_refresh:<порядок>:<id первой аренды на странице>; без параметров — первая страница
+        parts = callback.data.split(":")
+        if len(parts) == 3:
+            page = await active_rentals_page(callback.from_user.id, parts[1], int(parts[2]), "at")
+        else:
+            page = await active_rentals_page(callback.from_user.id)
+        if not page.items:
+            await edit_message(callback.message, "✅ Все инструменты возвращены. Активных аренд нет.", reply_markup=None)
             await callback.answer()
             return
-        # Меняем сразу и текст, и клавиатуру у того же сообщения
-        await callback.message.edit_text("📋 Активные аренды (оставшееся время):")
-        await callback.message.edit_reply_markup(reply_markup=build_rentals_list_kb(rows))
+        # Текст и клавиатура — одним запросом; если за минуту ничего не изменилось, запроса нет
+        await edit_message(
+            callback.message,
+            "📋 Активные аренды (оставшееся время):",
+            reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+        )
         await callback.answer("Обновлено")
 
     @router.callback_query(F.data == "rentals_list")
@@ -50,14 +59,37 @@ def register_callback_handlers(router: Router) -> None:
         if not check_admin_callback(callback):
             return
         
-        rows = await get_active_rentals(user_id=callback.from_user.id)
-        if not rows:
-            await callback.message.edit_text("✅ Все инструменты возвращены. Активных аренд нет.")
+        page = await active_rentals_page(callback.from_user.id)
+        if not page.items:
+            await edit_message(callback.message, "✅ Все инструменты возвращены. Активных аренд нет.")
+            await callback.answer()
+            return
+        await edit_message(
+            callback.message,
+            "📋 Активные аренды (оставшееся время):",
+            reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+        )
+        await callback.answer()
+
+    @router.callback_query(F.data.startswith("rentals_page:"))
+    async def cb_rentals_page(callback: CallbackQuery) -> None:
+        if not check_admin_callback(callback):
+            return
+        
+        # rentals_page:<new|due>:<next|prev|first>:<id крайней аренды текущей страницы>
+        _, sort, direction, cursor = callback.data.split(":", 3)
+        if direction == "first":
+            page = await active_rentals_page(callback.from_user.id, sort)
+        else:
+            page = await active_rentals_page(callback.from_user.id, sort, int(cursor), direction)
+        if not page.items:
+            await edit_message(callback.message, "✅ Все инструменты возвращены. Активных аренд нет.")
             await callback.answer()
             return
-        await callback.message.edit_text(
+        await edit_message(
+            callback.message,
             "📋 Активные аренды (оставшееся время):",
-            reply_markup=build_rentals_list_kb(rows),
+            reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
         )
         await callback.answer()
 
@@ -71,77 +103,30 @@ def register_callback_handlers(router: Router) -> None:
         if not row or int(row.get("active", 0)) != 1:
             await callback.answer("Аренда неактивна", show_alert=True)
             return
-        left = format_remaining_time(int(row["start_time"]))
-        end_hhmm = format_local_end_time_hhmm(int(row["start_time"]))
-        
-        # Формируем детальную информацию
-        deposit = int(row.get("deposit", 0))
-        payment_method = row.get("payment_method", "cash")
-        delivery_type = row.get("delivery_type", "pickup")
-        address = row.get("address", "")
-        
-        payment_text = "💵 Наличные" if payment_method == "cash" else "💳 Перевод"
-        delivery_text = "🚚 Доставка" if delivery_type == "delivery" else "🏠 Самовывоз"
-        
-        text = (
-            f"🔧 <b>{row['tool_name']}</b> — {row['rent_price']}₽/сутки\n"
-            f"⏰ Осталось: {left} (до {end_hhmm})\n"
-            f"💰 Залог: {deposit}₽\n"
-            f"{payment_text}\n"
-            f"{delivery_text}"
-        )
-        
-        if delivery_type == "delivery" and address:
-            text += f"\n📍 Адрес: {address}"
-        
-        await callback.message.edit_text(text, reply_markup=build_rental_menu_kb(rental_id))
+        text, kb = render_rental_card(row)
+        await edit_message(callback.message, text, reply_markup=kb)
         await callback.answer()
 
     @router.callback_query(F.data.startswith("rental_renew:"))
-    async def cb_rental_renew(callback: CallbackQuery) -> None:
+    async def cb_rental_renew(callback: CallbackQuery, scheduler) -> None:
         if not check_admin_callback(callback):
             return
         
         try:
             rental_id = int(callback.data.split(":", 1)[1])
-            row_before = await get_rental_by_id(rental_id)
-            if not row_before:
+            # Начислим выручку за период и продлим на +24ч от текущего дедлайна — одной транзакцией
+            row_after = await renew_and_charge_rental(rental_id, charge_date=moscow_today_str())
+            if not row_after:
                 await callback.answer("Аренда не найдена", show_alert=True)
                 return
-            # Начислим выручку за период и продлим на +24ч от текущего дедлайна
-            date_key = moscow_today_str()
-            await add_revenue(date_key, rental_id, int(row_before["rent_price"]))
-            await renew_rental(rental_id)
-            row_after = await get_rental_by_id(rental_id)
-            if row_after:
-                # Обновляем сообщение с новой информацией о времени
-                left = format_remaining_time(int(row_after["start_time"]))
-                end_hhmm = format_local_end_time_hhmm(int(row_after["start_time"]))
-                
-                deposit = int(row_after.get("deposit", 0))
-                payment_method = row_after.get("payment_method", "cash")
-                delivery_type = row_after.get("delivery_type", "pickup")
-                address = row_after.get("address", "")
-                
-                payment_text = "💵 Наличные" if payment_method == "cash" else "💳 Перевод"
-                delivery_text = "🚚 Доставка" if delivery_type == "delivery" else "🏠 Самовывоз"
-                
-                updated_text = (
-                    f"🔧 <b>{row_after['tool_name']}</b> — {row_after['rent_price']}₽/сутки\n"
-                    f"✅ Аренда продлена на 24 часа\n"
-                    f"⏰ Осталось: {left} (до {end_hhmm})\n"
-                    f"💰 Залог: {deposit}₽\n"
-                    f"{payment_text}\n"
-                    f"{delivery_text}"
-                )
-                if delivery_type == "delivery" and address:
-                    updated_text += f"\n📍 Адрес: {address}"
-                
-                try:
-                    await callback.message.edit_text(updated_text, reply_markup=build_rental_menu_kb(rental_id))
-                except TelegramBadRequest:
-                    # Если сообщение не изменилось, просто игнорируем ошибку
-                    pass
+            await scheduler.schedule_expiration_notification(
+                rental_id, int(row_after["expires_at"]), int(row_after["user_id"]), row_after["tool_name"]
+            )
+            # Обновляем сообщение с новой информацией о времени
+            updated_text, kb = render_rental_card(row_after, note="✅ Аренда продлена на 24 часа")
+
+            # Неизменившееся сообщение edit_message не отправляет повторно
+            await edit_message(callback.message, updated_text, reply_markup=kb)
             await callback.answer("Аренда продлена")
         except Exception as e:
             import logging
@@ -153,7 +138,7 @@ def register_callback_handlers(router: Router) -> None:
                 pass
 
     @router.callback_query(F.data.startswith("rental_close:"))
-    async def cb_rental_close(callback: CallbackQuery) -> None:
+    async def cb_rental_close(callback: CallbackQuery, scheduler) -> None:
         if not check_admin_callback(callback):
             return
         
@@ -163,7 +148,8 @@ def register_callback_handlers(router: Router) -> None:
             date_key = moscow_today_str()
             await add_revenue(date_key, rental_id, int(row["rent_price"]))
         await close_rental(rental_id)
-        await callback.message.edit_text("🔒 Аренда инструмента завершена")
+        await scheduler.cancel_expiration_notification(rental_id)
+        await edit_message(callback.message, "🔒 Аренда инструмента завершена")
         await callback.answer()
 
     # --- Tool editing callbacks ---
@@ -172,10 +158,40 @@ def register_callback_handlers(router: Router) -> None:
         if not check_admin_callback(callback):
             return
         
-        items = await list_tools(limit=50)
+        page = await list_tools_page()
         await state.set_state(EditToolStates.choosing_tool)
-        await callback.message.edit_text("📚 Выберите инструмент для редактирования:")
-        await callback.message.answer(reply_markup=build_tools_list_kb(items), text=" ")
+        if not page.items:
+            await edit_message(callback.message, "Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
+            await callback.answer()
+            return
+        await edit_message(
+            callback.message,
+            "📚 Выберите инструмент для редактирования:",
+            reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next),
+        )
+        await callback.answer()
+
+    @router.callback_query(F.data.startswith("tools_page:"))
+    async def cb_tools_page(callback: CallbackQuery, state: FSMContext) -> None:
+        if not check_admin_callback(callback):
+            return
+        
+        # tools_page:<next|prev>:<id крайнего инструмента текущей страницы>
+        _, direction, cursor = callback.data.split(":", 2)
+        if direction == "prev":
+            page = await list_tools_page(before_id=int(cursor))
+        else:
+            page = await list_tools_page(after_id=int(cursor))
+        await state.set_state(EditToolStates.choosing_tool)
+        if not page.items:
+            await edit_message(callback.message, "Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
+            await callback.answer()
+            return
+        await edit_message(
+            callback.message,
+            "📚 Выберите инструмент для редактирования:",
+            reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next),
+        )
         await callback.answer()
 
     @router.callback_query(F.data.startswith("tool_open:"))
@@ -190,7 +206,7 @@ def register_callback_handlers(router: Router) -> None:
             return
         await state.update_data(tool_id=tool_id)
         await state.set_state(EditToolStates.tool_menu)
-        await callback.message.edit_text(f"🔧 {tool['name']} — {tool['price']}₽", reply_markup=build_tool_menu_kb(tool_id))
+        await edit_message(callback.message, f"🔧 {tool['name']} — {tool['price']}₽", reply_markup=build_tool_menu_kb(tool_id))
         await callback.answer()
 
     @router.callback_query(F.data.startswith("tool_do_rename:"))
@@ -201,7 +217,7 @@ def register_callback_handlers(router: Router) -> None:
         tool_id = int(callback.data.split(":", 1)[1])
         await state.update_data(tool_id=tool_id)
         await state.set_state(EditToolStates.renaming)
-        await callback.message.edit_text("Введите новое название:")
+        await edit_message(callback.message, "Введите новое название:")
         await callback.answer()
 
     @router.callback_query(F.data.startswith("tool_do_price:"))
@@ -212,7 +228,7 @@ def register_callback_handlers(router: Router) -> None:
         tool_id = int(callback.data.split(":", 1)[1])
         await state.update_data(tool_id=tool_id)
         await state.set_state(EditToolStates.pricing)
-        await callback.message.edit_text("Введите новую цену (число):")
+        await edit_message(callback.message, "Введите новую цену (число):")
         await callback.answer()
 
     @router.callback_query(F.data.startswith("tool_do_delete:"))
@@ -222,7 +238,7 @@ def register_callback_handlers(router: Router) -> None:
         
         tool_id = int(callback.data.split(":", 1)[1])
         await delete_tool(tool_id)
-        await callback.message.edit_text("✅ Инструмент удалён")
+        await edit_message(callback.message, "✅ Инструмент удалён")
         await callback.answer()
 
     # --- Reset database callback ---
@@ -232,51 +248,28 @@ def register_callback_handlers(router: Router) -> None:
             return
         
         await reset_database()
-        await confirm.message.edit_text("✅ База очищена. Можно начинать заново.")
+        await edit_message(confirm.message, "✅ База очищена. Можно начинать заново.")
         await confirm.answer()
 
     # --- Legacy expiration callbacks ---
     @router.callback_query(F.data.startswith("renew:"))
-    async def on_renew(callback: CallbackQuery) -> None:
+    async def on_renew(callback: CallbackQuery, scheduler) -> None:
         if not check_admin_callback(callback):
             return
         
         try:
             rental_id = int(callback.data.split(":", 1)[1])
-            row_before = await get_rental_by_id(rental_id)
-            if row_before:
-                # Продлеваем без записи выручки (она уже записана при создании)
-                await renew_rental(rental_id)
-                row_after = await get_rental_by_id(rental_id)
-                if row_after:
-                    # Обновляем сообщение с новой информацией о времени
-                    left = format_remaining_time(int(row_after["start_time"]))
-                    end_hhmm = format_local_end_time_hhmm(int(row_after["start_time"]))
-                    
-                    deposit = int(row_after.get("deposit", 0))
-                    payment_method = row_after.get("payment_method", "cash")
-                    delivery_type = row_after.get("delivery_type", "pickup")
-                    address = row_after.get("address", "")
-                    
-                    payment_text = "💵 Наличные" if payment_method == "cash" else "💳 Перевод"
-                    delivery_text = "🚚 Доставка" if delivery_type == "delivery" else "🏠 Самовывоз"
-                    
-                    updated_text = (
-                        f"🔧 <b>{row_after['tool_name']}</b> — {row_after['rent_price']}₽/сутки\n"
-                        f"✅ Аренда продлена на 24 часа\n"
-                        f"⏰ Осталось: {left} (до {end_hhmm})\n"
-                        f"💰 Залог: {deposit}₽\n"
-                        f"{payment_text}\n"
-                        f"{delivery_text}"
-                    )
-                    if delivery_type == "delivery" and address:
-                        updated_text += f"\n📍 Адрес: {address}"
-                    
-                    try:
-                        await callback.message.edit_text(updated_text, reply_markup=build_rental_menu_kb(rental_id))
-                    except TelegramBadRequest:
-                        # Если сообщение не изменилось, просто игнорируем ошибку
-                        pass
+            # Продлеваем без записи выручки (она уже записана при создании)
+            row_after = await renew_and_charge_rental(rental_id)
+            if row_after:
+                await scheduler.schedule_expiration_notification(
+                    rental_id, int(row_after["expires_at"]), int(row_after["user_id"]), row_after["tool_name"]
+                )
+                # Обновляем сообщение с новой информацией о времени
+                updated_text, kb = render_rental_card(row_after, note="✅ Аренда продлена на 24 часа")
+
+                # Неизменившееся сообщение edit_message не отправляет повторно
+                await edit_message(callback.message, updated_text, reply_markup=kb)
                 await callback.answer("Аренда продлена")
         except Exception as e:
             import logging
@@ -288,7 +281,7 @@ def register_callback_handlers(router: Router) -> None:
                 pass
 
     @router.callback_query(F.data.startswith("close:"))
-    async def on_close(callback: CallbackQuery) -> None:
+    async def on_close(callback: CallbackQuery, scheduler) -> None:
         if not check_admin_callback(callback):
             return
         
@@ -298,5 +291,50 @@ def register_callback_handlers(router: Router) -> None:
             date_key = moscow_today_str()
             await add_revenue(date_key, rental_id, int(row["rent_price"]))
         await close_rental(rental_id)
-        await callback.message.edit_text("🔒 Аренда инструмента завершена")
-        await callback.answer()
\ No newline at end of file
+        await scheduler.cancel_expiration_notification(rental_id)
+        await edit_message(callback.message, "🔒 Аренда инструмента завершена")
+        await callback.answer()
+
+    # --- Expiration digest callbacks ---
+    async def _digest_done(callback: CallbackQuery, rental_id: int, note: str) -> None:
+        """Убирает из сводки строку обработанной аренды; когда строк не осталось — закрывает сводку."""
+        markup = callback.message.reply_markup
+        rows = [
+            row for row in (markup.inline_keyboard if markup else [])
+            if not any(btn.callback_data and btn.callback_data.endswith(f":{rental_id}") for btn in row)
+        ]
+        if rows:
+            await edit_message(callback.message, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+        else:
+            await edit_message(callback.message, "✅ Все истёкшие аренды обработаны")
+        await callback.answer(note)
+
+    @router.callback_query(F.data.startswith("digest_renew:"))
+    async def on_digest_renew(callback: CallbackQuery, scheduler) -> None:
+        if not check_admin_callback(callback):
+            return
+
+        rental_id = int(callback.data.split(":", 1)[1])
+        # Как и renew: — без записи выручки
+        row_after = await renew_and_charge_rental(rental_id)
+        if not row_after:
+            await callback.answer("Аренда не найдена", show_alert=True)
+            return
+        await scheduler.schedule_expiration_notification(
+            rental_id, int(row_after["expires_at"]), int(row_after["user_id"]), row_after["tool_name"]
+        )
+        end_hhmm = format_local_end_time_hhmm(int(row_after["expires_at"]))
+        await _digest_done(callback, rental_id, f"«{row_after['tool_name']}» продлена до {end_hhmm}")
+
+    @router.callback_query(F.data.startswith("digest_close:"))
+    async def on_digest_close(callback: CallbackQuery, scheduler) -> None:
+        if not check_admin_callback(callback):
+            return
+
+        rental_id = int(callback.data.split(":", 1)[1])
+        row = await get_rental_by_id(rental_id)
+        if row:
+            await add_revenue(moscow_today_str(), rental_id, int(row["rent_price"]))
+        await close_rental(rental_id)
+        await scheduler.cancel_expiration_notification(rental_id)
+        await _digest_done(callback, rental_id, "🔒 Аренда завершена")
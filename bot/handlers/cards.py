@@ -0,0 +1,60 @@
+"""Rental card rendering shared by the handlers."""
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from utils import format_local_end_time_hhmm, format_minutes_left, remaining_minutes
+from .keyboards import build_rental_menu_kb
+
+CARD_CACHE_SIZE = 4096
+
+
+def _card_version(row: Dict[str, Any]) -> Tuple[Any, ...]:
+    # Версия строки — сами показываемые поля: продление меняет expires_at,
+    # остальное после создания не меняется, так что устаревшей карточки не будет
+    return (
+        row["tool_name"],
+        int(row["rent_price"]),
+        int(row["expires_at"]),
+        int(row.get("deposit") or 0),
+        row.get("payment_method") or "cash",
+        row.get("delivery_type") or "pickup",
+        row.get("address") or "",
+    )
+
+
+@lru_cache(maxsize=CARD_CACHE_SIZE)
+def _card_parts(rental_id: int, version: Tuple[Any, ...]) -> Tuple[str, str, str]:
+    """Неизменные части карточки: заголовок, время окончания и хвост с деталями."""
+    tool_name, rent_price, expires_at, deposit, payment_method, delivery_type, address = version
+    payment_text = "💵 Наличные" if payment_method == "cash" else "💳 Перевод"
+    delivery_text = "🚚 Доставка" if delivery_type == "delivery" else "🏠 Самовывоз"
+    tail = f"💰 Залог: {deposit}₽\n{payment_text}\n{delivery_text}"
+    if delivery_type == "delivery" and address:
+        tail += f"\n📍 Адрес: {address}"
+    return f"🔧 <b>{tool_name}</b> — {rent_price}₽/сутки\n", format_local_end_time_hhmm(expires_at), tail
+
+
+@lru_cache(maxsize=CARD_CACHE_SIZE)
+def _card_text(rental_id: int, version: Tuple[Any, ...], minutes_left: int, note: Optional[str]) -> str:
+    title, end_hhmm, tail = _card_parts(rental_id, version)
+    note_line = f"{note}\n" if note else ""
+    return f"{title}{note_line}⏰ Осталось: {format_minutes_left(minutes_left)} (до {end_hhmm})\n{tail}"
+
+
+def render_rental_card(row: Dict[str, Any], note: Optional[str] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст карточки аренды и её клавиатура.
+
+    Текст кэшируется по (id аренды, версия строки, оставшиеся минуты): в пределах
+    одной минуты повторный показ карточки не пересобирает строку.
+    """
+    rental_id = int(row["id"])
+    version = _card_version(row)
+    text = _card_text(rental_id, version, remaining_minutes(version[2]), note)
+    return text, build_rental_menu_kb(rental_id)
+
+
+def card_cache_info() -> Dict[str, Any]:
+    """Статистика кэшей карточек (для бенчмарка и логов)."""
+    return {"parts": _card_parts.cache_info()._asdict(), "text": _card_text.cache_info()._asdict()}
@@ -1,23 +1,49 @@
 """Command handlers."""
+import time
+
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
 from database import (
-    get_active_rentals, sum_revenue_by_date_for_user, get_tool_by_name, 
-    upsert_tool, list_tools, import_catalog_from_csv, reset_database,
-    get_tool_by_id, update_tool_name, update_tool_price, delete_tool
+    get_active_rentals, active_rentals_page, sum_revenue_by_date_for_user, find_tool_by_name, search_tools,
+    upsert_tool, list_tools_page, import_catalog_from_csv, reset_database,
+    get_tool_by_id, update_tool_name, update_tool_price, delete_tool, revenue_by_period_for_user,
+    get_report_minute, set_report_minute, rentals_due_before
+)
+from utils import (
+    parse_tool_and_price, moscow_today_str, format_daily_report_with_revenue, format_import_result,
+    PERIOD_ALIASES, parse_date, period_bounds, period_days, format_revenue_period_report,
+    parse_hhmm, format_hhmm, format_due_rentals
 )
-from utils import parse_tool_and_price, moscow_today_str, format_daily_report_with_revenue
+from message_edits import edit_message
 from .admin import check_admin_access, check_admin_callback
 from .keyboards import (
     build_main_menu, build_rentals_list_kb, build_tools_list_kb, 
-    build_tool_menu_kb, build_back_menu_kb, build_reset_confirm_kb
+    build_tool_menu_kb, build_back_menu_kb, build_reset_confirm_kb, build_tool_suggestions_kb
 )
 from .fsm import EditToolStates, ReportStates, RentalStates
 
 
+INCOME_DAILY_BREAKDOWN_MAX_DAYS = 62
+DUE_DEFAULT_HOURS = 2
+DUE_MAX_HOURS = 168
+
+
+def _deposit_prompt(tool_name: str, rent_price: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура вопроса о залоге — первый шаг создания аренды."""
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Без залога", callback_data="deposit:0")],
+        [InlineKeyboardButton(text="↩️ Отмена", callback_data="back_menu")]
+    ])
+    text = (
+        f"🔧 <b>{tool_name}</b> — {rent_price}₽/сутки\n\n"
+        "💰 Какой залог оставили? (введите сумму или нажмите кнопку)"
+    )
+    return text, kb
+
+
 def register_command_handlers(router: Router) -> None:
     """Регистрирует обработчики команд."""
     
@@ -41,11 +67,30 @@ def register_command_handlers(router: Router) -> None:
             return
         
         await state.clear()
-        rows = await get_active_rentals(user_id=message.from_user.id)
-        if not rows:
+        page = await active_rentals_page(message.from_user.id)
+        if not page.items:
             await message.answer("✅ Все инструменты возвращены. Активных аренд нет.")
             return
-        await message.answer("📋 Активные аренды (оставшееся время):", reply_markup=build_rentals_list_kb(rows))
+        await message.answer(
+            "📋 Активные аренды (оставшееся время):",
+            reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+        )
+
+    @router.message(Command("due"))
+    async def cmd_due(message: Message) -> None:
+        if not await check_admin_access(message):
+            return
+        
+        # /due [часы] — аренды, истекающие в ближайшие N часов (и уже истёкшие), по сроку
+        parts = (message.text or "").split()
+        hours = DUE_DEFAULT_HOURS
+        if len(parts) > 1:
+            hours = int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else 0
+            if not 1 <= hours <= DUE_MAX_HOURS:
+                await message.answer(f"Формат: /due [часы], от 1 до {DUE_MAX_HOURS}")
+                return
+        rows = await rentals_due_before(message.from_user.id, int(time.time()) + hours * 3600)
+        await message.answer(format_due_rentals(rows, hours))
 
     @router.message(Command("report_now"))
     async def cmd_report_now(message: Message, scheduler) -> None:
@@ -84,6 +129,30 @@ def register_command_handlers(router: Router) -> None:
         s = await sum_revenue_by_date_for_user(date, message.from_user.id)
         await message.answer(format_daily_report_with_revenue(date, rows, s))
 
+    @router.message(Command("report_time"))
+    async def cmd_report_time(message: Message) -> None:
+        if not await check_admin_access(message):
+            return
+        
+        # /report_time HH:MM — время ежедневного отчёта; без аргумента показывает текущее
+        parts = (message.text or "").split()
+        if len(parts) == 1:
+            minute = await get_report_minute(message.from_user.id)
+            await message.answer(
+                f"🕘 Ежедневный отчёт: около {format_hhmm(minute * 60)}\n"
+                "Изменить: /report_time HH:MM"
+            )
+            return
+        minute = parse_hhmm(parts[1]) if len(parts) == 2 else None
+        if minute is None:
+            await message.answer("Формат: /report_time HH:MM")
+            return
+        slot = await set_report_minute(message.from_user.id, minute)
+        await message.answer(
+            f"✅ Отчёт будет приходить около {format_hhmm(minute * 60)} "
+            f"(точнее — в {format_hhmm(slot)}, чтобы не отправлять всем одновременно)"
+        )
+
     @router.message(Command("expire_last"))
     async def cmd_expire_last(message: Message, scheduler) -> None:
         if not await check_admin_access(message):
@@ -111,19 +180,39 @@ def register_command_handlers(router: Router) -> None:
         if not await check_admin_access(message):
             return
         
-        # Ожидаем формат: /income YYYY-MM-DD
+        # Ожидаем формат: /income YYYY-MM-DD, /income FROM TO или /income week|month|year
+        usage = (
+            "Формат:\n"
+            "/income YYYY-MM-DD — за день\n"
+            "/income YYYY-MM-DD YYYY-MM-DD — за период\n"
+            "/income week | month | year — с начала недели, месяца или года"
+        )
         text = (message.text or "").strip()
         parts = text.split()
-        if len(parts) != 2:
-            await message.answer("Формат: /income YYYY-MM-DD")
+        if len(parts) == 2 and parts[1].lower() in PERIOD_ALIASES:
+            date_from, date_to = period_bounds(PERIOD_ALIASES[parts[1].lower()])
+        elif len(parts) == 2:
+            date = parse_date(parts[1])
+            if date is None:
+                await message.answer(usage)
+                return
+            s = await sum_revenue_by_date_for_user(date, message.from_user.id)
+            await message.answer(f"💰 Доход за {date}: {s}₽")
             return
-        date = parts[1]
-        # Простейшая валидация формата
-        if len(date) != 10 or date[4] != '-' or date[7] != '-':
-            await message.answer("Формат: /income YYYY-MM-DD")
+        elif len(parts) == 3:
+            date_from, date_to = parse_date(parts[1]), parse_date(parts[2])
+            if date_from is None or date_to is None:
+                await message.answer(usage)
+                return
+            if date_from > date_to:
+                date_from, date_to = date_to, date_from
+        else:
+            await message.answer(usage)
             return
-        s = await sum_revenue_by_date_for_user(date, message.from_user.id)
-        await message.answer(f"💰 Доход за {date}: {s}₽")
+        # Длинные периоды сворачиваем помесячно, чтобы уложиться в лимит длины сообщения
+        by_month = period_days(date_from, date_to) > INCOME_DAILY_BREAKDOWN_MAX_DAYS
+        rows = await revenue_by_period_for_user(message.from_user.id, date_from, date_to, by_month=by_month)
+        await message.answer(format_revenue_period_report(date_from, date_to, rows, by_month=by_month))
 
     # --- Catalog commands ---
     @router.message(Command("catalog"))
@@ -131,12 +220,12 @@ def register_command_handlers(router: Router) -> None:
         if not await check_admin_access(message):
             return
         
-        items = await list_tools(limit=50)
-        if not items:
+        page = await list_tools_page()
+        if not page.items:
             await message.answer("Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
             return
         await state.set_state(EditToolStates.choosing_tool)
-        await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(items))
+        await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next))
 
     @router.message(Command("setprice"))
     async def cmd_setprice(message: Message) -> None:
@@ -171,8 +260,8 @@ def register_command_handlers(router: Router) -> None:
         if not path.exists():
             await message.answer("Файл /app/data/catalog.csv не найден. Смонтируйте его в volume bot_data.")
             return
-        count = await import_catalog_from_csv(str(path))
-        await message.answer(f"✅ Импортировано позиций: {count}")
+        result = await import_catalog_from_csv(str(path))
+        await message.answer(format_import_result(result))
 
     # --- Reset database (testing) ---
     @router.message(Command("reset_db"))
@@ -192,11 +281,14 @@ def register_command_handlers(router: Router) -> None:
             return
         
         await state.clear()
-        rows = await get_active_rentals(user_id=message.from_user.id)
-        if not rows:
+        page = await active_rentals_page(message.from_user.id)
+        if not page.items:
             await message.answer("✅ Все инструменты возвращены. Активных аренд нет.")
             return
-        await message.answer("📋 Активные аренды (оставшееся время):", reply_markup=build_rentals_list_kb(rows))
+        await message.answer(
+            "📋 Активные аренды (оставшееся время):",
+            reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+        )
 
     @router.message(F.text == "📅 Отчёт по дате")
     async def btn_report_by_date(message: Message, state: FSMContext) -> None:
@@ -226,12 +318,12 @@ def register_command_handlers(router: Router) -> None:
         # Сбросим возможное состояние отчёта по дате, чтобы текст кнопки не обрабатывался как дата
         await state.clear()
         # Переиспользуем тот же сценарий FSM, что и команда /catalog
-        items = await list_tools(limit=50)
-        if not items:
+        page = await list_tools_page()
+        if not page.items:
             await message.answer("Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
             return
         await state.set_state(EditToolStates.choosing_tool)
-        await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(items))
+        await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next))
 
     @router.message(F.text == "⬆️ Импорт CSV")
     async def btn_import_hint(message: Message, state: FSMContext) -> None:
@@ -281,8 +373,8 @@ def register_command_handlers(router: Router) -> None:
             # Download file to destination
             await message.bot.download(doc, destination=str(dest_path))
 
-            count = await import_catalog_from_csv(str(dest_path))
-            await message.answer(f"✅ Импортировано позиций: {count}")
+            result = await import_catalog_from_csv(str(dest_path))
+            await message.answer(format_import_result(result))
         except Exception as e:
             await message.answer("❌ Не удалось импортировать CSV. Проверьте формат: название,цена")
 
@@ -338,9 +430,17 @@ def register_command_handlers(router: Router) -> None:
         # Начинаем процесс создания аренды
         parsed = parse_tool_and_price(text)
         if parsed is None:
-            # Если указан только инструмент, попробуем взять цену из каталога
-            catalog_row = await get_tool_by_name(text)
+            # Если указан только инструмент, попробуем взять цену из каталога (кэш в памяти)
+            catalog_row = await find_tool_by_name(text)
             if not catalog_row:
+                # Нет точного совпадения — предложим похожие позиции
+                candidates = await search_tools(text, limit=5)
+                if candidates:
+                    await message.answer(
+                        "🔎 Точного совпадения нет. Возможно, вы имели в виду:",
+                        reply_markup=build_tool_suggestions_kb(candidates),
+                    )
+                    return
                 await message.answer(
                     "❗️ Формат: <b>Название инструмента Цена</b>\nНапример: <b>Перфоратор Bosch 500</b>\n"
                     "Или добавьте инструмент в каталог через /setprice или импортируйте каталог."
@@ -355,12 +455,22 @@ def register_command_handlers(router: Router) -> None:
         await state.set_state(RentalStates.waiting_deposit)
 
         # Спрашиваем залог
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Без залога", callback_data="deposit:0")],
-            [InlineKeyboardButton(text="↩️ Отмена", callback_data="back_menu")]
-        ])
-        await message.answer(
-            f"🔧 <b>{tool_name}</b> — {rent_price}₽/сутки\n\n"
-            "💰 Какой залог оставили? (введите сумму или нажмите кнопку)",
-            reply_markup=kb
-        )
\ No newline at end of file
+        text, kb = _deposit_prompt(tool_name, rent_price)
+        await message.answer(text, reply_markup=kb)
+
+    @router.callback_query(F.data.startswith("rent_pick:"))
+    async def cb_rent_pick(callback: CallbackQuery, state: FSMContext) -> None:
+        if not check_admin_callback(callback):
+            return
+        
+        tool_id = int(callback.data.split(":", 1)[1])
+        tool = await get_tool_by_id(tool_id)
+        if not tool:
+            await callback.answer("Не найдено", show_alert=True)
+            return
+        tool_name, rent_price = tool["name"], int(tool["price"])
+        await state.update_data(tool_name=tool_name, rent_price=rent_price)
+        await state.set_state(RentalStates.waiting_deposit)
+        text, kb = _deposit_prompt(tool_name, rent_price)
+        await edit_message(callback.message, text, reply_markup=kb)
+        await callback.answer()
\ No newline at end of file
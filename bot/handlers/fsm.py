@@ -1,20 +1,24 @@
 """FSM states and handlers."""
+import asyncio
+
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from database import (
-    add_rental, get_rental_by_id, get_tool_by_name, upsert_tool, 
-    list_tools, get_tool_by_id, update_tool_name, update_tool_price, delete_tool,
-    get_active_rentals, sum_revenue_by_date_for_user, add_revenue
+    create_rental, get_rental_by_id, get_tool_by_name, upsert_tool, 
+    list_tools_page, get_tool_by_id, update_tool_name, update_tool_price, delete_tool,
+    get_active_rentals, active_rentals_page, sum_revenue_by_date_for_user
 )
 from utils import parse_tool_and_price, moscow_today_str, format_daily_report_with_revenue
+from message_edits import edit_message
 from .admin import check_admin_access, check_admin_callback
 from .keyboards import (
     build_main_menu, build_rentals_list_kb, build_tool_menu_kb, 
     build_tools_list_kb, build_back_menu_kb
 )
+from .cards import render_rental_card
 
 
 class RentalStates(StatesGroup):
@@ -59,51 +63,39 @@ async def create_rental_from_fsm(message_or_callback, state: FSMContext, schedul
     else:
         user_id = message_or_callback.message.from_user.id
 
-    # Создаем аренду
-    rental_id = await add_rental(
+    # Создаем аренду и записываем выручку одной транзакцией
+    rental = await create_rental(
         tool_name=tool_name,
         rent_price=rent_price,
         user_id=user_id,
         deposit=deposit,
         payment_method=payment_method,
         delivery_type=delivery_type,
-        address=address
+        address=address,
+        charge_date=moscow_today_str(),
     )
 
-    # Записываем выручку
-    date_key = moscow_today_str()
-    await add_revenue(date_key, rental_id, rent_price)
-
-    # Планируем уведомление
-    rental_data = await get_rental_by_id(rental_id)
-    await scheduler.schedule_expiration_notification(
-        rental_id=rental_id,
-        start_time_ts=rental_data["start_time"],
-        user_id=user_id,
-        tool_name=tool_name,
-    )
+    card_text, _ = render_rental_card(rental)
+    result_text = f"✅ <b>Аренда создана!</b>\n\n{card_text}"
 
-    # Формируем сообщение
-    payment_text = "💵 Наличные" if payment_method == "cash" else "💳 Перевод"
-    delivery_text = "🚚 Доставка" if delivery_type == "delivery" else "🏠 Самовывоз"
+    async def _reply() -> None:
+        if isinstance(message_or_callback, CallbackQuery):
+            await edit_message(message_or_callback.message, result_text)
+            await message_or_callback.answer()
+        else:
+            await message_or_callback.answer(result_text)
 
-    result_text = (
-        f"✅ <b>Аренда создана!</b>\n\n"
-        f"🔧 <b>{tool_name}</b> — {rent_price}₽/сутки\n"
-        f"💰 Залог: {deposit}₽\n"
-        f"{payment_text}\n"
-        f"{delivery_text}"
+    # Планируем уведомление и отвечаем пользователю параллельно
+    await asyncio.gather(
+        scheduler.schedule_expiration_notification(
+            rental_id=int(rental["id"]),
+            expires_at=int(rental["expires_at"]),
+            user_id=user_id,
+            tool_name=tool_name,
+        ),
+        _reply(),
     )
 
-    if delivery_type == "delivery" and address:
-        result_text += f"\n📍 Адрес: {address}"
-
-    if isinstance(message_or_callback, CallbackQuery):
-        await message_or_callback.message.edit_text(result_text)
-        await message_or_callback.answer()
-    else:
-        await message_or_callback.answer(result_text)
-
     await state.clear()
 
 
@@ -124,11 +116,14 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
             await state.clear()
             # Роутинг на соответствующий сценарий
             if text == "📋 Список аренд":
-                rows = await get_active_rentals(user_id=message.from_user.id)
-                if not rows:
+                page = await active_rentals_page(message.from_user.id)
+                if not page.items:
                     await message.answer("✅ Все инструменты возвращены. Активных аренд нет.")
                     return
-                await message.answer("📋 Активные аренды (оставшееся время):", reply_markup=build_rentals_list_kb(rows))
+                await message.answer(
+                    "📋 Активные аренды (оставшееся время):",
+                    reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+                )
                 return
             if text == "📊 Отчёт сейчас":
                 date = moscow_today_str()
@@ -137,12 +132,12 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
                 await message.answer(format_daily_report_with_revenue(date, rows, s))
                 return
             if text == "📚 Каталог":
-                items = await list_tools(limit=50)
-                if not items:
+                page = await list_tools_page()
+                if not page.items:
                     await message.answer("Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
                     return
                 await state.set_state(EditToolStates.choosing_tool)
-                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(items))
+                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next))
                 return
             if text == "⬆️ Импорт CSV":
                 await message.answer(
@@ -189,11 +184,14 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
             await state.clear()
             # Роутинг на соответствующий сценарий
             if text == "📋 Список аренд":
-                rows = await get_active_rentals(user_id=message.from_user.id)
-                if not rows:
+                page = await active_rentals_page(message.from_user.id)
+                if not page.items:
                     await message.answer("✅ Все инструменты возвращены. Активных аренд нет.")
                     return
-                await message.answer("📋 Активные аренды (оставшееся время):", reply_markup=build_rentals_list_kb(rows))
+                await message.answer(
+                    "📋 Активные аренды (оставшееся время):",
+                    reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+                )
                 return
             if text == "📊 Отчёт сейчас":
                 date = moscow_today_str()
@@ -202,12 +200,12 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
                 await message.answer(format_daily_report_with_revenue(date, rows, s))
                 return
             if text == "📚 Каталог":
-                items = await list_tools(limit=50)
-                if not items:
+                page = await list_tools_page()
+                if not page.items:
                     await message.answer("Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
                     return
                 await state.set_state(EditToolStates.choosing_tool)
-                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(items))
+                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next))
                 return
             if text == "⬆️ Импорт CSV":
                 await message.answer(
@@ -245,7 +243,7 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
             [InlineKeyboardButton(text="💳 Перевод", callback_data="payment:transfer")],
             [InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_deposit")]
         ])
-        await callback.message.edit_text("💳 Способ оплаты:", reply_markup=kb)
+        await edit_message(callback.message, "💳 Способ оплаты:", reply_markup=kb)
         await callback.answer()
 
     @router.callback_query(F.data.startswith("payment:"))
@@ -262,7 +260,7 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
             [InlineKeyboardButton(text="🏠 Самовывоз", callback_data="delivery:pickup")],
             [InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_payment")]
         ])
-        await callback.message.edit_text("🚚 Доставка или самовывоз?", reply_markup=kb)
+        await edit_message(callback.message, "🚚 Доставка или самовывоз?", reply_markup=kb)
         await callback.answer()
 
     @router.callback_query(F.data.startswith("delivery:"))
@@ -275,7 +273,7 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
         
         if delivery_type == "delivery":
             await state.set_state(RentalStates.waiting_address)
-            await callback.message.edit_text("📍 Введите адрес доставки:")
+            await edit_message(callback.message, "📍 Введите адрес доставки:")
             await callback.answer()
         else:
             # Самовывоз - адрес не нужен
@@ -331,11 +329,14 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
             await state.clear()
             # Роутинг на соответствующий сценарий
             if text == "📋 Список аренд":
-                rows = await get_active_rentals(user_id=message.from_user.id)
-                if not rows:
+                page = await active_rentals_page(message.from_user.id)
+                if not page.items:
                     await message.answer("✅ Все инструменты возвращены. Активных аренд нет.")
                     return
-                await message.answer("📋 Активные аренды (оставшееся время):", reply_markup=build_rentals_list_kb(rows))
+                await message.answer(
+                    "📋 Активные аренды (оставшееся время):",
+                    reply_markup=build_rentals_list_kb(page.items, page.has_prev, page.has_next, page.sort),
+                )
                 return
             if text == "📊 Отчёт сейчас":
                 date = moscow_today_str()
@@ -344,12 +345,12 @@ def register_fsm_handlers(router: Router, scheduler) -> None:
                 await message.answer(format_daily_report_with_revenue(date, rows, s))
                 return
             if text == "📚 Каталог":
-                items = await list_tools(limit=50)
-                if not items:
+                page = await list_tools_page()
+                if not page.items:
                     await message.answer("Каталог пуст. Импортируйте CSV или установите цены командой /setprice.")
                     return
                 await state.set_state(EditToolStates.choosing_tool)
-                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(items))
+                await message.answer("📚 Выберите инструмент для редактирования:", reply_markup=build_tools_list_kb(page.items, page.has_prev, page.has_next))
                 return
             if text == "⬆️ Импорт CSV":
                 await message.answer(
@@ -1,8 +1,17 @@
-"""Keyboard builders."""
+"""Keyboard builders.
+
+Keyboards that depend only on their arguments are built once and cached
+(``lru_cache``); the returned objects are shared, so don't modify them.
+"""
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from utils import format_remaining_time
 
+KEYBOARD_CACHE_SIZE = 4096
 
+
+@lru_cache(maxsize=None)
 def build_main_menu() -> ReplyKeyboardMarkup:
     """Создает главное меню."""
     return ReplyKeyboardMarkup(
@@ -15,17 +24,33 @@ def build_main_menu() -> ReplyKeyboardMarkup:
     )
 
 
-def build_rentals_list_kb(rows: list[dict]) -> InlineKeyboardMarkup:
-    """Создает клавиатуру списка аренд."""
+def build_rentals_list_kb(items: list[dict], has_prev: bool = False, has_next: bool = False,
+                          sort: str = "new") -> InlineKeyboardMarkup:
+    """Создает клавиатуру страницы списка аренд (оставшееся время считается только для неё)."""
     buttons = []
-    for r in rows:
-        left = format_remaining_time(int(r["start_time"]))
+    for r in items:
+        left = format_remaining_time(int(r["expires_at"]))
         buttons.append([InlineKeyboardButton(text=f"{r['tool_name']} — {left}", callback_data=f"rental_open:{r['id']}")])
-    buttons.append([InlineKeyboardButton(text="Обновить", callback_data="rentals_refresh")])
+    # Курсор страницы — id крайней аренды (см. database.active_rentals_page)
+    nav = []
+    if has_prev and items:
+        nav.append(InlineKeyboardButton(text="◀️ Пред.", callback_data=f"rentals_page:{sort}:prev:{items[0]['id']}"))
+    if has_next and items:
+        nav.append(InlineKeyboardButton(text="След. ▶️", callback_data=f"rentals_page:{sort}:next:{items[-1]['id']}"))
+    if nav:
+        buttons.append(nav)
+    if sort == "due":
+        toggle = InlineKeyboardButton(text="🆕 Сначала новые", callback_data="rentals_page:new:first:0")
+    else:
+        toggle = InlineKeyboardButton(text="⏳ Сначала истекающие", callback_data="rentals_page:due:first:0")
+    buttons.append([toggle])
+    refresh = f"rentals_refresh:{sort}:{items[0]['id']}" if items else "rentals_refresh"
+    buttons.append([InlineKeyboardButton(text="Обновить", callback_data=refresh)])
     buttons.append([InlineKeyboardButton(text="↩️ В меню", callback_data="back_menu")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def build_rental_menu_kb(rental_id: int) -> InlineKeyboardMarkup:
     """Создает меню для конкретной аренды."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -35,15 +60,33 @@ def build_rental_menu_kb(rental_id: int) -> InlineKeyboardMarkup:
     ])
 
 
-def build_tools_list_kb(items: list[dict]) -> InlineKeyboardMarkup:
-    """Создает клавиатуру списка инструментов."""
+def build_tools_list_kb(items: list[dict], has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
+    """Создает клавиатуру страницы списка инструментов."""
     rows = []
     for it in items:
         rows.append([InlineKeyboardButton(text=f"{it['name']} ({it['price']}₽)", callback_data=f"tool_open:{it['id']}")])
+    # Курсор страницы — id крайнего инструмента (см. database.list_tools_page)
+    nav = []
+    if has_prev and items:
+        nav.append(InlineKeyboardButton(text="◀️ Пред.", callback_data=f"tools_page:prev:{items[0]['id']}"))
+    if has_next and items:
+        nav.append(InlineKeyboardButton(text="След. ▶️", callback_data=f"tools_page:next:{items[-1]['id']}"))
+    if nav:
+        rows.append(nav)
     rows.append([InlineKeyboardButton(text="↩️ Назад", callback_data="back_menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def build_tool_suggestions_kb(items: list[dict]) -> InlineKeyboardMarkup:
+    """Создает клавиатуру похожих позиций каталога для выбора при создании аренды."""
+    rows = []
+    for it in items:
+        rows.append([InlineKeyboardButton(text=f"{it['name']} ({it['price']}₽)", callback_data=f"rent_pick:{it['id']}")])
+    rows.append([InlineKeyboardButton(text="↩️ Отмена", callback_data="back_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def build_tool_menu_kb(tool_id: int) -> InlineKeyboardMarkup:
     """Создает меню для инструмента."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -54,6 +97,7 @@ def build_tool_menu_kb(tool_id: int) -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def build_expiration_keyboard(rental_id: int) -> InlineKeyboardMarkup:
     """Создает клавиатуру для уведомления об истечении аренды."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -64,6 +108,18 @@ def build_expiration_keyboard(rental_id: int) -> InlineKeyboardMarkup:
     ])
 
 
+def build_expiration_digest_kb(rows: list[dict]) -> InlineKeyboardMarkup:
+    """Создает клавиатуру сводного уведомления: по строке кнопок на каждую аренду."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f"✅ {r['tool_name']}", callback_data=f"digest_renew:{r['id']}"),
+            InlineKeyboardButton(text="❌ Забрал", callback_data=f"digest_close:{r['id']}"),
+        ]
+        for r in rows
+    ])
+
+
+@lru_cache(maxsize=None)
 def build_back_menu_kb() -> InlineKeyboardMarkup:
     """Создает кнопку возврата в меню."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -71,6 +127,7 @@ def build_back_menu_kb() -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def build_reset_confirm_kb() -> InlineKeyboardMarkup:
     """Создает клавиатуру подтверждения сброса БД."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -0,0 +1,98 @@
+"""Lease-based leader election over the shared SQLite database."""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from database import acquire_leader_lease, release_leader_lease, sync_external_changes
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+LEASE_TTL_SEC = float(os.getenv("LEADER_LEASE_SEC", "30"))
+
+
+def default_instance_id() -> str:
+    # В Docker hostname = id контейнера, а pid обычно 1: перезапущенный контейнер
+    # сразу возвращает себе свою аренду, не дожидаясь её истечения
+    return os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElector:
+    """Keeps trying to hold the lease; calls ``on_elected`` / ``on_revoked`` on changes.
+
+    The lease is renewed every ``ttl / 3`` seconds. Another replica may take it
+    over only after ``expires_at``, and the current leader steps down on its own
+    once it has failed to renew for ``2 * ttl / 3`` seconds, so two leaders never
+    overlap while the clocks agree. Each heartbeat also reloads the in-memory
+    caches if another replica has written to the database.
+    """
+
+    def __init__(
+        self,
+        on_elected: Callable[[], Awaitable[None]],
+        on_revoked: Callable[[], Awaitable[None]],
+        ttl: float = LEASE_TTL_SEC,
+        instance_id: Optional[str] = None,
+    ) -> None:
+        self.instance_id = instance_id or default_instance_id()
+        self.ttl = ttl
+        self.is_leader = False
+        self._on_elected = on_elected
+        self._on_revoked = on_revoked
+        self._last_renewed = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        # Первая попытка — сразу, чтобы единственная реплика не ждала heartbeat
+        await self._heartbeat()
+        self._task = asyncio.create_task(self._run(), name="leader-elector")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            try:
+                # Отдаём аренду сразу, чтобы другая реплика не ждала ttl
+                await release_leader_lease(LEASE_NAME, self.instance_id)
+            except Exception:
+                logger.exception("Failed to release leader lease")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._heartbeat()
+
+    async def _heartbeat(self) -> None:
+        try:
+            held = await acquire_leader_lease(LEASE_NAME, self.instance_id, self.ttl)
+        except Exception:
+            logger.exception("Leader lease heartbeat failed")
+            if self.is_leader and time.monotonic() - self._last_renewed > self.ttl * 2 / 3:
+                await self._set_leader(False)
+            return
+        if held:
+            self._last_renewed = time.monotonic()
+        # Сбой синхронизации кэшей не должен останавливать продление аренды лидера
+        try:
+            await sync_external_changes()
+        except Exception:
+            logger.exception("Syncing external changes failed")
+        if held != self.is_leader:
+            await self._set_leader(held)
+
+    async def _set_leader(self, leader: bool) -> None:
+        self.is_leader = leader
+        logger.info("Instance %s is %s", self.instance_id, "now the leader" if leader else "no longer the leader")
+        try:
+            await (self._on_elected() if leader else self._on_revoked())
+        except Exception:
+            logger.exception("Leadership change handler failed")
@@ -5,14 +5,19 @@ from contextlib import suppress
 from zoneinfo import ZoneInfo
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
 
-from database import init_db, import_catalog_from_csv
+from database import init_db, close_db, import_catalog_from_csv
+from fsm_storage import SQLiteStorage
 from scheduler import SchedulerService
 from bot_handlers import register_handlers
+from webhook import run_webhook
+
+BOT_MODES = ("polling", "webhook")
 
 
 async def main() -> None:
@@ -36,34 +41,62 @@ async def main() -> None:
     catalog_path = Path("/app/data/catalog.csv")
     if catalog_path.exists():
         try:
-            count = await import_catalog_from_csv(str(catalog_path))
-            logger.info("Imported catalog on startup: %s items", count)
+            result = await import_catalog_from_csv(str(catalog_path))
+            logger.info("Imported catalog on startup: %s items (%s rejected)", result.accepted, result.rejected)
         except Exception:
             logger.exception("Failed to import catalog on startup")
 
     bot_token = os.getenv("BOT_TOKEN")
     if not bot_token:
         raise RuntimeError("BOT_TOKEN is not set in environment")
+    mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    if mode not in BOT_MODES:
+        raise RuntimeError(f"BOT_MODE must be one of {', '.join(BOT_MODES)}, got {mode!r}")
+
+    # Свой адрес Bot API (локальный сервер или заглушка из scripts/webhook_replay.py)
+    api_url = os.getenv("TELEGRAM_API_URL")
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+    bot = Bot(token=bot_token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Незавершённые диалоги (RentalStates и т.п.) переживают перезапуск
+    dp = Dispatcher(storage=SQLiteStorage())
+
+    # Scheduler setup: запускается и останавливается вместе с диспетчером в любом режиме
+    scheduler = SchedulerService(timezone=ZoneInfo(tz_name))
 
-    bot = Bot(token=bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    async def on_startup() -> None:
+        await scheduler.start(bot)
 
-    # Scheduler setup
-    scheduler = SchedulerService(timezone=ZoneInfo(tz_name))
-    await scheduler.start(bot)
+    async def on_shutdown() -> None:
+        with suppress(Exception):
+            await scheduler.shutdown()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     # Register handlers
     register_handlers(dp, scheduler)
 
-    logger.info("Starting polling...")
     try:
-        # Явно укажем типы апдейтов на основе зарегистрированных хэндлеров
-        allowed = dp.resolve_used_update_types()
-        logger.info("Allowed updates: %s", allowed)
-        await dp.start_polling(bot, allowed_updates=allowed)
+        if mode == "webhook":
+            secret = os.getenv("WEBHOOK_SECRET")
+            if not secret:
+                raise RuntimeError("WEBHOOK_SECRET is not set in environment")
+            await run_webhook(
+                dp, bot, scheduler,
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=secret,
+                public_url=os.getenv("WEBHOOK_URL"),
+            )
+        else:
+            logger.info("Starting polling...")
+            # Явно укажем типы апдейтов на основе зарегистрированных хэндлеров
+            allowed = dp.resolve_used_update_types()
+            logger.info("Allowed updates: %s", allowed)
+            await dp.start_polling(bot, allowed_updates=allowed)
     finally:
-        with suppress(Exception):
-            await scheduler.shutdown()
+        await close_db()
         await bot.session.close()
 
 
@@ -0,0 +1,148 @@
+"""Message edits that skip no-op calls to Telegram."""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+logger = logging.getLogger(__name__)
+
+EDIT_CACHE_SIZE = 10000
+STATS_LOG_INTERVAL = 600
+
+
+@dataclass
+class _Shown:
+    text: Optional[int]  # hash текста; None — неизвестен
+    markup: int
+    at: Optional[float]  # edit_date/date этой версии по часам Telegram; None — неизвестно
+
+
+def _telegram_ts(message: Any) -> Optional[float]:
+    """When Telegram last changed the message (its own clock), if known."""
+    edit_date = getattr(message, "edit_date", None)
+    if edit_date:
+        # edit_date приходит числом, date — datetime
+        return float(edit_date)
+    date = getattr(message, "date", None)
+    return date.timestamp() if date is not None else None
+
+
+def _markup_hash(markup: Optional[InlineKeyboardMarkup]) -> int:
+    return hash(markup.model_dump_json(exclude_none=True)) if markup is not None else 0
+
+
+class MessageEditor:
+    """Remembers what each (chat, message) shows and edits only when it changes.
+
+    The last text and keyboard are kept as hashes for up to ``max_messages``
+    messages (LRU). For a message we haven't edited yet, the state is taken
+    from the ``Message`` object itself, e.g. ``callback.message``; the same
+    happens when that object is newer than our record (edited elsewhere, for
+    example by another replica). "Newer" compares Telegram's own timestamps
+    only: the record keeps the ``edit_date`` Telegram returned for our edit,
+    never the local clock. Text and keyboard always go out in one
+    ``editMessageText`` call.
+    """
+
+    def __init__(self, max_messages: int = EDIT_CACHE_SIZE) -> None:
+        self.max_messages = max_messages
+        self._shown: "OrderedDict[Tuple[int, int], _Shown]" = OrderedDict()
+        self.calls = 0
+        self.skipped = 0  # одинаковые правки, отброшенные без запроса
+        self.merged = 0  # текст и клавиатура изменены одним запросом вместо двух
+        self.not_modified = 0  # Telegram всё же ответил «message is not modified»
+        self._stats_since = time.monotonic()
+
+    def _current(self, key: Tuple[int, int], message: Message) -> Optional[_Shown]:
+        shown = self._shown.get(key)
+        if getattr(message, "text", None) is None:
+            return shown
+        message_ts = _telegram_ts(message)
+        if shown is None or (message_ts is not None and (shown.at is None or message_ts > shown.at)):
+            return _Shown(hash(message.html_text), _markup_hash(message.reply_markup), message_ts)
+        return shown
+
+    def _remember(self, key: Tuple[int, int], shown: _Shown) -> None:
+        self._shown[key] = shown
+        self._shown.move_to_end(key)
+        while len(self._shown) > self.max_messages:
+            self._shown.popitem(last=False)
+
+    async def edit(
+        self,
+        message: Message,
+        text: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        **kwargs: Any,
+    ) -> bool:
+        """Show ``text`` (if given) and ``reply_markup`` in ``message``; False if nothing changed.
+
+        As in the Bot API, editing the text without ``reply_markup`` removes
+        the keyboard.
+        """
+        key = (message.chat.id, message.message_id)
+        text_hash = hash(text) if text is not None else None
+        markup_hash = _markup_hash(reply_markup)
+        current = self._current(key, message)
+        if current is not None and current.markup == markup_hash and (text is None or current.text == text_hash):
+            self.skipped += 1
+            self._record()
+            return False
+
+        # Без ответа Telegram (инлайн-сообщения, «not modified») остаётся известная нам версия
+        at = current.at if current is not None else None
+        try:
+            if text is None:
+                result = await message.edit_reply_markup(reply_markup=reply_markup)
+                text_hash = current.text if current is not None else None
+            else:
+                result = await message.edit_text(text, reply_markup=reply_markup, **kwargs)
+                if current is not None and current.text != text_hash and current.markup != markup_hash:
+                    self.merged += 1
+            at = _telegram_ts(result) or at
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                self._shown.pop(key, None)
+                raise
+            self.not_modified += 1
+        self.calls += 1
+        self._remember(key, _Shown(text_hash, markup_hash, at))
+        self._record()
+        return True
+
+    def _record(self) -> None:
+        now = time.monotonic()
+        if now - self._stats_since >= STATS_LOG_INTERVAL:
+            logger.info("Message edits: %s", self.stats())
+            self._stats_since = now
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "merged": self.merged,
+            "not_modified": self.not_modified,
+            "saved": self.skipped + self.merged,
+            "tracked": len(self._shown),
+        }
+
+
+_editor = MessageEditor()
+
+
+async def edit_message(
+    message: Message,
+    text: Optional[str] = None,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    **kwargs: Any,
+) -> bool:
+    """Edit through the shared MessageEditor; see MessageEditor.edit."""
+    return await _editor.edit(message, text, reply_markup, **kwargs)
+
+
+def edit_stats() -> Dict[str, int]:
+    return _editor.stats()
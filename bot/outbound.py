@@ -0,0 +1,334 @@
+"""Rate-limited, prioritized outbound queue for messages the bot sends on its own."""
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter, TelegramUnauthorizedError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Меньше — важнее
+PRIORITY_EXPIRATION = 0
+PRIORITY_REPORT = 10
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат.
+# rate + burst <= 30, чтобы ни в одном секундном окне не выйти за лимит
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 5
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+MAX_RETRY_AFTER_ATTEMPTS = 3
+STATS_LOG_INTERVAL = 60.0
+
+# Повторы недоставленных сообщений (см. SchedulerService._retry_outbox)
+RETRY_BASE_SEC = 30
+RETRY_MAX_SEC = 2 * 3600
+RETRY_MAX_ATTEMPTS = 8
+
+# Повтор не поможет: бота заблокировали, чат не найден, сообщение некорректно
+_PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+def is_retriable(exc: BaseException) -> bool:
+    return not isinstance(exc, _PERMANENT_ERRORS)
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with "equal jitter" for the given 1-based attempt.
+
+    Half of the exponential step is fixed and half is random, so retries of a
+    failure burst spread out instead of hitting Telegram in lockstep.
+    """
+    step = min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** (attempt - 1))
+    return step / 2 + random.uniform(0, step / 2)
+
+
+class TokenBucket:
+    """Classic token bucket; time is passed in so one clock reading serves many buckets."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        paused = max(0.0, self.updated - now)
+        return paused + (0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate)
+
+    def pause(self, until: float) -> None:
+        """No tokens before ``until``; afterwards the bucket restarts with one token."""
+        if until > self.updated:
+            self.updated = until
+            self.tokens = min(self.tokens, 1.0)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "seq", "enqueued", "future", "attempts")
+
+    def __init__(self, chat_id: int, text: str, kwargs: Dict[str, Any], priority: int, seq: int, future: asyncio.Future) -> None:
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = future
+        self.attempts = 0
+
+
+class _ChatQueue:
+    __slots__ = ("bucket", "heap", "paused_until")
+
+    def __init__(self, now: float) -> None:
+        self.bucket = TokenBucket(CHAT_RATE, CHAT_BURST, now)
+        self.heap: List[Tuple[int, int, _Outgoing]] = []  # (priority, seq, message)
+        self.paused_until = 0.0
+
+    def head(self) -> Tuple[int, int]:
+        return self.heap[0][0], self.heap[0][1]
+
+
+class OutboundDispatcher:
+    """Sends queued messages under a global and a per-chat token bucket.
+
+    Each chat has its own priority queue. Chats whose next message can go out
+    now sit in a ready heap ordered by that message's (priority, seq), so an
+    expiration notice overtakes queued reports, while chats waiting for a
+    per-chat token or a ``retry_after`` sit in a wake-up heap and do not block
+    anyone else. On ``TelegramRetryAfter`` the message goes back to its
+    original position and both that chat and the global bucket are paused:
+    Telegram's flood wait may apply to the whole bot, and nothing in the error
+    tells the two apart.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self.bot = bot
+        now = time.monotonic()
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST, now)
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._ready: List[Tuple[int, int, int]] = []  # (priority, seq, chat_id), устаревшие пропускаются
+        self._sleeping: List[Tuple[float, int]] = []  # (wake_at, chat_id)
+        self._seq = 0
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._sends: Dict[asyncio.Task, _Outgoing] = {}  # отправки в процессе
+        # Статистика за интервал STATS_LOG_INTERVAL
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._stats_since = now
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), name="outbound-dispatcher")
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Give queued messages up to ``timeout`` seconds to go out, then drop the rest."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        dropped = 0
+        sends, self._sends = self._sends, {}
+        for task, msg in sends.items():
+            task.cancel()
+            if not msg.future.done():
+                msg.future.cancel()
+            dropped += 1
+        await asyncio.gather(*sends, return_exceptions=True)
+        for chat in self._chats.values():
+            for _, _, msg in chat.heap:
+                if not msg.future.done():
+                    msg.future.cancel()
+                dropped += 1
+        self._chats.clear()
+        self._ready.clear()
+        self._sleeping.clear()
+        self._pending = 0
+        if dropped:
+            logger.warning("Outbound dispatcher stopped with %s undelivered messages", dropped)
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_REPORT, **kwargs: Any) -> asyncio.Future:
+        """Queue a ``send_message`` call; the future resolves to its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        msg = _Outgoing(chat_id, text, kwargs, priority, self._seq, future)
+        self._enqueue(msg)
+        return future
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_REPORT, **kwargs: Any) -> Any:
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        by_priority: Dict[int, int] = {}
+        oldest = 0.0
+        now = time.monotonic()
+        for chat in self._chats.values():
+            for priority, _, msg in chat.heap:
+                by_priority[priority] = by_priority.get(priority, 0) + 1
+                oldest = max(oldest, now - msg.enqueued)
+        return {
+            "queued": self._pending,
+            "queued_by_priority": by_priority,
+            "oldest_wait": round(oldest, 3),
+            "sent": self._sent,
+            "failed": self._failed,
+            "retried": self._retried,
+            "latency_avg": round(self._latency_sum / self._sent, 3) if self._sent else 0.0,
+            "latency_max": round(self._latency_max, 3),
+        }
+
+    def _enqueue(self, msg: _Outgoing) -> None:
+        chat = self._chats.get(msg.chat_id)
+        if chat is None:
+            chat = self._chats[msg.chat_id] = _ChatQueue(time.monotonic())
+        heapq.heappush(chat.heap, (msg.priority, msg.seq, msg))
+        self._pending += 1
+        if chat.heap[0][2] is msg:
+            # Новая голова очереди чата — перепланируем чат (старая запись в ready станет устаревшей)
+            self._schedule_chat(msg.chat_id, chat, time.monotonic())
+        self._wakeup.set()
+
+    def _schedule_chat(self, chat_id: int, chat: _ChatQueue, now: float) -> None:
+        wait = max(chat.paused_until - now, chat.bucket.delay(now))
+        if wait > 0:
+            heapq.heappush(self._sleeping, (now + wait, chat_id))
+        else:
+            priority, seq = chat.head()
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+    def _wake_sleeping(self, now: float) -> None:
+        while self._sleeping and self._sleeping[0][0] <= now:
+            _, chat_id = heapq.heappop(self._sleeping)
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.heap:
+                self._schedule_chat(chat_id, chat, now)
+
+    def _pop_ready(self, now: float) -> Optional[_Outgoing]:
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or not chat.heap or chat.head() != (priority, seq):
+                continue  # Устаревшая запись
+            if chat.paused_until > now or chat.bucket.delay(now) > 0:
+                self._schedule_chat(chat_id, chat, now)
+                continue
+            _, _, msg = heapq.heappop(chat.heap)
+            self._pending -= 1
+            chat.bucket.take(now)
+            if chat.heap:
+                self._schedule_chat(chat_id, chat, now)
+            elif chat.bucket.full(now):
+                del self._chats[chat_id]
+            return msg
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._maybe_log_stats(now)
+            self._wake_sleeping(now)
+            if not self._ready:
+                timeout = self._sleeping[0][0] - now if self._sleeping else STATS_LOG_INTERVAL
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = self._global.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            msg = self._pop_ready(now)
+            if msg is None:
+                continue
+            self._global.take(now)
+            task = asyncio.create_task(self._deliver(msg))
+            self._sends[task] = msg
+            task.add_done_callback(lambda t: self._sends.pop(t, None))
+
+    async def _deliver(self, msg: _Outgoing) -> None:
+        if msg.future.cancelled():
+            return
+        msg.attempts += 1
+        try:
+            result = await self.bot.send_message(chat_id=msg.chat_id, text=msg.text, **msg.kwargs)
+        except TelegramRetryAfter as e:
+            if msg.attempts >= MAX_RETRY_AFTER_ATTEMPTS:
+                self._failed += 1
+                if not msg.future.done():
+                    msg.future.set_exception(e)
+                return
+            self._retried += 1
+            logger.warning("Flood control for chat %s: retry after %ss", msg.chat_id, e.retry_after)
+            chat = self._chats.get(msg.chat_id)
+            if chat is None:
+                chat = self._chats[msg.chat_id] = _ChatQueue(time.monotonic())
+            chat.paused_until = time.monotonic() + e.retry_after
+            self._global.pause(chat.paused_until)
+            # Возвращаем на прежнее место в очереди чата
+            heapq.heappush(chat.heap, (msg.priority, msg.seq, msg))
+            self._pending += 1
+            self._schedule_chat(msg.chat_id, chat, time.monotonic())
+            self._wakeup.set()
+            return
+        except Exception as e:
+            self._failed += 1
+            if not msg.future.done():
+                msg.future.set_exception(e)
+            return
+        latency = time.monotonic() - msg.enqueued
+        self._sent += 1
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+        if not msg.future.done():
+            msg.future.set_result(result)
+
+    def _maybe_log_stats(self, now: float) -> None:
+        if now - self._stats_since < STATS_LOG_INTERVAL:
+            return
+        if self._sent or self._failed or self._pending:
+            logger.info("Outbound queue: %s", self.stats())
+        # Забываем простаивающие чаты, чтобы словарь не рос бесконечно
+        for chat_id in [c for c, q in self._chats.items() if not q.heap and q.paused_until <= now and q.bucket.full(now)]:
+            del self._chats[chat_id]
+        self._sent = self._failed = self._retried = 0
+        self._latency_sum = self._latency_max = 0.0
+        self._stats_since = now
@@ -0,0 +1,71 @@
+"""Per-user daily report slots, ordered by time of day."""
+import bisect
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DAY_SEC = 24 * 3600
+DEFAULT_REPORT_MINUTE = 21 * 60  # 21:00, как был устроен общий cron
+
+
+def jitter_offset(user_id: int, window_sec: int) -> int:
+    """Stable per-user offset in [0, window_sec); same on every restart and replica."""
+    if window_sec <= 0:
+        return 0
+    return zlib.crc32(str(int(user_id)).encode()) % window_sec
+
+
+class ReportSchedule:
+    """Report slot (second of the local day) for every known user.
+
+    A user's slot is their preferred minute plus a deterministic jitter inside
+    ``window_sec``, so users sharing the default 21:00 are spread over the
+    window instead of all firing at once. Slots live in a sorted list, so one
+    recurring job can fetch everyone due in a time range with two bisects.
+    """
+
+    def __init__(self, window_sec: int) -> None:
+        self.window_sec = window_sec
+        self._minutes: Dict[int, int] = {}  # user_id -> предпочтительная минута суток
+        self._slots: List[Tuple[int, int]] = []  # (slot, user_id), по возрастанию
+
+    def __len__(self) -> int:
+        return len(self._minutes)
+
+    def __contains__(self, user_id: int) -> bool:
+        return int(user_id) in self._minutes
+
+    def slot_for(self, user_id: int, minute: int) -> int:
+        return (minute * 60 + jitter_offset(user_id, self.window_sec)) % DAY_SEC
+
+    def load(self, prefs: Iterable[Tuple[int, int]]) -> None:
+        self._minutes = {int(uid): int(minute) for uid, minute in prefs}
+        self._slots = sorted((self.slot_for(uid, minute), uid) for uid, minute in self._minutes.items())
+
+    def set(self, user_id: int, minute: int) -> None:
+        user_id = int(user_id)
+        old = self._minutes.get(user_id)
+        if old == minute:
+            return
+        if old is not None:
+            del self._slots[bisect.bisect_left(self._slots, (self.slot_for(user_id, old), user_id))]
+        self._minutes[user_id] = minute
+        bisect.insort(self._slots, (self.slot_for(user_id, minute), user_id))
+
+    def remove(self, user_id: int) -> None:
+        user_id = int(user_id)
+        old = self._minutes.pop(user_id, None)
+        if old is not None:
+            del self._slots[bisect.bisect_left(self._slots, (self.slot_for(user_id, old), user_id))]
+
+    def minute(self, user_id: int) -> Optional[int]:
+        return self._minutes.get(int(user_id))
+
+    def slot(self, user_id: int) -> Optional[int]:
+        minute = self._minutes.get(int(user_id))
+        return self.slot_for(user_id, minute) if minute is not None else None
+
+    def due(self, start: int, end: int) -> List[int]:
+        """Users whose slot is in ``[start, end)``, both seconds of the same day."""
+        lo = bisect.bisect_left(self._slots, (start,))
+        hi = bisect.bisect_left(self._slots, (end,))
+        return [uid for _, uid in self._slots[lo:hi]]
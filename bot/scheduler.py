@@ -1,120 +1,445 @@
+import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
 from zoneinfo import ZoneInfo
 
 from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 import os
-from database import get_rental_by_id, all_active_for_reschedule, get_active_rentals, sum_revenue_by_date_for_user
-from utils import ts_to_moscow_date_str, moscow_today_str, format_daily_report_with_revenue
+from database import (
+    get_rental_by_id, active_rentals_by_user, revenue_by_user_for_date, sum_revenue_by_date,
+    report_users_due, get_scheduler_state, set_scheduler_state, expirations_for, sync_external_changes,
+    mark_expirations_notified, expirations_due_before, count_expirations, on_external_change, prune_change_log,
+    add_outbox_message, outbox_due, finish_outbox_attempts, count_outbox,
+)
+from expiry import ExpiryEngine
+from leader import LeaderElector
+from report_schedule import DAY_SEC, DEFAULT_REPORT_MINUTE
+from outbound import (
+    OutboundDispatcher, PRIORITY_EXPIRATION, PRIORITY_REPORT, RETRY_MAX_ATTEMPTS, is_retriable, retry_delay,
+)
+from utils import ts_to_moscow_date_str, moscow_today_str, format_daily_report_with_revenue, format_expiration_digest
 
 logger = logging.getLogger(__name__)
 
+# В памяти держим только истечения ближайшего окна, остальные подгружаются из БД
+EXPIRY_WINDOW_SEC = int(os.getenv("EXPIRY_WINDOW_HOURS", "6")) * 3600
+EXPIRY_REFILL_MINUTES = 30
+# Истечения одного пользователя, сработавшие в течение DIGEST_DELAY секунд или
+# наступающие в ближайшие DIGEST_WINDOW секунд, уходят одним сводным сообщением
+EXPIRY_DIGEST_DELAY_SEC = 2.0
+EXPIRY_DIGEST_WINDOW_SEC = 120
+# Недоставленные сообщения: как часто и какими порциями повторять
+OUTBOX_POLL_SEC = 15
+OUTBOX_BATCH = 50
+# Сколько отчётов одновременно ждут отправки (темп всё равно задаёт dispatcher)
+REPORT_CONCURRENCY = 32
+# Ежедневные отчёты: раз в минуту забираем пользователей, чей слот наступил
+REPORT_CURSOR_KEY = "report_cursor"
+REPORT_CATCHUP_SEC = 3600
+
 
 class SchedulerService:
     def __init__(self, timezone: ZoneInfo) -> None:
         self.timezone = timezone
         self.scheduler = AsyncIOScheduler(timezone=self.timezone)
+        # Истечения аренд — одна куча дедлайнов и один таймер, а не job на каждую аренду
+        self.expiry = ExpiryEngine(self._on_rental_expired)
+        # До этого момента (POSIX) все сохранённые истечения уже загружены в expiry
+        self._loaded_until = 0.0
+        # user_id -> {rental_id: tool_name}, ждущие отправки сводки
+        self._digest: Dict[int, Dict[int, str]] = {}
         self.bot: Optional[Bot] = None
+        # Все сообщения, которые бот шлёт сам, идут через очередь с лимитами Telegram
+        self.dispatcher: Optional[OutboundDispatcher] = None
+        # Задачи выполняет только реплика-лидер; остальные лишь обрабатывают апдейты
+        self.elector = LeaderElector(self._on_elected, self._on_revoked)
+        # Аренды, созданные или продлённые другой репликой, лидер подгружает сразу,
+        # как увидит её запись (не позже heartbeat), а не только при плановом refill
+        self._refill_task: Optional[asyncio.Task] = None
+        on_external_change(self._on_external_change)
 
     async def start(self, bot: Bot) -> None:
+        started = time.monotonic()
         self.bot = bot
-        self.scheduler.start()
-        # Daily report at 21:00 local TZ (from env)
+        self.dispatcher = OutboundDispatcher(bot)
+        self.dispatcher.start()
+        # Задачи добавляются сразу, но выполняются, только пока эта реплика — лидер
+        self.scheduler.start(paused=True)
+        # Daily reports: one job every minute walks the per-user slots (see report_schedule.py)
         self.scheduler.add_job(
-            self._send_daily_report_job,
-            CronTrigger(hour=21, minute=0, timezone=self.timezone),
+            self._report_tick,
+            CronTrigger(second=0, timezone=self.timezone),
             id="daily_report",
             replace_existing=True,
+            max_instances=1,
+            coalesce=True,
         )
         # Nightly flush removed - revenue is now recorded at rental creation
-        # Reschedule expiration for existing active rentals
-        await self._reschedule_all_active()
-        logger.info("Scheduler started with timezone %s", self.timezone)
+        # Load deadlines due within the window from rentals.expires_at; the rest is loaded lazily
+        self.scheduler.add_job(
+            self._load_expirations,
+            IntervalTrigger(minutes=EXPIRY_REFILL_MINUTES, timezone=self.timezone),
+            id="expirations_refill",
+            replace_existing=True,
+        )
+        # Журнал изменений для синхронизации реплик: старые записи больше никому не нужны
+        self.scheduler.add_job(
+            self._prune_change_log,
+            IntervalTrigger(hours=1, timezone=self.timezone),
+            id="change_log_prune",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        self.scheduler.add_job(
+            self._retry_outbox,
+            IntervalTrigger(seconds=OUTBOX_POLL_SEC, timezone=self.timezone),
+            id="outbox_retry",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        await self.elector.start()
+        logger.info(
+            "Scheduler started with timezone %s in %.3fs as %s (%s)",
+            self.timezone, time.monotonic() - started, self.elector.instance_id,
+            "leader" if self.elector.is_leader else "follower",
+        )
+
+    async def _on_elected(self) -> None:
+        started = time.monotonic()
+        self.expiry.start()
+        await self._load_expirations()
+        self.scheduler.resume()
+        outbox = await count_outbox()
+        logger.info(
+            "Scheduled jobs taken over in %.3fs: %s expirations in memory, %s pending in DB, outbox %s pending / %s dead",
+            time.monotonic() - started, len(self.expiry), await count_expirations(),
+            outbox["pending"], outbox["dead"],
+        )
+
+    async def _on_revoked(self) -> None:
+        self.scheduler.pause()
+        self.expiry.stop()
+        self.expiry.clear()
+        self._loaded_until = 0.0
+        self._digest.clear()
 
     async def shutdown(self) -> None:
+        await self.elector.stop()
+        self.expiry.stop()
         self.scheduler.shutdown(wait=False)
+        if self.dispatcher is not None:
+            await self.dispatcher.stop()
+
+    async def _prune_change_log(self) -> None:
+        removed = await prune_change_log()
+        if removed:
+            logger.info("Change log pruned: %s entries", removed)
 
-    async def _reschedule_all_active(self) -> None:
-        rows = await all_active_for_reschedule()
+    async def _load_expirations(self) -> None:
+        """Move pending deadlines due within the window into the in-memory engine."""
+        horizon = time.time() + EXPIRY_WINDOW_SEC
+        rows = await expirations_due_before(int(horizon))
+        loaded = 0
         for r in rows:
-            await self.schedule_expiration_notification(r["id"], r["start_time"], r["user_id"], r["tool_name"])  # type: ignore[arg-type]
+            rental_id = int(r["id"])
+            run_at = self._run_at(int(r["expires_at"]))
+            current = self.expiry.deadline(rental_id)
+            if current is not None and current <= run_at:
+                continue  # Уже запланировано в этом процессе (не позже, чем в БД)
+            self.expiry.schedule(rental_id, run_at, (int(r["user_id"]), r["tool_name"]))
+            loaded += 1
+        self._loaded_until = horizon
+        logger.log(
+            logging.INFO if loaded else logging.DEBUG,
+            "Expirations loaded: %s new within %sh window", loaded, EXPIRY_WINDOW_SEC // 3600,
+        )
 
-    async def schedule_expiration_notification(self, rental_id: int, start_time_ts: int, user_id: int, tool_name: str) -> None:
-        if self.bot is None:
-            raise RuntimeError("Scheduler bot not initialized")
-        # Next execution is 24h after start_time
-        dt = datetime.fromtimestamp(start_time_ts, tz=self.timezone) + timedelta(hours=24)
+    def _on_external_change(self) -> None:
+        if not self.elector.is_leader or self.bot is None:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_after_external_change(), name="expirations-refill")
+
+    async def _refill_after_external_change(self) -> None:
+        try:
+            await self._load_expirations()
+        except Exception:
+            logger.exception("Failed to load expirations written by another replica")
+
+    @staticmethod
+    def _run_at(deadline: int) -> float:
         # If time already passed, schedule immediate run (1 minute later to avoid flood)
-        run_time = max(dt, datetime.now(tz=self.timezone) + timedelta(minutes=1))
-        job_id = f"expire_{rental_id}"
-        self.scheduler.add_job(
-            self._expiration_job,
-            DateTrigger(run_date=run_time, timezone=self.timezone),
-            id=job_id,
-            kwargs={"rental_id": rental_id, "user_id": user_id, "tool_name": tool_name},
-            replace_existing=True,
-        )
-        logger.info("Scheduled expiration: rental_id=%s at %s", rental_id, run_time.isoformat())
+        return max(float(deadline), time.time() + 60)
 
-    async def _expiration_job(self, rental_id: int, user_id: int, tool_name: str) -> None:
+    async def schedule_expiration_notification(self, rental_id: int, expires_at: int, user_id: int, tool_name: str) -> None:
+        """Arm the timer for a deadline already stored in rentals.expires_at.
+
+        Only the leader holds a window (``_loaded_until``); on a follower this
+        just drops any local timer, and the leader loads the deadline from the
+        database on its next heartbeat (see ``_on_external_change``).
+        """
         if self.bot is None:
+            raise RuntimeError("Scheduler bot not initialized")
+        run_at = self._run_at(int(expires_at))
+        if run_at <= self._loaded_until:
+            self.expiry.schedule(rental_id, run_at, (user_id, tool_name))
+        else:
+            # За пределами окна: подгрузит _load_expirations
+            self.expiry.cancel(rental_id)
+        logger.debug("Scheduled expiration: rental_id=%s at %s", rental_id, datetime.fromtimestamp(run_at, tz=self.timezone).isoformat())
+
+    async def cancel_expiration_notification(self, rental_id: int) -> None:
+        # Закрытая аренда выпадает из выборки по active = 1, в БД чистить нечего
+        self.expiry.cancel(rental_id)
+
+    async def _on_rental_expired(self, rental_id: int, payload: tuple) -> None:
+        user_id, tool_name = payload
+        pending = self._digest.get(user_id)
+        if pending is not None:
+            # Сводка для пользователя уже собирается — просто добавляемся в неё
+            pending[rental_id] = tool_name
             return
+        self._digest[user_id] = {rental_id: tool_name}
+        try:
+            await asyncio.sleep(EXPIRY_DIGEST_DELAY_SEC)
+        except asyncio.CancelledError:
+            self._digest.pop(user_id, None)
+            raise
+        await self._flush_expirations(user_id)
+
+    async def _flush_expirations(self, user_id: int) -> None:
+        batch = self._digest.pop(user_id, {})
+        horizon = int(time.time()) + EXPIRY_DIGEST_WINDOW_SEC
+        # Забираем из таймера и ближайшие истечения того же пользователя
+        for rental_id, (uid, tool_name) in self.expiry.due_before(horizon):
+            if uid == user_id:
+                self.expiry.cancel(rental_id)
+                batch[rental_id] = tool_name
+        # Другая реплика могла продлить, закрыть аренду или уже уведомить: сверяемся с rentals
+        await sync_external_changes()
+        pending = await expirations_for(batch)
+        for rental_id in list(batch):
+            expires_at = pending.get(rental_id)
+            if expires_at is not None and expires_at > horizon:
+                tool_name = batch.pop(rental_id)
+                if self._run_at(expires_at) <= self._loaded_until:
+                    self.expiry.schedule(rental_id, self._run_at(expires_at), (user_id, tool_name))
+            elif expires_at is None:
+                del batch[rental_id]
+        rows = []
+        for rental_id in sorted(batch):
+            # Аренду могли закрыть, не отменив таймер (например, сбросом БД)
+            row = await get_rental_by_id(rental_id)
+            if row and int(row.get("active", 0)) == 1:
+                rows.append(row)
+        handled = True
+        if len(rows) == 1:
+            handled = await self._expiration_job(rental_id=int(rows[0]["id"]), user_id=user_id, tool_name=rows[0]["tool_name"])
+        elif rows:
+            handled = await self._expiration_digest_job(user_id, rows)
+        # Отмечаем только доставленное или сохранённое в outbox. Если отправку
+        # отменили (выключение, потеря лидерства) или outbox недоступен, аренды
+        # остаются неуведомлёнными и снова попадут в таймер при следующей загрузке.
+        # Продление за это время сдвинуло expires_at в будущее — такие аренды не отмечаем.
+        if handled:
+            await mark_expirations_notified(batch, due_before=horizon)
+
+    async def _expiration_job(self, rental_id: int, user_id: int, tool_name: str) -> bool:
+        """Send one expiration notice; True if it was delivered or parked in the outbox."""
+        if self.bot is None:
+            return False
         text = (
             f"⏰ Аренда инструмента \"{tool_name}\" закончилась.\n"
             f"Что хотите сделать?"
         )
-        from bot_handlers import build_expiration_keyboard  # lazy import to avoid cycles
+        from handlers import build_expiration_keyboard  # lazy import to avoid cycles
         kb = build_expiration_keyboard(rental_id)
         try:
-            await self.bot.send_message(chat_id=user_id, text=text, reply_markup=kb)
+            await self.dispatcher.send(user_id, text, PRIORITY_EXPIRATION, reply_markup=kb)
+        except Exception as e:
+            return await self._park_failed(user_id, text, PRIORITY_EXPIRATION, e, reply_markup=kb, rental_ids=[rental_id])
+        return True
+
+    async def _expiration_digest_job(self, user_id: int, rows: list) -> bool:
+        """Send one digest for ``rows``; True if it was delivered or parked in the outbox."""
+        if self.bot is None:
+            return False
+        from handlers import build_expiration_digest_kb  # lazy import to avoid cycles
+        text = format_expiration_digest(rows)
+        kb = build_expiration_digest_kb(rows)
+        try:
+            await self.dispatcher.send(user_id, text, PRIORITY_EXPIRATION, reply_markup=kb)
         except Exception as e:
-            logger.exception("Failed to send expiration notification: %s", e)
+            return await self._park_failed(user_id, text, PRIORITY_EXPIRATION, e, reply_markup=kb, rental_ids=[r["id"] for r in rows])
+        logger.info("Expiration digest sent: user=%s rentals=%s", user_id, len(rows))
+        return True
+
+    async def _report_tick(self) -> None:
+        """Send reports to users whose slot passed since the last tick.
 
-    async def _send_daily_report_job(self) -> None:
+        Runs every minute; the cursor is persisted so a restart inside the
+        window does not lose reports (but catches up at most REPORT_CATCHUP_SEC).
+        """
         if self.bot is None:
             return
-        # In this simple implementation we send daily report to each user who has active rentals right now.
-        # For a minimal MVP, we'll deduplicate by user ids present in active rentals.
-        from database import get_active_rentals
-        from utils import format_daily_report
+        await sync_external_changes()
+        now = time.time()
+        stored = await get_scheduler_state(REPORT_CURSOR_KEY)
+        cursor = float(stored) if stored else now - 60
+        cursor = max(cursor, now - REPORT_CATCHUP_SEC)
+        while cursor < now:
+            # Слоты — секунды локальных суток; окно через полночь режем на два
+            local = datetime.fromtimestamp(cursor, tz=self.timezone)
+            midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            day_end = (midnight + timedelta(days=1)).timestamp()
+            seg_end = min(now, day_end)
+            start_sec = int(cursor - midnight.timestamp())
+            end_sec = int(seg_end - midnight.timestamp()) if seg_end < day_end else DAY_SEC
+            date = local.strftime("%Y-%m-%d")
+            user_ids = await report_users_due(start_sec, end_sec)
+            if user_ids:
+                await self._send_reports(date, user_ids)
+            if start_sec <= DEFAULT_REPORT_MINUTE * 60 < end_sec:
+                await self._send_admin_report(date)
+            cursor = seg_end
+        await set_scheduler_state(REPORT_CURSOR_KEY, repr(now))
 
-        rows = await get_active_rentals()
-        # Collect unique users
-        user_ids = sorted({int(r["user_id"]) for r in rows})
-        for uid in user_ids:
-            user_rows = [r for r in rows if int(r["user_id"]) == uid]
-            date = moscow_today_str()
-            revenue_sum = await sum_revenue_by_date_for_user(date, uid)
-            text = format_daily_report_with_revenue(date, user_rows, revenue_sum)
-            try:
-                await self.bot.send_message(chat_id=uid, text=text)
-            except Exception as e:
-                logger.exception("Failed to send daily report to %s: %s", uid, e)
+    async def _send_reports(self, date: str, user_ids: Optional[List[int]] = None) -> None:
+        started = time.monotonic()
+        # Отчёт получают пользователи с активными арендами: аренды сгруппированы
+        # по пользователю за один проход, выручка — одним запросом
+        by_user = await active_rentals_by_user()
+        if user_ids is not None:
+            by_user = {uid: by_user[uid] for uid in user_ids if uid in by_user}
+        if not by_user:
+            return
+        revenue = await revenue_by_user_for_date(date, None if user_ids is None else list(by_user))
+        users = iter(by_user.items())
+        failed = 0
 
-        # Optional: send copy to admin if ADMIN_ID is set
-        admin_id = os.getenv("ADMIN_ID")
-        if admin_id:
-            try:
-                admin_uid = int(admin_id)
-            except ValueError:
-                admin_uid = None
-            if admin_uid:
-                date = moscow_today_str()
-                # Сводим по всем пользователям (для админа)
+        async def worker() -> None:
+            nonlocal failed
+            # Общий итератор: каждый пользователь достаётся ровно одному воркеру
+            for uid, user_rows in users:
+                text = format_daily_report_with_revenue(date, user_rows, revenue.get(uid, 0))
                 try:
-                    # Простой суммарный доход админа за дату = сумма по всем users: используем уже посчитанную сумму частями
-                    # Для простоты — посчитаем ещё раз по БД, но без user_id (сумма по всем)
-                    from database import sum_revenue_by_date
-                    total_rev = await sum_revenue_by_date(date)
-                    text = f"📢 Админ-отчёт\n📅 {date}\n💵 Суммарная выручка: {total_rev}₽"
-                    await self.bot.send_message(chat_id=admin_uid, text=text)
+                    await self.dispatcher.send(uid, text, PRIORITY_REPORT)
+                except asyncio.CancelledError as e:
+                    # При остановке dispatcher отменяет future неотправленных — такой отчёт
+                    # паркуем. Отмену самого воркера (и _report_tick) не глотаем.
+                    if asyncio.current_task().cancelling():
+                        raise
+                    failed += 1
+                    await self._park_failed(uid, text, PRIORITY_REPORT, e)
                 except Exception as e:
-                    logger.exception("Failed to send admin daily report: %s", e)
+                    failed += 1
+                    await self._park_failed(uid, text, PRIORITY_REPORT, e)
+
+        await asyncio.gather(*(worker() for _ in range(min(REPORT_CONCURRENCY, len(by_user)))))
+        logger.info(
+            "Daily report for %s: %s users, %s failed, %.3fs",
+            date, len(by_user), failed, time.monotonic() - started,
+        )
+
+    async def _send_admin_report(self, date: str) -> None:
+        # Optional: send copy to admin if ADMIN_ID is set
+        admin_id = os.getenv("ADMIN_ID")
+        if not admin_id:
+            return
+        try:
+            admin_uid = int(admin_id)
+        except ValueError:
+            return
+        # Сводим по всем пользователям (для админа)
+        total_rev = await sum_revenue_by_date(date)
+        text = f"📢 Админ-отчёт\n📅 {date}\n💵 Суммарная выручка: {total_rev}₽"
+        try:
+            await self.dispatcher.send(admin_uid, text, PRIORITY_REPORT)
+        except Exception as e:
+            await self._park_failed(admin_uid, text, PRIORITY_REPORT, e)
+
+    # --- Outbox of failed deliveries ---
+    async def _park_failed(
+        self,
+        chat_id: int,
+        text: str,
+        priority: int,
+        error: BaseException,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        rental_ids: Iterable[int] = (),
+    ) -> bool:
+        """Persist a failed send for a later retry instead of losing it.
+
+        Returns False only if it could not be persisted; a message that no
+        retry would deliver (bot blocked, bad request) counts as handled.
+        """
+        if not is_retriable(error):
+            logger.error("Dropping message to %s, not retriable: %r", chat_id, error)
+            return True
+        try:
+            await add_outbox_message(
+                chat_id,
+                text,
+                next_attempt_at=int(time.time() + retry_delay(1)),
+                reply_markup=reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None,
+                priority=priority,
+                rental_ids=",".join(str(i) for i in rental_ids) or None,
+                last_error=repr(error),
+            )
+        except Exception:
+            logger.exception("Failed to persist undelivered message to %s", chat_id)
+            return False
+        logger.warning("Delivery to %s failed, queued for retry: %r", chat_id, error)
+        return True
+
+    async def _still_relevant(self, row: dict) -> bool:
+        # Уведомление об истечении не нужно, если все его аренды уже закрыты
+        if not row["rental_ids"]:
+            return True
+        for rental_id in row["rental_ids"].split(","):
+            rental = await get_rental_by_id(int(rental_id))
+            if rental and int(rental.get("active", 0)) == 1:
+                return True
+        return False
+
+    async def _retry_outbox(self) -> None:
+        if self.dispatcher is None:
+            return
+        rows = await outbox_due(int(time.time()), limit=OUTBOX_BATCH)
+        if not rows:
+            return
+        delivered = []
+        sends = {}
+        for row in rows:
+            if not await self._still_relevant(row):
+                delivered.append(row["id"])
+                continue
+            markup = InlineKeyboardMarkup.model_validate_json(row["reply_markup"]) if row["reply_markup"] else None
+            sends[row["id"]] = self.dispatcher.submit(row["chat_id"], row["text"], row["priority"], reply_markup=markup)
+        by_id = {row["id"]: row for row in rows}
+        failed = []
+        now = time.time()
+        for outbox_id, result in zip(sends, await asyncio.gather(*sends.values(), return_exceptions=True)):
+            if not isinstance(result, BaseException):
+                delivered.append(outbox_id)
+                continue
+            attempts = int(by_id[outbox_id]["attempts"]) + 1
+            if attempts >= RETRY_MAX_ATTEMPTS or not is_retriable(result):
+                logger.error("Giving up on message %s to %s after %s attempts: %r", outbox_id, by_id[outbox_id]["chat_id"], attempts, result)
+                failed.append((outbox_id, None, repr(result)))
+            else:
+                failed.append((outbox_id, int(now + retry_delay(attempts)), repr(result)))
+        await finish_outbox_attempts(delivered, failed)
+        logger.info("Outbox retry: %s delivered or dropped, %s failed", len(delivered), len(failed))
 
     # --- Helper methods for testing ---
     async def send_daily_report_for_user(self, user_id: int) -> None:
@@ -126,7 +451,7 @@ class SchedulerService:
         rows = await get_active_rentals(user_id=user_id)
         text = format_daily_report(rows)
         try:
-            await self.bot.send_message(chat_id=user_id, text=text)
+            await self.dispatcher.send(user_id, text, PRIORITY_REPORT)
         except Exception as e:
             logger.exception("Failed to send on-demand daily report to %s: %s", user_id, e)
 
@@ -0,0 +1,139 @@
+"""Concurrent update handling with per-chat ordering and a bound on in-flight handlers."""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Chat, TelegramObject, User
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+STATS_LOG_INTERVAL = 60.0
+STATS_SAMPLES = 1000
+
+
+def _percentile(samples: Deque[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class UpdateGate(BaseMiddleware):
+    """Outer middleware on ``dp.update``.
+
+    aiogram already runs every update as its own task (polling and webhook
+    alike). This gate lets updates from different chats run side by side, but
+    makes updates from one chat wait for each other in arrival order, so FSM
+    steps of a user never interleave. At most ``limit`` handlers run at once;
+    the rest wait. Time spent waiting (chat lock + free slot) and time spent in
+    the handler are tracked separately.
+    """
+
+    def __init__(self, limit: int = UPDATE_CONCURRENCY) -> None:
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Hashable, int] = {}
+        self._in_flight = 0
+        self._waiting = 0
+        self._wait: Deque[float] = deque(maxlen=STATS_SAMPLES)
+        self._handle: Deque[float] = deque(maxlen=STATS_SAMPLES)
+        self._handled = 0
+        self._stats_since = time.monotonic()
+
+    @staticmethod
+    def _chat_key(data: Dict[str, Any]) -> Optional[Hashable]:
+        # event_chat / event_from_user выставляет встроенный UserContextMiddleware
+        chat: Optional[Chat] = data.get("event_chat")
+        user: Optional[User] = data.get("event_from_user")
+        if chat is not None:
+            return chat.id
+        return ("user", user.id) if user is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = self._chat_key(data)
+        arrived = time.monotonic()
+        lock = None
+        if key is not None:
+            lock = self._chat_locks.get(key)
+            if lock is None:
+                lock = self._chat_locks[key] = asyncio.Lock()
+            self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        self._waiting += 1
+        waiting = True
+        try:
+            if lock is not None:
+                # Lock пропускает ожидающих по порядку — апдейты чата идут в порядке прихода
+                await lock.acquire()
+            try:
+                async with self._slots:
+                    started = time.monotonic()
+                    self._waiting -= 1
+                    waiting = False
+                    self._in_flight += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self._in_flight -= 1
+                        self._record(started - arrived, time.monotonic() - started)
+            finally:
+                if lock is not None:
+                    lock.release()
+        finally:
+            if waiting:
+                self._waiting -= 1
+            if key is not None:
+                left = self._chat_waiters[key] - 1
+                if left:
+                    self._chat_waiters[key] = left
+                else:
+                    # Последний апдейт чата — замок больше не нужен
+                    del self._chat_waiters[key]
+                    del self._chat_locks[key]
+
+    def _record(self, wait: float, handle: float) -> None:
+        self._wait.append(wait)
+        self._handle.append(handle)
+        self._handled += 1
+        now = time.monotonic()
+        if now - self._stats_since >= STATS_LOG_INTERVAL:
+            logger.info("Updates: %s", self.stats())
+            self._handled = 0
+            self._stats_since = now
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since the last log line; wait/handler times over the last samples, in ms."""
+        return {
+            "handled": self._handled,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "limit": self.limit,
+            "wait_p50_ms": round(_percentile(self._wait, 0.5) * 1000, 1),
+            "wait_p95_ms": round(_percentile(self._wait, 0.95) * 1000, 1),
+            "handler_p50_ms": round(_percentile(self._handle, 0.5) * 1000, 1),
+            "handler_p95_ms": round(_percentile(self._handle, 0.95) * 1000, 1),
+        }
+
+
+def install_update_gate(dp: Dispatcher, limit: int = UPDATE_CONCURRENCY) -> UpdateGate:
+    """Register an UpdateGate on ``dp.update``, ahead of the FSM middleware."""
+    gate = UpdateGate(limit)
+    # FSMContextMiddleware (его регистрирует Dispatcher) читает raw_state; стоя
+    # перед гейтом, он читал бы его до замка чата, и апдейт из очереди видел бы
+    # состояние, которое предыдущий апдейт уже поменял. UserContextMiddleware,
+    # от которого зависит _chat_key, остаётся перед гейтом.
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(gate)
+    dp.update.outer_middleware(dp.fsm)
+    dp["update_gate"] = gate
+    return gate
@@ -50,6 +50,14 @@ def format_daily_report(rows: List[dict]) -> str:
     return "\n".join(lines)
 
 
+def format_expiration_digest(rows: List[dict]) -> str:
+    lines = [f"⏰ Закончилась аренда инструментов: {len(rows)}"]
+    for i, r in enumerate(rows, 1):
+        lines.append(f"{i}. {r['tool_name']} — {r['rent_price']}₽/сутки")
+    lines.append("Что хотите сделать? ✅ — продлить, ❌ — забрали инструмент")
+    return "\n".join(lines)
+
+
 def utc_now_ts() -> int:
     return int(datetime.now(tz=timezone.utc).timestamp())
 
@@ -104,26 +112,117 @@ def format_daily_report_with_revenue(date: str, rows: List[dict], revenue_sum: i
     return base + f"\n📅 Дата: {date}\n💵 Выручка за день: {revenue_sum}₽"
 
 
-def format_remaining_time(start_time_ts: int) -> str:
+def parse_hhmm(text: str) -> Optional[int]:
+    """"21:30" -> минута суток (1290); None, если формат неверный."""
+    try:
+        t = datetime.strptime(text.strip(), "%H:%M")
+    except ValueError:
+        return None
+    return t.hour * 60 + t.minute
+
+
+def format_hhmm(seconds_of_day: int) -> str:
+    return f"{seconds_of_day // 3600:02d}:{seconds_of_day % 3600 // 60:02d}"
+
+
+PERIOD_ALIASES = {
+    "week": "week", "неделя": "week",
+    "month": "month", "месяц": "month",
+    "year": "year", "год": "year",
+}
+
+
+def parse_date(text: str) -> Optional[str]:
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def period_bounds(period: str) -> Tuple[str, str]:
+    """Start of the current week/month/year and today, in the bot's TZ."""
+    from datetime import timedelta
+    today = datetime.now(tz=_tz()).date()
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+    elif period == "month":
+        start = today.replace(day=1)
+    else:
+        start = today.replace(month=1, day=1)
+    return start.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+
+
+def period_days(date_from: str, date_to: str) -> int:
+    start = datetime.strptime(date_from, "%Y-%m-%d")
+    end = datetime.strptime(date_to, "%Y-%m-%d")
+    return (end - start).days + 1
+
+
+def format_revenue_period_report(date_from: str, date_to: str, rows: List[dict], by_month: bool = False) -> str:
+    # Разбивка по дням (или месяцам для длинных периодов) и итог за период
+    lines = ["📊 Выручка по месяцам:" if by_month else "📊 Выручка по дням:"]
+    total = 0
+    count = 0
+    for r in rows:
+        amount = int(r["amount"] or 0)
+        total += amount
+        count += int(r["count"] or 0)
+        lines.append(f"- {r['period']} — {amount}₽ ({r['count']} шт.)")
+    if not rows:
+        lines.append("✅ Выручки за период нет.")
+    lines.append(f"\n📅 Период: {date_from} — {date_to}")
+    lines.append(f"🧾 Начислений: {count}")
+    lines.append(f"💵 Выручка за период: {total}₽")
+    return "\n".join(lines)
+
+
+def format_import_result(result) -> str:
+    text = (
+        f"✅ Импортировано позиций: {result.accepted}\n"
+        f"🆕 Новых: {result.inserted}\n"
+        f"✏️ Обновлено: {result.updated}\n"
+        f"➖ Без изменений: {result.unchanged}"
+    )
+    if result.rejected:
+        text += f"\n⚠️ Отклонено строк: {result.rejected}"
+    return text + f"\n⏱ {result.elapsed:.2f} с"
+
+
+def remaining_minutes(expires_at_ts: int) -> int:
+    """Whole minutes left until ``expires_at_ts``, rounded up; 0 once it has passed."""
     # Расчёт в POSIX-секундах, чтобы исключить любые эффекты TZ/DST
     import time
-    day_sec = 24 * 3600
     now_sec = int(time.time())
-    total_sec = (int(start_time_ts) + day_sec) - now_sec
+    total_sec = int(expires_at_ts) - now_sec
     if total_sec <= 0:
-        return "срок истёк"
+        return 0
     # ceil до минуты
-    minute = 60
-    total_sec = ((total_sec + minute - 1) // minute) * minute
-    hours = total_sec // 3600
-    minutes = (total_sec % 3600) // 60
-    return f"{hours:02d}:{minutes:02d}"
+    return (total_sec + 59) // 60
 
 
-def format_local_end_time_hhmm(start_time_ts: int) -> str:
-    from datetime import timedelta
-    tz = _tz()
-    end_dt = datetime.fromtimestamp(int(start_time_ts), tz=tz) + timedelta(hours=24)
+def format_minutes_left(minutes: int) -> str:
+    if minutes <= 0:
+        return "срок истёк"
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def format_remaining_time(expires_at_ts: int) -> str:
+    return format_minutes_left(remaining_minutes(expires_at_ts))
+
+
+def format_due_rentals(rows: List[dict], hours: int) -> str:
+    if not rows:
+        return f"✅ В ближайшие {hours} ч. ничего не истекает"
+    lines = [f"⏳ Истекают в ближайшие {hours} ч.: {len(rows)}"]
+    for i, r in enumerate(rows, 1):
+        left = format_remaining_time(int(r["expires_at"]))
+        end_hhmm = format_local_end_time_hhmm(int(r["expires_at"]))
+        lines.append(f"{i}. {r['tool_name']} — до {end_hhmm} ({left})")
+    return "\n".join(lines)
+
+
+def format_local_end_time_hhmm(expires_at_ts: int) -> str:
+    end_dt = datetime.fromtimestamp(int(expires_at_ts), tz=_tz())
     return end_dt.strftime("%H:%M")
 
 
@@ -0,0 +1,88 @@
+"""Webhook mode: an embedded aiohttp server instead of long polling."""
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from database import ping_db
+from message_edits import edit_stats
+
+logger = logging.getLogger(__name__)
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, scheduler, path: str, secret_token: str) -> web.Application:
+    """aiohttp app with the update endpoint at ``path`` and ``GET /healthz``.
+
+    Updates without the matching ``X-Telegram-Bot-Api-Secret-Token`` header
+    get 401. Dispatcher startup/shutdown (and with them the scheduler) follow
+    the app lifecycle.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+
+    async def healthz(request: web.Request) -> web.Response:
+        db_ok = await ping_db()
+        body = {
+            "status": "ok" if db_ok else "degraded",
+            "db": db_ok,
+            "instance": scheduler.elector.instance_id,
+            "leader": scheduler.elector.is_leader,
+            "outbound_queue": len(scheduler.dispatcher) if scheduler.dispatcher is not None else 0,
+            "edits": edit_stats(),
+        }
+        gate = dp.workflow_data.get("update_gate")
+        if gate is not None:
+            body["updates"] = gate.stats()
+        return web.json_response(body, status=200 if db_ok else 503)
+
+    app.router.add_get("/healthz", healthz)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    scheduler,
+    host: str,
+    port: int,
+    path: str,
+    secret_token: str,
+    public_url: Optional[str] = None,
+) -> None:
+    """Serve until SIGINT/SIGTERM; registers the webhook with Telegram only if ``public_url`` is set."""
+    app = build_webhook_app(dp, bot, scheduler, path, secret_token)
+
+    if public_url:
+        async def register_webhook(*_: object) -> None:
+            url = public_url.rstrip("/") + path
+            await bot.set_webhook(url, secret_token=secret_token, allowed_updates=dp.resolve_used_update_types())
+            logger.info("Webhook set to %s", url)
+
+        app.on_startup.append(register_webhook)
+    else:
+        # Без WEBHOOK_URL сервер работает локально: апдейты можно слать POST-ом (scripts/webhook_replay.py)
+        logger.info("WEBHOOK_URL is not set, not registering the webhook with Telegram")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(app)
+    # setup() вызывает on_startup: запускается диспетчер и планировщик
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook server listening on http://%s:%s%s", host, port, path)
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook server...")
+        # cleanup() вызывает on_shutdown: останавливается диспетчер и планировщик
+        await runner.cleanup()
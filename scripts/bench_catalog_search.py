@@ -0,0 +1,53 @@
+"""Lookup latency of the catalog search index against catalog size.
+
+Usage: python scripts/bench_catalog_search.py [sizes...]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from catalog_cache import CatalogCache  # noqa: E402
+
+KINDS = ["Перфоратор", "Шуруповёрт", "Болгарка", "Лазерный уровень", "Бетономешалка", "Отбойный молоток", "Пила"]
+BRANDS = ["Bosch", "Makita", "DeWalt", "Metabo", "Hilti", "Интерскол", "Зубр", "Ryobi"]
+QUERIES = ["перфоратор бош", "шуруповерт макита", "болг", "лазерный", "пила hilti 12", "отбойный молоток зубр 7"]
+
+
+def make_catalog(size: int) -> list[dict]:
+    rnd = random.Random(size)
+    return [
+        {"id": i, "name": f"{rnd.choice(KINDS)} {rnd.choice(BRANDS)} {i}", "price": rnd.randint(100, 3000)}
+        for i in range(1, size + 1)
+    ]
+
+
+def main() -> None:
+    sizes = [int(s) for s in sys.argv[1:]] or [1_000, 10_000, 50_000]
+    print(f"{'size':>8} {'load, s':>9} {'exact, µs':>10} {'search p50, ms':>15} {'search max, ms':>15}")
+    for size in sizes:
+        rows = make_catalog(size)
+        cache = CatalogCache()
+        started = time.perf_counter()
+        cache.load(rows)
+        load_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for row in rows[:1000]:
+            cache.find(row["name"].lower())
+        exact_us = (time.perf_counter() - started) / 1000 * 1e6
+
+        timings = []
+        for _ in range(5):
+            for query in QUERIES:
+                started = time.perf_counter()
+                cache.search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{size:>8} {load_s:>9.2f} {exact_us:>10.1f} {timings[len(timings) // 2]:>15.2f} {timings[-1]:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
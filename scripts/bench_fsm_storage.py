@@ -0,0 +1,93 @@
+"""FSM storage latency: MemoryStorage vs SQLiteStorage on the rental dialog.
+
+Every simulated user walks the RentalStates steps the way the handlers do
+(get_state + update_data + set_state per message, then clear). SQLiteStorage
+runs on a throwaway database in a temp directory, with a warm cache, right
+after a restart (empty cache) and with a cache too small to hold the users.
+Between steps the pending writes are flushed, as they would be in the
+seconds a user takes to answer.
+
+Usage: python scripts/bench_fsm_storage.py [users]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+import database  # noqa: E402
+from fsm_storage import SQLiteStorage  # noqa: E402
+
+STEPS = [
+    ("RentalStates:waiting_deposit", {"tool_name": "Перфоратор Bosch", "rent_price": 500}),
+    ("RentalStates:waiting_payment_method", {"deposit": 3000}),
+    ("RentalStates:waiting_delivery_type", {"payment_method": "card"}),
+    ("RentalStates:waiting_address", {"delivery_type": "delivery"}),
+    (None, {"address": "ул. Ленина, 1"}),
+]
+
+
+async def run_dialogs(storage, users: int) -> list[float]:
+    """Per-message latency in µs across all users, messages of different users interleaved."""
+    timings = []
+    for state, data in STEPS:
+        for user_id in range(users):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            started = time.perf_counter()
+            await storage.get_state(key)
+            await storage.update_data(key, data)
+            if state is None:
+                await storage.get_data(key)
+                await storage.set_state(key, None)
+                await storage.set_data(key, {})
+            else:
+                await storage.set_state(key, state)
+            timings.append((time.perf_counter() - started) * 1e6)
+        if isinstance(storage, SQLiteStorage):
+            await storage.flush()
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f"{name:<28} {p50:>10.1f} {p99:>10.1f} {timings[-1]:>10.1f}")
+
+
+async def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{users} users x {len(STEPS)} messages")
+    print(f"{'storage':<28} {'p50, µs':>10} {'p99, µs':>10} {'max, µs':>10}")
+    report("MemoryStorage", await run_dialogs(MemoryStorage(), users))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_DIR = Path(tmp)
+        database.DB_PATH = Path(tmp) / "rentals.db"
+        await database.init_db()
+        try:
+            storage = SQLiteStorage(cache_size=users * 2)
+            await run_dialogs(storage, users)
+            report("SQLiteStorage (warm cache)", await run_dialogs(storage, users))
+            await storage.close()
+
+            storage = SQLiteStorage(cache_size=users * 2)
+            report("SQLiteStorage (restart)", await run_dialogs(storage, users))
+            await storage.close()
+
+            storage = SQLiteStorage(cache_size=users // 10)
+            await run_dialogs(storage, users)
+            report("SQLiteStorage (cache 10%)", await run_dialogs(storage, users))
+            await storage.close()
+            print(f"cache 10%: hits {storage.hits}, misses {storage.misses}")
+        finally:
+            await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Render cost of a rental card: hand-built text vs the memoized renderer.
+
+"inline" repeats what the handlers used to do on every open/renew (two time
+conversions, string assembly and a fresh keyboard). "cold" is the renderer on
+rows it has not seen, "warm" is the same rows again within the same minute.
+With more cards than handlers.cards.CARD_CACHE_SIZE, "warm" degrades to "cold".
+
+Usage: python scripts/bench_rental_card.py [cards]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from handlers.cards import card_cache_info, render_rental_card  # noqa: E402
+from utils import format_local_end_time_hhmm, format_remaining_time  # noqa: E402
+
+
+def make_rows(count: int) -> list[dict]:
+    rnd = random.Random(count)
+    now = int(time.time())
+    return [
+        {
+            "id": i,
+            "tool_name": f"Перфоратор Bosch {i}",
+            "rent_price": rnd.randint(100, 3000),
+            "expires_at": now + rnd.randint(400, 86_400),
+            "deposit": rnd.choice([0, 1000, 3000]),
+            "payment_method": rnd.choice(["cash", "transfer"]),
+            "delivery_type": rnd.choice(["pickup", "delivery"]),
+            "address": "ул. Ленина, 1",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def render_inline(row: dict) -> tuple[str, InlineKeyboardMarkup]:
+    left = format_remaining_time(int(row["expires_at"]))
+    end_hhmm = format_local_end_time_hhmm(int(row["expires_at"]))
+    payment_text = "💵 Наличные" if row["payment_method"] == "cash" else "💳 Перевод"
+    delivery_text = "🚚 Доставка" if row["delivery_type"] == "delivery" else "🏠 Самовывоз"
+    text = (
+        f"🔧 <b>{row['tool_name']}</b> — {row['rent_price']}₽/сутки\n"
+        f"⏰ Осталось: {left} (до {end_hhmm})\n"
+        f"💰 Залог: {row['deposit']}₽\n"
+        f"{payment_text}\n"
+        f"{delivery_text}"
+    )
+    if row["delivery_type"] == "delivery" and row["address"]:
+        text += f"\n📍 Адрес: {row['address']}"
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Продлить на 24ч", callback_data=f"rental_renew:{row['id']}")],
+        [InlineKeyboardButton(text="🔒 Завершить сейчас", callback_data=f"rental_close:{row['id']}")],
+        [InlineKeyboardButton(text="↩️ К списку", callback_data="rentals_list")],
+    ])
+    return text, kb
+
+
+def measure(fn, rows: list[dict]) -> float:
+    """Average µs per card."""
+    started = time.perf_counter()
+    for row in rows:
+        fn(row)
+    return (time.perf_counter() - started) / len(rows) * 1e6
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rows = make_rows(count)
+    # Тексты должны совпадать с тем, что собирали хэндлеры
+    assert all(render_inline(r)[0] == render_rental_card(r)[0] for r in rows)
+
+    print(f"{count} cards, µs per card")
+    print(f"{'inline':>8} {measure(render_inline, rows):>8.2f}")
+    fresh = [dict(r, id=r["id"] + count) for r in rows]
+    print(f"{'cold':>8} {measure(render_rental_card, fresh):>8.2f}")
+    print(f"{'warm':>8} {measure(render_rental_card, rows):>8.2f}")
+    print(card_cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""POST recorded updates to the bot's webhook, optionally with a fake Bot API.
+
+Start the bot locally in webhook mode against the fake API:
+
+    BOT_MODE=webhook WEBHOOK_SECRET=dev TELEGRAM_API_URL=http://127.0.0.1:8081 python bot/main.py
+
+then replay updates (JSON lines or a JSON array of Update objects):
+
+    python scripts/webhook_replay.py scripts/updates_sample.jsonl --secret dev --fake-api 8081
+
+The fake API answers every method the way Telegram would closely enough for
+aiogram to parse it, and prints the calls the bot made. Nothing reaches Telegram.
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from aiohttp import ClientSession, web
+
+_MESSAGE_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup", "senddocument"}
+
+
+def load_updates(path: Path) -> List[Dict[str, Any]]:
+    text = path.read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def start_fake_api(port: int, calls: List[str]) -> web.AppRunner:
+    message_id = 0
+
+    async def handle(request: web.Request) -> web.Response:
+        nonlocal message_id
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        calls.append(f"{method} {json.dumps(params, ensure_ascii=False)[:200]}")
+        if method.lower() == "getme":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif method.lower() in _MESSAGE_METHODS:
+            message_id += 1
+            chat_id = int(params.get("chat_id", 0) or 0)
+            result = {
+                "message_id": int(params.get("message_id", message_id) or message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", type=Path, help="file with recorded updates")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET of the bot")
+    parser.add_argument("--fake-api", type=int, metavar="PORT", help="serve a fake Bot API on this port")
+    parser.add_argument("--wait", type=float, default=2.0, help="seconds to keep the fake API up after the last update")
+    args = parser.parse_args()
+
+    calls: List[str] = []
+    runner = await start_fake_api(args.fake_api, calls) if args.fake_api else None
+    try:
+        async with ClientSession() as session:
+            for update in load_updates(args.updates):
+                started = time.perf_counter()
+                async with session.post(
+                    args.url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": args.secret}
+                ) as resp:
+                    await resp.read()
+                    print(f"update {update.get('update_id')}: HTTP {resp.status} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        if runner is not None:
+            await asyncio.sleep(args.wait)
+            print(f"Bot API calls ({len(calls)}):")
+            for call in calls:
+                print("  " + call)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """database module pointed at a fresh SQLite file in ``tmp_path``."""
+    monkeypatch.setattr(database, "DB_DIR", tmp_path)
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "rentals.db")
+    monkeypatch.setattr(database, "_pool", None)
+    monkeypatch.setattr(database, "_external_change_listeners", [])
+    yield database
+    if database._pool is not None:
+        database._pool.close()
+
+
+@pytest.fixture
+def run(db):
+    """Run a coroutine function against an initialized database."""
+    def _run(scenario):
+        async def _main():
+            await db.init_db()
+            try:
+                return await scenario()
+            finally:
+                await db.close_db()
+        return asyncio.run(_main())
+    return _run
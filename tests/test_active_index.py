@@ -0,0 +1,72 @@
+def test_index_matches_database_after_each_write(db, run):
+    async def scenario():
+        first = await db.create_rental("Перфоратор", 500, user_id=1, charge_date="2026-01-01")
+        second = await db.create_rental("Болгарка", 300, user_id=1, deposit=1000)
+        await db.create_rental("Шуруповёрт", 200, user_id=2)
+        assert await db.verify_active_index() == []
+
+        await db.renew_and_charge_rental(int(first["id"]), charge_date="2026-01-02")
+        assert await db.verify_active_index() == []
+
+        await db.reset_rental_start_now(int(second["id"]))
+        assert await db.verify_active_index() == []
+
+        await db.close_rental(int(second["id"]))
+        assert await db.verify_active_index() == []
+        assert [r["id"] for r in await db.get_active_rentals(user_id=1)] == [first["id"]]
+
+        await db.reset_database()
+        assert await db.verify_active_index() == []
+        assert await db.get_active_rentals() == []
+
+    run(scenario)
+
+
+def test_diff_reports_corrupted_index(db, run):
+    async def scenario():
+        kept = await db.create_rental("Перфоратор", 500, user_id=1)
+        lost = await db.create_rental("Болгарка", 300, user_id=1)
+        db._active.put({**kept, "rent_price": 1})
+        db._active.remove(int(lost["id"]))
+        db._active.put({**lost, "id": 999})
+
+        problems = await db.verify_active_index()
+        assert any(p.startswith(f"rental {lost['id']}: missing from index") for p in problems)
+        assert any(p.startswith("rental 999: in index but not active") for p in problems)
+        assert any(p.startswith(f"rental {kept['id']}: index ") for p in problems)
+
+    run(scenario)
+
+
+def test_pages_follow_sorted_orders_through_writes():
+    import random
+
+    from active_index import SORT_KEYS, ActiveRentalIndex
+
+    rnd = random.Random(5)
+    index = ActiveRentalIndex()
+    index.load([
+        {"id": i, "user_id": 1, "active": 1, "expires_at": rnd.randint(0, 50)} for i in range(1, 40)
+    ])
+    for step in range(300):
+        rental_id = rnd.randint(1, 60)
+        if rnd.random() < 0.3:
+            index.remove(rental_id)
+        else:
+            index.put({"id": rental_id, "user_id": 1, "active": 1, "expires_at": rnd.randint(0, 50)})
+        assert index.diff(index.rows()) == []
+
+    for sort, key in SORT_KEYS.items():
+        expected = [r["id"] for r in sorted(index.rows(1), key=key)]
+        walked, cursor, has_next = [], None, True
+        while has_next:
+            rows, _, has_next = index.page(1, sort, cursor, "next", limit=7)
+            walked += [r["id"] for r in rows]
+            cursor = rows[-1]["id"]
+        assert walked == expected
+        # "prev" от первой строки последней страницы — предыдущие 7 строк
+        first = rows[0]["id"]
+        pos = expected.index(first)
+        rows, has_prev, _ = index.page(1, sort, first, "prev", limit=7)
+        assert [r["id"] for r in rows] == expected[max(0, pos - 7):max(0, pos - 7) + 7]
+        assert has_prev == (pos - 7 > 0)
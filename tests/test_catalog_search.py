@@ -0,0 +1,27 @@
+from catalog_search import CatalogSearchIndex
+
+
+def test_bitmaps_follow_catalog_size_not_ids():
+    index = CatalogSearchIndex()
+    index.load([(1_000_000, "Перфоратор Bosch"), (2_000_000, "Болгарка Makita")])
+    for item_id in range(3_000_000, 3_000_200):
+        index.add(item_id, f"Шуруповёрт {item_id}")
+        index.remove(item_id)
+    index.add(5_000_000, "Перфоратор Makita")
+
+    assert index._all.bit_length() <= 3
+    assert max(bitmap.bit_length() for bitmap in index._word_items.values()) <= 3
+    assert [item_id for item_id, _ in index.search("перфоратор")] == [1_000_000, 5_000_000]
+    assert index.search("makita")[0][0] in (2_000_000, 5_000_000)
+    assert index.search("шуруповерт") == []
+
+
+def test_removed_slot_is_reused():
+    index = CatalogSearchIndex()
+    index.load([(10, "Перфоратор"), (20, "Болгарка"), (30, "Лобзик")])
+    index.remove(20)
+    index.add(40, "Болгарка новая")
+
+    assert len(index._ids) == 3
+    assert [item_id for item_id, _ in index.search("болгарка")] == [40]
+    assert [item_id for item_id, _ in index.search("лобзик")] == [30]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+
+def test_closed_pool_is_not_reopened_implicitly(db, run):
+    async def scenario():
+        await db.create_rental("Перфоратор", 500, user_id=1)
+        await db.close_db()
+        db.DB_PATH.unlink()
+        # Запоздавший вызов (flush FSM, heartbeat) не должен пересоздать файл
+        with pytest.raises(RuntimeError):
+            await db.count_expirations()
+        assert not await db.ping_db()
+        assert not db.DB_PATH.exists()
+        await db.init_db()
+        assert await db.count_expirations() == 0
+
+    run(scenario)
+
+
+def test_reset_database_refuses_concurrent_calls(db, run):
+    async def scenario():
+        await db.create_rental("Перфоратор", 500, user_id=1)
+        results = []
+
+        async def reader():
+            for _ in range(200):
+                try:
+                    results.append(await db.count_expirations())
+                except RuntimeError:
+                    results.append("closed")
+                await asyncio.sleep(0)
+
+        await asyncio.gather(db.reset_database(), reader())
+        assert await db.get_active_rentals() == []
+        assert await db.verify_active_index() == []
+        assert set(results) <= {0, 1, "closed"}
+
+    run(scenario)
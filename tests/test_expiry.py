@@ -0,0 +1,234 @@
+import asyncio
+import sqlite3
+import time
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import scheduler
+from expiry import ExpiryEngine
+from outbound import OutboundDispatcher
+from scheduler import EXPIRY_WINDOW_SEC, SchedulerService
+
+
+def test_engine_fires_in_deadline_order_with_one_timer():
+    async def scenario():
+        fired = []
+
+        async def callback(key, payload):
+            fired.append((key, payload))
+
+        engine = ExpiryEngine(callback)
+        engine.start()
+        now = time.time()
+        engine.schedule(1, now + 0.15, "a")
+        engine.schedule(2, now + 0.05, "b")
+        engine.schedule(3, now + 0.10, "c")
+        engine.schedule(4, now + 0.02, "d")
+        engine.schedule(1, now + 0.03, "a2")  # перенос раньше — новая запись в куче
+        engine.cancel(4)
+
+        # Взведён один таймер, на ближайший дедлайн (отменённый ключ не считается)
+        assert engine._armed_for == now + 0.02
+        assert engine.next_deadline() == now + 0.03
+        assert sorted(k for k, _ in engine.due_before(now + 0.06)) == [1, 2]
+        assert len(engine) == 3
+
+        await asyncio.sleep(0.3)
+        engine.stop()
+        assert fired == [(1, "a2"), (2, "b"), (3, "c")]
+        assert len(engine) == 0 and engine._handle is None
+
+    asyncio.run(scenario())
+
+
+def test_engine_compacts_superseded_entries():
+    async def noop(key, payload):
+        pass
+
+    engine = ExpiryEngine(noop)
+    for i in range(200):
+        engine.schedule(1, 1000.0 + i)
+    assert len(engine) == 1
+    assert len(engine._heap) <= 64 + 2
+    assert engine.deadline(1) == 1199.0
+
+
+def _service() -> SchedulerService:
+    s = SchedulerService(ZoneInfo("UTC"))
+    s.bot = object()
+    return s
+
+
+def test_follower_leaves_deadlines_to_leader(db, run):
+    async def scenario():
+        follower = _service()
+        rental = await db.create_rental("Перфоратор", 500, user_id=1, duration_sec=600)
+        await follower.schedule_expiration_notification(
+            int(rental["id"]), int(rental["expires_at"]), 1, rental["tool_name"]
+        )
+        # У фолловера нет окна: таймер не заводится, и чужие записи он не подгружает
+        assert follower._loaded_until == 0.0
+        assert rental["id"] not in follower.expiry
+        follower._on_external_change()
+        assert follower._refill_task is None
+
+    run(scenario)
+
+
+def test_leader_window_and_foreign_writes(db, run):
+    async def scenario():
+        near = await db.create_rental("Перфоратор", 500, user_id=1, duration_sec=600)
+        far = await db.create_rental("Болгарка", 300, user_id=1, duration_sec=EXPIRY_WINDOW_SEC + 3600)
+        overdue = await db.create_rental("Лобзик", 200, user_id=2, duration_sec=-10)
+
+        leader = _service()
+        leader.elector.is_leader = True
+        leader.expiry.start()
+        try:
+            await leader._load_expirations()
+            assert abs(leader._loaded_until - (time.time() + EXPIRY_WINDOW_SEC)) < 5
+            assert near["id"] in leader.expiry and overdue["id"] in leader.expiry
+            assert far["id"] not in leader.expiry
+
+            # Просроченная аренда не отодвигается повторными загрузками
+            first = leader.expiry.deadline(overdue["id"])
+            await asyncio.sleep(0.01)
+            await leader._load_expirations()
+            assert leader.expiry.deadline(overdue["id"]) == first
+
+            # Внутри окна — таймер сразу, за окном — ждёт refill
+            await leader.schedule_expiration_notification(
+                int(far["id"]), int(far["expires_at"]), 1, far["tool_name"]
+            )
+            assert far["id"] not in leader.expiry
+            await leader.schedule_expiration_notification(int(near["id"]), time.time() + 120, 1, "Перфоратор")
+            assert leader.expiry.deadline(near["id"]) >= time.time() + 60
+
+            # Аренда, созданная другой репликой, подгружается при обнаружении её записи
+            conn = sqlite3.connect(db.DB_PATH)
+            now = int(time.time())
+            foreign_id = conn.execute(
+                "INSERT INTO rentals(tool_name, rent_price, start_time, expires_at, user_id) "
+                "VALUES ('Дрель', 100, ?, ?, 3) RETURNING id",
+                (now, now + 900),
+            ).fetchone()[0]
+            conn.commit()
+            conn.close()
+            assert await db.sync_external_changes()
+            await leader._refill_task
+            assert leader.expiry.deadline(foreign_id) == now + 900
+        finally:
+            leader.expiry.stop()
+
+    run(scenario)
+
+
+class _Bot:
+    """send_message hangs until ``release`` is set, then raises ``error`` if any."""
+
+    def __init__(self, error=None):
+        self.release = asyncio.Event()
+        self.error = error
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return text
+
+
+async def _notifier(bot) -> SchedulerService:
+    s = SchedulerService(ZoneInfo("UTC"))
+    s.bot = bot
+    s.dispatcher = OutboundDispatcher(bot)
+    s.dispatcher.start()
+    return s
+
+
+def test_notice_cancelled_in_flight_stays_pending(db, run):
+    async def scenario():
+        rental = await db.create_rental("Перфоратор", 500, user_id=1, duration_sec=-10)
+        bot = _Bot()
+        service = await _notifier(bot)
+        service._digest[1] = {int(rental["id"]): rental["tool_name"]}
+        flush = asyncio.create_task(service._flush_expirations(1))
+        while not bot.calls:
+            await asyncio.sleep(0.01)
+        # Выключение отменяет отправку: уведомление не теряется, а ждёт следующей загрузки
+        await service.dispatcher.stop(timeout=0)
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        assert [r["id"] for r in await db.expirations_due_before(int(time.time()))] == [rental["id"]]
+
+    run(scenario)
+
+
+def test_notice_marked_only_once_delivered_or_parked(db, run, monkeypatch):
+    async def scenario():
+        sent = await db.create_rental("Перфоратор", 500, user_id=1, duration_sec=-10)
+        bot = _Bot()
+        bot.release.set()
+        service = await _notifier(bot)
+        service._digest[1] = {int(sent["id"]): sent["tool_name"]}
+        await service._flush_expirations(1)
+        assert await db.expirations_due_before(int(time.time())) == []
+        await service.dispatcher.stop()
+
+        # Отправка не удалась, и outbox недоступен — аренда остаётся неуведомлённой
+        lost = await db.create_rental("Болгарка", 300, user_id=2, duration_sec=-10)
+        bot = _Bot(error=RuntimeError("network down"))
+        bot.release.set()
+        service = await _notifier(bot)
+
+        async def broken_outbox(*args, **kwargs):
+            raise RuntimeError("disk full")
+
+        add_outbox_message = scheduler.add_outbox_message
+        monkeypatch.setattr(scheduler, "add_outbox_message", broken_outbox)
+        service._digest[2] = {int(lost["id"]): lost["tool_name"]}
+        await service._flush_expirations(2)
+        assert [r["id"] for r in await db.expirations_due_before(int(time.time()))] == [lost["id"]]
+
+        # Сохранённое в outbox считается доставленным: его повторит outbox
+        monkeypatch.setattr(scheduler, "add_outbox_message", add_outbox_message)
+        service._digest[2] = {int(lost["id"]): lost["tool_name"]}
+        await service._flush_expirations(2)
+        assert await db.expirations_due_before(int(time.time())) == []
+        assert (await db.count_outbox())["pending"] == 1
+        await service.dispatcher.stop()
+
+    run(scenario)
+
+
+def test_daily_reports_park_dropped_sends_but_not_own_cancellation(db, run):
+    async def scenario():
+        for uid in (1, 2):
+            await db.create_rental("Перфоратор", 500, user_id=uid, duration_sec=3600)
+        date = time.strftime("%Y-%m-%d", time.gmtime())
+
+        # Отменили сам расчёт отчётов: отмена доходит до вызывающего, в outbox пусто
+        bot = _Bot()
+        service = await _notifier(bot)
+        reports = asyncio.create_task(service._send_reports(date))
+        while bot.calls < 2:
+            await asyncio.sleep(0.01)
+        reports.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reports
+        assert (await db.count_outbox())["pending"] == 0
+        await service.dispatcher.stop(timeout=0)
+
+        # Dispatcher остановили посреди рассылки: неотправленные отчёты уходят в outbox
+        bot = _Bot()
+        service = await _notifier(bot)
+        reports = asyncio.create_task(service._send_reports(date))
+        while bot.calls < 2:
+            await asyncio.sleep(0.01)
+        await service.dispatcher.stop(timeout=0)
+        await reports
+        assert (await db.count_outbox())["pending"] == 2
+
+    run(scenario)
@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def test_state_and_data_survive_restart(db, run):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=0.01)
+        assert await storage.get_state(KEY) is None and await storage.get_data(KEY) == {}
+        await storage.set_state(KEY, "RentalForm:tool")
+        await storage.set_data(KEY, {"tool": "Перфоратор"})
+        # Читаем из кэша ещё до записи в БД; get_data отдаёт копию
+        assert await storage.get_state(KEY) == "RentalForm:tool"
+        (await storage.get_data(KEY))["tool"] = "Болгарка"
+        assert await storage.get_data(KEY) == {"tool": "Перфоратор"}
+        await storage.close()
+
+        restarted = SQLiteStorage()
+        assert await restarted.get_state(KEY) == "RentalForm:tool"
+        assert await restarted.get_data(KEY) == {"tool": "Перфоратор"}
+        assert restarted.misses == 1 and restarted.hits == 1
+
+        # Пустая сессия не хранится
+        await restarted.set_state(KEY, None)
+        await restarted.set_data(KEY, {})
+        await restarted.close()
+        assert await db.get_fsm_record("42:1:1::default") is None
+
+    run(scenario)
+
+
+def test_external_write_drops_cache(db, run):
+    async def scenario():
+        storage = SQLiteStorage()
+        await storage.set_state(KEY, "RentalForm:tool")
+        await storage.flush()
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute("UPDATE fsm_state SET state = 'RentalForm:price'")
+        conn.commit()
+        conn.close()
+        assert await storage.get_state(KEY) == "RentalForm:tool"
+        assert await db.sync_external_changes()
+        assert await storage.get_state(KEY) == "RentalForm:price"
+        await storage.close()
+
+    run(scenario)
+
+
+def test_idle_session_expires_and_is_swept(db, run):
+    async def scenario():
+        storage = SQLiteStorage(ttl=3600)
+        idle = StorageKey(bot_id=42, chat_id=2, user_id=2)
+        long_ago = int(time.time()) - 7200
+        await storage.set_state(KEY, "RentalForm:tool")
+        await storage.set_state(idle, "EditTool:name")
+        await storage.flush()
+        await db.save_fsm_records([("42:2:2::default", "EditTool:name", "{}", long_ago)])
+        storage._cache["42:2:2::default"].updated_at = long_ago
+
+        await storage._sweep()
+        assert "42:2:2::default" not in storage._cache
+        assert await db.get_fsm_record("42:2:2::default") is None
+        assert (await db.get_fsm_record("42:1:1::default"))[0] == "RentalForm:tool"
+        assert await storage.get_state(KEY) == "RentalForm:tool"
+
+        # До sweep протухшая сессия уже читается как пустая
+        storage._cache["42:1:1::default"].updated_at = long_ago
+        assert await storage.get_state(KEY) is None
+        await storage.close()
+
+    run(scenario)
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from message_edits import MessageEditor
+
+
+class FakeMessage:
+    """Enough of aiogram's Message for MessageEditor; Telegram's clock is ``server``."""
+
+    def __init__(self, server, text="old", reply_markup=None, date=1000, edit_date=None):
+        self.server = server
+        self.chat = SimpleNamespace(id=1)
+        self.message_id = 7
+        self.text = self.html_text = text
+        self.reply_markup = reply_markup
+        self.date = datetime.fromtimestamp(date, tz=timezone.utc)
+        self.edit_date = edit_date
+        self.sent = []
+
+    def _edited(self, text, reply_markup):
+        self.server["now"] += 1
+        self.sent.append(text)
+        return FakeMessage(self.server, text, reply_markup, edit_date=self.server["now"])
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        return self._edited(text, reply_markup)
+
+    async def edit_reply_markup(self, reply_markup=None):
+        return self._edited(self.text, reply_markup)
+
+
+def _kb(label):
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=label, callback_data=label)]])
+
+
+def test_skips_repeats_using_telegram_timestamps_only(monkeypatch):
+    # Локальные часы сильно впереди Telegram: сравнивать с ними нельзя
+    monkeypatch.setattr("time.time", lambda: 10 ** 10)
+
+    async def scenario():
+        server = {"now": 2000}
+        editor = MessageEditor()
+        message = FakeMessage(server)
+        assert await editor.edit(message, "new", _kb("a"))
+        assert not await editor.edit(message, "new", _kb("a"))
+        assert editor.skipped == 1
+
+        # Другая реплика поменяла сообщение позже: callback.message несёт её edit_date
+        foreign = FakeMessage(server, text="foreign", reply_markup=_kb("a"), edit_date=server["now"] + 5)
+        assert await editor.edit(foreign, "new", _kb("a"))
+        assert foreign.sent == ["new"]
+
+        # Устаревший объект (старше нашей правки) не перебивает запись
+        stale = FakeMessage(server, text="old", edit_date=1500)
+        assert not await editor.edit(stale, "new", _kb("a"))
+        assert stale.sent == []
+
+    asyncio.run(scenario())
+
+
+def test_local_clock_behind_telegram_does_not_hide_our_edit(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 0)
+
+    async def scenario():
+        server = {"now": 2000}
+        editor = MessageEditor()
+        message = FakeMessage(server)
+        await editor.edit(message, "new", _kb("a"))
+        # callback.message после нашей правки: edit_date совпадает с ответом Telegram
+        echoed = FakeMessage(server, text="new", reply_markup=_kb("a"), edit_date=server["now"])
+        assert not await editor.edit(echoed, "new", _kb("a"))
+        assert await editor.edit(echoed, reply_markup=_kb("b"))
+        assert editor.calls == 2
+
+    asyncio.run(scenario())
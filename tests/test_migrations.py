@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+import pytest
+
+OLD_RENTALS = """
+CREATE TABLE rentals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, tool_name TEXT NOT NULL, rent_price INTEGER NOT NULL,
+    start_time INTEGER NOT NULL, user_id INTEGER NOT NULL, active INTEGER NOT NULL DEFAULT 1,
+    deposit INTEGER DEFAULT 0, payment_method TEXT DEFAULT 'cash', delivery_type TEXT DEFAULT 'pickup',
+    address TEXT DEFAULT ''
+)
+"""
+
+
+@pytest.mark.parametrize("interrupted", [False, True])
+def test_expires_at_migration_from_expirations_table(db, run, interrupted):
+    now = int(time.time())
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute(OLD_RENTALS)
+    if interrupted:
+        # Прошлый запуск успел добавить только первую колонку
+        conn.execute("ALTER TABLE rentals ADD COLUMN expires_at INTEGER")
+    conn.execute(
+        "CREATE TABLE expirations (rental_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+        "tool_name TEXT NOT NULL, run_at INTEGER NOT NULL)"
+    )
+    # 1 — уведомление уже отправлено (строки в expirations нет), 2 — ещё ждёт
+    conn.execute("INSERT INTO rentals(tool_name, rent_price, start_time, user_id) VALUES ('A', 100, ?, 1)", (now - 90000,))
+    conn.execute("INSERT INTO rentals(tool_name, rent_price, start_time, user_id) VALUES ('B', 100, ?, 1)", (now - 80000,))
+    conn.execute("INSERT INTO expirations VALUES (2, 1, 'B', ?)", (now - 80000 + 86400,))
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        rows = {r["id"]: r for r in await db.get_active_rentals(user_id=1)}
+        assert rows[1]["expires_at"] == now - 90000 + 86400
+        assert rows[1]["notified_expires_at"] == rows[1]["expires_at"]
+        assert rows[2]["expires_at"] == now - 80000 + 86400
+        assert rows[2]["notified_expires_at"] is None
+        assert [r["id"] for r in await db.expirations_due_before(now + 86400)] == [2]
+        tables = await db._read(lambda c: [r["name"] for r in c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")])
+        assert "expirations" not in tables
+
+    run(scenario)
+    # Повторный запуск ничего не ломает
+    run(scenario)
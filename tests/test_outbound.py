@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import outbound
+from outbound import PRIORITY_EXPIRATION, PRIORITY_REPORT, OutboundDispatcher
+
+
+class FakeBot:
+    """Records sends; raises RetryAfter while ``flood`` says so for the chat."""
+
+    def __init__(self, flood=lambda chat_id, text, calls: False, retry_after=1):
+        self.flood = flood
+        self.retry_after = retry_after
+        self.calls = []
+        self.release = None
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((chat_id, text, time.monotonic()))
+        if self.release is not None:
+            await self.release.wait()
+        if self.flood(chat_id, text, self.calls):
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood", self.retry_after)
+        return text
+
+
+def test_retry_after_requeues_in_place_and_pauses_everyone():
+    async def scenario():
+        bot = FakeBot(flood=lambda chat_id, text, calls: len(calls) == 1)
+        dispatcher = OutboundDispatcher(bot)
+        dispatcher.start()
+        first = dispatcher.submit(1, "report-1", PRIORITY_REPORT)
+        while not bot.calls:
+            await asyncio.sleep(0.01)
+        flooded_at = bot.calls[0][2]
+        await asyncio.sleep(0.05)
+        # Пока действует пауза, в очередь встают ещё сообщения
+        later = dispatcher.submit(1, "report-2", PRIORITY_REPORT)
+        urgent = dispatcher.submit(1, "expired", PRIORITY_EXPIRATION)
+        other_chat = dispatcher.submit(2, "report-3", PRIORITY_REPORT)
+        results = await asyncio.wait_for(asyncio.gather(first, later, urgent, other_chat), timeout=5)
+        await dispatcher.stop()
+
+        assert results == ["report-1", "report-2", "expired", "report-3"]
+        assert [text for _, text, _ in bot.calls] == ["report-1", "expired", "report-1", "report-2", "report-3"]
+        # Пауза глобальная: другой чат тоже ждал retry_after
+        assert all(at >= flooded_at + bot.retry_after for _, _, at in bot.calls[1:])
+        assert dispatcher.stats()["retried"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(outbound, "MAX_RETRY_AFTER_ATTEMPTS", 2)
+
+    async def scenario():
+        bot = FakeBot(flood=lambda chat_id, text, calls: chat_id == 1)
+        dispatcher = OutboundDispatcher(bot)
+        dispatcher.start()
+        flooded = dispatcher.submit(1, "report", PRIORITY_REPORT)
+        with pytest.raises(TelegramRetryAfter):
+            await asyncio.wait_for(flooded, timeout=5)
+        assert [text for _, text, _ in bot.calls] == ["report", "report"]
+        assert len(dispatcher) == 0
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_resolves_messages_in_flight_and_queued():
+    async def scenario():
+        bot = FakeBot()
+        bot.release = asyncio.Event()  # send_message висит, пока не отпустим
+        dispatcher = OutboundDispatcher(bot)
+        dispatcher.start()
+        in_flight = [dispatcher.submit(1, f"m{i}") for i in range(3)]
+        queued = dispatcher.submit(1, "m3")
+        while len(bot.calls) < 3:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(dispatcher.stop(timeout=0.1), timeout=5)
+
+        assert all(f.cancelled() for f in in_flight + [queued])
+        assert not dispatcher._sends and len(dispatcher) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+import asyncio
+import sqlite3
+import time
+
+
+def _foreign(db, *statements):
+    """Write through a separate connection, as another replica would."""
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        for sql, params in statements:
+            conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_foreign_writes_are_applied_without_full_reload(db, run, monkeypatch):
+    async def scenario():
+        kept = await db.create_rental("Перфоратор", 500, user_id=1)
+        closed = await db.create_rental("Болгарка", 300, user_id=1)
+        await db.upsert_tool("Лобзик", 200)
+        await db.upsert_tool("Дрель", 150)
+        assert not await db.sync_external_changes()
+
+        async def no_full_reload():
+            raise AssertionError("full reload")
+
+        monkeypatch.setattr(db, "_load_caches", no_full_reload)
+        calls = []
+        db.on_external_change(lambda: calls.append(1))
+        now = int(time.time())
+        _foreign(
+            db,
+            ("UPDATE rentals SET expires_at = expires_at + 3600 WHERE id = ?", (kept["id"],)),
+            ("UPDATE rentals SET active = 0 WHERE id = ?", (closed["id"],)),
+            ("INSERT INTO rentals(tool_name, rent_price, start_time, expires_at, user_id) VALUES ('Шлифмашина', 400, ?, ?, 2)",
+             (now, now + 86400)),
+            ("UPDATE tools SET price = 250 WHERE name = 'Лобзик'", ()),
+            ("DELETE FROM tools WHERE name = 'Дрель'", ()),
+            ("INSERT INTO tools(name, price) VALUES ('Миксер', 300)", ()),
+            ("UPDATE report_prefs SET report_minute = 600 WHERE user_id = 1", ()),
+            ("INSERT INTO report_prefs(user_id, report_minute) VALUES (2, 480)", ()),
+        )
+        assert await db.sync_external_changes()
+        assert calls == [1]
+        assert await db.verify_active_index() == []
+        assert (await db.get_rental_by_id(kept["id"]))["expires_at"] == kept["expires_at"] + 3600
+        assert [r["tool_name"] for r in await db.get_active_rentals(user_id=2)] == ["Шлифмашина"]
+        assert (await db.find_tool_by_name("Лобзик"))["price"] == 250
+        assert await db.find_tool_by_name("Дрель") is None
+        assert (await db.find_tool_by_name("Миксер"))["price"] == 300
+        assert await db.get_report_minute(1) == 600
+        assert await db.get_report_minute(2) == 480
+        assert not await db.sync_external_changes()
+
+        _foreign(db, ("DELETE FROM report_prefs WHERE user_id = 2", ()))
+        assert await db.sync_external_changes()
+        assert 2 not in db._reports
+
+    run(scenario)
+
+
+def test_pruned_journal_falls_back_to_full_reload(db, run):
+    async def scenario():
+        await db.create_rental("Перфоратор", 500, user_id=1)
+        _foreign(
+            db,
+            ("UPDATE rentals SET rent_price = 700", ()),
+            ("DELETE FROM change_log", ()),
+        )
+        assert await db.sync_external_changes()
+        assert [r["rent_price"] for r in await db.get_active_rentals(user_id=1)] == [700]
+        assert await db.verify_active_index() == []
+        assert db._change_seq == await db._read(db._last_change_seq)
+
+    run(scenario)
+
+
+def test_prune_change_log(db, run):
+    async def scenario():
+        await db.create_rental("Перфоратор", 500, user_id=1)
+        assert await db.prune_change_log(keep_sec=3600) == 0
+        assert await db.prune_change_log(keep_sec=-10) > 0
+
+    run(scenario)
+
+
+def test_sync_does_not_roll_back_a_concurrent_local_write(db, run, monkeypatch):
+    async def scenario():
+        rental = await db.create_rental("Перфоратор", 500, user_id=1)
+        read_changes = db._read_changes
+
+        def slow_read_changes(conn, since):
+            result = read_changes(conn, since)
+            time.sleep(0.2)  # локальная запись успевает завершиться, пока снимок в пути
+            return result
+
+        monkeypatch.setattr(db, "_read_changes", slow_read_changes)
+        _foreign(db, ("UPDATE rentals SET rent_price = 700 WHERE id = ?", (rental["id"],)))
+
+        async def local_close():
+            await asyncio.sleep(0.05)
+            await db.close_rental(rental["id"])
+
+        await asyncio.gather(db.sync_external_changes(), local_close())
+        assert await db.get_active_rentals(user_id=1) == []
+        assert await db.verify_active_index() == []
+
+    run(scenario)
+
+
+def test_heartbeat_renews_lease_when_sync_fails(db, run, monkeypatch):
+    async def scenario():
+        import leader
+
+        async def broken_sync():
+            raise sqlite3.OperationalError("database disk image is malformed")
+
+        monkeypatch.setattr(leader, "sync_external_changes", broken_sync)
+        events = []
+
+        async def elected():
+            events.append("elected")
+
+        async def revoked():
+            events.append("revoked")
+
+        elector = leader.LeaderElector(elected, revoked, ttl=30, instance_id="a")
+        await elector._heartbeat()
+        assert elector.is_leader and events == ["elected"]
+        renewed = elector._last_renewed
+        await elector._heartbeat()
+        assert elector.is_leader and elector._last_renewed > renewed
+
+    run(scenario)
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Chat, Message, Update, User
+
+from update_gate import install_update_gate
+
+
+def _update(update_id: int, text: str) -> Update:
+    user = User(id=1, is_bot=False, first_name="a")
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=user,
+        text=text,
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def test_queued_update_sees_state_set_by_previous_one():
+    async def scenario():
+        dp = Dispatcher()
+        router = Router()
+        seen = []
+
+        @router.message()
+        async def step(message: Message, state: FSMContext, raw_state):
+            seen.append((message.text, raw_state))
+            await asyncio.sleep(0.05)  # второй апдейт чата тем временем ждёт в гейте
+            await state.set_state(message.text)
+
+        dp.include_router(router)
+        gate = install_update_gate(dp)
+        assert list(dp.update.outer_middleware).index(gate) < list(dp.update.outer_middleware).index(dp.fsm)
+
+        bot = Bot("42:TEST")
+        try:
+            await asyncio.gather(dp.feed_update(bot, _update(1, "first")), dp.feed_update(bot, _update(2, "second")))
+        finally:
+            await bot.session.close()
+        assert seen == [("first", None), ("second", "first")]
+
+    asyncio.run(scenario())